@@ -0,0 +1,214 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import struct
+import zlib
+
+import numpy as np
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+
+RAW = 0
+ZLIB = 1
+LZ4 = 2
+ZSTD = 3
+DELTA_BITPACK = 4
+
+CODECS = {
+    'raw': RAW,
+    'zlib': ZLIB,
+    'lz4': LZ4,
+    'zstd': ZSTD,
+    'delta_bitpack': DELTA_BITPACK
+}
+
+
+def _encode_zlib(chunk):
+    return zlib.compress(chunk.tobytes(), 1)
+
+
+def _decode_zlib(data, dtype, size):
+    return np.frombuffer(zlib.decompress(data), dtype=dtype, count=size)
+
+
+def _encode_lz4(chunk):
+    return lz4.compress(chunk.tobytes())
+
+
+def _decode_lz4(data, dtype, size):
+    return np.frombuffer(lz4.decompress(data), dtype=dtype, count=size)
+
+
+def _encode_zstd(chunk):
+    return zstd.ZstdCompressor(level=1).compress(chunk.tobytes())
+
+
+def _decode_zstd(data, dtype, size):
+    return np.frombuffer(zstd.ZstdDecompressor().decompress(data), dtype=dtype, count=size)
+
+
+def _encode_delta_bitpack(chunk):
+    # the deltas are zigzag encoded to keep the negatives with few bits
+    deltas = np.diff(chunk.astype(np.int64), prepend=0)
+    zigzag = ((deltas << 1) ^ (deltas >> 63)).astype('<u8')
+    width = int(zigzag.max()).bit_length() if zigzag.size else 0
+
+    bits = np.unpackbits(zigzag.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    return bytes((width,)) + np.packbits(bits[:, :width], bitorder='little').tobytes()
+
+
+def _decode_delta_bitpack(data, dtype, size):
+    width = data[0]
+    bits = np.zeros((size, 64), dtype=np.uint8)
+
+    if width:
+        packed = np.frombuffer(data, dtype=np.uint8, offset=1)
+        bits[:, :width] = np.unpackbits(
+            packed, count=size * width, bitorder='little').reshape(size, width)
+
+    zigzag = np.packbits(bits, axis=1, bitorder='little').view('<u8').ravel()
+    deltas = ((zigzag >> np.uint64(1)) ^ -(zigzag & np.uint64(1))).view(np.int64)
+    return np.cumsum(deltas).astype(dtype)
+
+
+_ENCODERS = {
+    ZLIB: _encode_zlib,
+    LZ4: _encode_lz4,
+    ZSTD: _encode_zstd,
+    DELTA_BITPACK: _encode_delta_bitpack
+}
+
+_DECODERS = {
+    ZLIB: _decode_zlib,
+    LZ4: _decode_lz4,
+    ZSTD: _decode_zstd,
+    DELTA_BITPACK: _decode_delta_bitpack
+}
+
+
+class ChunkedArray(object):
+    _header = struct.Struct('<4s8sIIB')
+    _magic = b'MRCA'
+    _chunks_table_dtype = np.dtype([('codec', 'u1'), ('end', '<u8')])
+
+    def __init__(self, data):
+        magic, dtype, self.chunk_size, chunks, ndim = self._header.unpack_from(data)
+        if magic != self._magic:
+            raise ValueError('Invalid chunked array')
+
+        self.dtype = np.dtype(dtype.rstrip(b'\x00').decode())
+        offset = self._header.size
+        self.shape = struct.unpack_from('<{}Q'.format(ndim), data, offset)
+        offset += 8 * ndim
+
+        chunks_table = np.frombuffer(
+            data, dtype=self._chunks_table_dtype, count=chunks, offset=offset)
+        self._codecs = chunks_table['codec']
+        self._ends = chunks_table['end']
+        self._data = memoryview(data)[offset + chunks_table.nbytes:]
+
+    @classmethod
+    def is_chunked(cls, data):
+        return data[:len(cls._magic)] == cls._magic
+
+    @classmethod
+    def pack(cls, array, codec='zlib', chunk_size=65536):
+        codec = CODECS[codec]
+        if codec == LZ4 and lz4 is None or codec == ZSTD and zstd is None:
+            raise ValueError("The codec module isn't installed")
+
+        if codec == DELTA_BITPACK and array.dtype.kind not in 'iu':
+            raise ValueError('The delta bitpack codec only supports integer arrays')
+
+        flat_array = np.ascontiguousarray(array).ravel()
+        chunks_table = np.zeros(
+            -(-flat_array.size // chunk_size), dtype=cls._chunks_table_dtype)
+        chunks = []
+        end = 0
+
+        for i in range(chunks_table.size):
+            chunk = flat_array[i*chunk_size:(i+1)*chunk_size]
+            chunk_data = chunk.tobytes() if codec == RAW else _ENCODERS[codec](chunk)
+
+            # the chunks which don't shrink are stored without compression
+            if len(chunk_data) >= chunk.nbytes:
+                chunks_table[i]['codec'] = RAW
+                chunk_data = chunk.tobytes()
+            else:
+                chunks_table[i]['codec'] = codec
+
+            end += len(chunk_data)
+            chunks_table[i]['end'] = end
+            chunks.append(chunk_data)
+
+        header = cls._header.pack(
+            cls._magic, array.dtype.str.encode(), chunk_size,
+            chunks_table.size, array.ndim
+        )
+        shape = struct.pack('<{}Q'.format(array.ndim), *array.shape)
+        return b''.join([header, shape, chunks_table.tobytes()] + chunks)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    @property
+    def chunks(self):
+        return self._codecs.size
+
+    def get_chunk(self, i):
+        start = int(self._ends[i-1]) if i else 0
+        data = self._data[start:int(self._ends[i])]
+        size = min(self.chunk_size, self.size - i * self.chunk_size)
+        codec = self._codecs[i]
+
+        if codec == RAW:
+            return np.frombuffer(data, dtype=self.dtype, count=size)
+
+        return _DECODERS[codec](data, self.dtype, size)
+
+    def get_slice(self, start, stop):
+        start, stop, _ = slice(start, stop).indices(self.size)
+        array = np.empty(max(stop - start, 0), dtype=self.dtype)
+
+        # only the chunks which have values of the slice are decompressed
+        for i in range(start // self.chunk_size, -(-stop // self.chunk_size)):
+            chunk_start = i * self.chunk_size
+            chunk = self.get_chunk(i)
+            begin = max(start, chunk_start)
+            end = min(stop, chunk_start + chunk.size)
+            array[begin-start:end-start] = chunk[begin-chunk_start:end-chunk_start]
+
+        return array
+
+    def to_array(self):
+        return self.get_slice(0, self.size).reshape(self.shape)
@@ -22,11 +22,14 @@
 
 
 import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 
 from myreco.engine_objects.data_importer.model import \
     EngineObjectsDataImporterModelBase
-from myreco.utils import extend_swagger_json, get_items_model
+from myreco.exceptions import EngineError
+from myreco.utils import extend_swagger_json, get_items_model, run_coro
 
 
 class EngineObjectsExporterModelBase(EngineObjectsDataImporterModelBase):
@@ -34,6 +37,10 @@ class EngineObjectsExporterModelBase(EngineObjectsDataImporterModelBase):
         EngineObjectsDataImporterModelBase.__swagger_json__,
         __file__
     )
+    __export_workers__ = 4
+    __export_queue_key__ = 'engine_objects_export_queue'
+    __export_queue_timeout__ = 60*60
+    __exporter_jobs_id__ = 'engine_objects_exporter'
 
     @classmethod
     async def post_export_job(cls, req, session):
@@ -52,6 +59,21 @@ class EngineObjectsExporterModelBase(EngineObjectsDataImporterModelBase):
 
     @classmethod
     def _run_export_objects_job(cls, req, session, engine_object):
+        jobs_id = cls._get_jobs_id_exporter(engine_object)
+
+        # the objects exported by the queue aren't exported twice
+        if not run_coro(cls._enqueue_exports(session, [jobs_id]), session):
+            raise EngineError(
+                "The engine object '{}' is already being exported".format(engine_object.id))
+
+        try:
+            cls._set_export_state(jobs_id, session, 'running')
+            return cls._run_export_object(req, session, engine_object)
+        finally:
+            run_coro(cls._dequeue_exports(session, [jobs_id]), session)
+
+    @classmethod
+    def _run_export_object(cls, req, session, engine_object):
         import_data = req.query.get('import_data')
         items_model = cls._get_items_model(engine_object)
         engine_object = cls.get_engine_object_instance(engine_object)
@@ -75,3 +97,218 @@ class EngineObjectsExporterModelBase(EngineObjectsDataImporterModelBase):
 
         jobs_id = cls._get_jobs_id_exporter(engine_object)
         return await cls._get_job(jobs_id, req, session)
+
+    @classmethod
+    async def post_export_jobs(cls, req, session):
+        session = cls._copy_session(session)
+        ids = sorted(set(req.body))
+        engine_objects = await cls.get(session, [{'id': id_} for id_ in ids], todict=False)
+
+        if len(engine_objects) != len(ids):
+            return cls._build_response(404)
+
+        return cls._create_job(
+            cls._run_export_objects_jobs, cls.__exporter_jobs_id__, req, session, engine_objects)
+
+    @classmethod
+    def _run_export_objects_jobs(cls, req, session, engine_objects):
+        import_data = req.query.get('import_data')
+        scheduled = cls._schedule_engine_objects(engine_objects)
+        exports = run_coro(cls._enqueue_exports(session, sorted(scheduled)), session)
+
+        try:
+            return cls._run_exports(scheduled, exports, session, import_data)
+        finally:
+            # the objects which weren't finished by an error of the job are released too
+            run_coro(cls._dequeue_exports(session, exports), session)
+
+    @classmethod
+    def _run_exports(cls, scheduled, exports, session, import_data):
+        items_indices_maps_dicts = dict()
+        ret = {'done': {}, 'error': {}, 'skipped': sorted(set(scheduled).difference(exports))}
+
+        # the indices maps are loaded once for all the objects of the same items
+        for jobs_id in exports:
+            engine_object, items_model, _ = scheduled[jobs_id]
+            items_indices_map_dict = items_indices_maps_dicts.get(items_model.__key__)
+
+            if items_indices_map_dict is None:
+                items_indices_map_dict = run_coro(
+                    items_model.indices_map.get_shared_snapshot(session), session)
+                items_indices_maps_dicts[items_model.__key__] = items_indices_map_dict
+
+            engine_object.set_items_indices_map_dict(items_indices_map_dict)
+
+        groups = cls._group_exports(exports, scheduled, import_data)
+        workers = max(min(cls.__export_workers__, len(groups)), 1)
+
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(cls._run_exports_group, group, scheduled, session, import_data)
+                for group in groups
+            ]
+
+            for future in futures:
+                for jobs_id, status, result in future.result():
+                    ret[status][jobs_id] = result
+
+        return ret
+
+    @classmethod
+    def _schedule_engine_objects(cls, engine_objects):
+        scheduled = dict()
+
+        for engine_object in engine_objects:
+            items_model = cls._get_items_model(engine_object)
+            instance = cls.get_engine_object_instance(engine_object)
+            scheduled[cls._get_jobs_id_exporter(engine_object)] = (
+                instance, items_model, instance.get_input_key(items_model))
+
+        return scheduled
+
+    @classmethod
+    def _group_exports(cls, exports, scheduled, import_data):
+        if not import_data:
+            return [[jobs_id] for jobs_id in exports]
+
+        # the objects with the same input import their data once
+        groups = dict()
+        for jobs_id in exports:
+            groups.setdefault(scheduled[jobs_id][2], []).append(jobs_id)
+
+        return list(groups.values())
+
+    @classmethod
+    async def _enqueue_exports(cls, session, jobs_ids):
+        exports = []
+
+        # the objects locked by other jobs aren't exported twice
+        for jobs_id in jobs_ids:
+            locked = await session.redis_bind.set(
+                cls._build_export_lock_key(jobs_id), 1,
+                expire=cls.__export_queue_timeout__,
+                exist=session.redis_bind.SET_IF_NOT_EXIST
+            )
+            if locked:
+                exports.append(jobs_id)
+
+        if exports:
+            await session.redis_bind.hmset_dict(
+                cls.__export_queue_key__,
+                {jobs_id: cls._pack_obj(cls._build_export_state('queued')) for jobs_id in exports}
+            )
+
+        return exports
+
+    @classmethod
+    async def _dequeue_exports(cls, session, jobs_ids):
+        if not jobs_ids:
+            return
+
+        transaction = session.redis_bind.multi_exec()
+        transaction.hdel(cls.__export_queue_key__, *jobs_ids)
+        transaction.delete(*[cls._build_export_lock_key(jobs_id) for jobs_id in jobs_ids])
+        await transaction.execute()
+
+    @classmethod
+    def _build_export_lock_key(cls, jobs_id):
+        return '{}_{}_lock'.format(cls.__export_queue_key__, jobs_id)
+
+    @classmethod
+    def _is_export_pending(cls, export):
+        return export['status'] in ('queued', 'running') and \
+            time.time() - export['updated'] < cls.__export_queue_timeout__
+
+    @classmethod
+    def _build_export_state(cls, status, result=None):
+        state = {'status': status, 'updated': time.time()}
+        if result is not None:
+            state['result'] = result
+
+        return state
+
+    @classmethod
+    def _run_exports_group(cls, group, scheduled, session, import_data):
+        leader_id = group[0]
+        leader, items_model, _ = scheduled[leader_id]
+        results = []
+
+        if import_data:
+            try:
+                importer_result = leader.get_data(items_model, session)
+
+            except Exception as error:
+                cls._logger.exception('From import {}'.format(leader_id))
+                result = {'name': error.__class__.__name__, 'message': str(error)}
+
+                for jobs_id in group:
+                    cls._set_export_state(jobs_id, session, 'error', result)
+                    results.append((jobs_id, 'error', result))
+
+                return results
+
+        for jobs_id in group:
+            engine_object, items_model, _ = scheduled[jobs_id]
+            if engine_object is not leader:
+                engine_object.share_data_path(leader)
+
+            status, result = cls._run_scheduled_export(
+                jobs_id, engine_object, items_model, session)
+
+            if import_data and status == 'done':
+                result = {
+                    'importer': importer_result if engine_object is leader
+                    else {'shared_with': leader_id},
+                    'exporter': result
+                }
+
+            cls._set_export_state(jobs_id, session, status, result)
+            results.append((jobs_id, status, result))
+
+        return results
+
+    @classmethod
+    def _run_scheduled_export(cls, jobs_id, engine_object, items_model, session):
+        cls._set_export_state(jobs_id, session, 'running')
+
+        try:
+            result = engine_object.export(items_model, session)
+
+        except Exception as error:
+            cls._logger.exception('From export {}'.format(jobs_id))
+            return 'error', {'name': error.__class__.__name__, 'message': str(error)}
+
+        return 'done', result
+
+    @classmethod
+    def _set_export_state(cls, jobs_id, session, status, result=None):
+        run_coro(cls._set_export_state_coro(jobs_id, session, status, result), session)
+
+    @classmethod
+    async def _set_export_state_coro(cls, jobs_id, session, status, result):
+        # the finished objects are released, their results are kept on the job
+        if status in ('done', 'error'):
+            await cls._dequeue_exports(session, [jobs_id])
+        else:
+            state = cls._pack_obj(cls._build_export_state(status, result))
+            await session.redis_bind.hset(cls.__export_queue_key__, jobs_id, state)
+
+    @classmethod
+    async def get_export_jobs(cls, req, session):
+        return await cls._get_job(cls.__exporter_jobs_id__, req, session)
+
+    @classmethod
+    async def get_export_queue(cls, req, session):
+        queue = await session.redis_bind.hgetall(cls.__export_queue_key__)
+        if not queue:
+            return cls._build_response(404)
+
+        states = dict()
+        for jobs_id, state in queue.items():
+            state = cls._unpack_obj(state)
+            if cls._is_export_pending(state):
+                states.setdefault(state.pop('status'), dict())[jobs_id.decode()] = state
+            else:
+                states.setdefault('stale', dict())[jobs_id.decode()] = state
+
+        return cls._build_response(200, body=cls._pack_obj(states))
@@ -25,16 +25,35 @@ import asyncio
 import os.path
 import zlib
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from glob import glob
 from gzip import GzipFile
+from itertools import repeat
 
 import numpy as np
+from myreco.engine_objects.chunked_array import ChunkedArray
 from myreco.exceptions import EngineError
 from myreco.utils import build_engine_object_key, makedirs, run_coro
 from swaggerit.utils import set_logger
 
+import ujson
+
+
+def _build_partial_vector(object_class, engine_object, filenames, items_indices_map_dict):
+    engine_object = object_class(engine_object)
+
+    with ExitStack() as stack:
+        readers = [stack.enter_context(GzipFile(filename, 'r')) for filename in filenames]
+        return engine_object._build_partial_vector(readers, items_indices_map_dict)
+
 
 class EngineObjectBase(metaclass=ABCMeta):
+    __export_processes__ = 1
+    __export_reduction__ = 'sum'
+    __array_codec__ = 'zlib'
+    __array_chunk_size__ = 65536
+    _items_indices_map_dict = None
 
     def __init__(self, engine_object, data_path=None):
         self._engine_object = engine_object
@@ -50,6 +69,15 @@ class EngineObjectBase(metaclass=ABCMeta):
         self._data_path = os.path.join(data_path, self._redis_key)
         makedirs(self._data_path)
 
+    def share_data_path(self, engine_object):
+        self._data_path = engine_object._data_path
+
+    def get_input_key(self, items_model):
+        # the objects with the same input key can share the imported data
+        configuration = self._engine_object.get('configuration', {})
+        return (self._engine_object['type'], items_model.__key__,
+                ujson.dumps(configuration, sort_keys=True))
+
     def _pack_array(self, array, compress=True, level=-1):
         if compress:
             return zlib.compress(array.tobytes(), level)
@@ -65,30 +93,132 @@ class EngineObjectBase(metaclass=ABCMeta):
         else:
             return None
 
+    def _pack_chunked_array(self, array):
+        return ChunkedArray.pack(array, self.__array_codec__, self.__array_chunk_size__)
+
+    def _unpack_chunked_array(self, array, dtype):
+        if array is None:
+            return None
+
+        # the arrays stored before the chunked format are read without compression
+        if not ChunkedArray.is_chunked(array):
+            return np.frombuffer(array, dtype=dtype).copy()
+
+        return ChunkedArray(array).to_array()
+
     @abstractmethod
     def export(self, items_model, session):
         pass
 
-    def _build_csv_readers(self, pattern=''):
+    def _build_csv_readers(self, pattern='', filenames=None):
         readers = []
-        pattern = os.path.join(self._data_path, '{}*.gz'.format(pattern))
 
-        for filename in glob(pattern):
+        if filenames is None:
+            filenames = self._get_data_filenames(pattern)
+
+        for filename in filenames:
             file_ = GzipFile(filename, 'r')
             readers.append(file_)
 
         return readers
 
+    def _get_data_filenames(self, pattern=''):
+        # the files are sorted to keep the last write order of the partial vectors
+        return sorted(glob(os.path.join(self._data_path, '{}*.gz'.format(pattern))))
+
+    def _get_export_processes(self):
+        return self._engine_object.get('configuration', {}).get(
+            'export_processes', self.__export_processes__)
+
+    def _build_export_executor(self):
+        processes = self._get_export_processes()
+        return ProcessPoolExecutor(processes) if processes > 1 else None
+
+    def _build_files_vector(self, items_indices_map_dict, pattern='',
+                            filenames=None, executor=None):
+        processes = self._get_export_processes()
+
+        if processes > 1 and not self._has_partial_vector_builder():
+            raise EngineError(
+                "The engine object type '{}' can't be exported with more than one process"
+                .format(self.__class__.__name__))
+
+        if processes <= 1:
+            with ExitStack() as stack:
+                readers = [stack.enter_context(reader)
+                           for reader in self._build_csv_readers(pattern, filenames)]
+                return self._build_partial_vector(readers, items_indices_map_dict)
+
+        if filenames is None:
+            filenames = self._get_data_filenames(pattern)
+
+        processes = min(processes, len(filenames))
+        shards = [filenames[len(filenames)*i//processes:len(filenames)*(i+1)//processes]
+                  for i in range(processes)]
+        if not shards:
+            return None
+
+        if executor is None:
+            with ProcessPoolExecutor(processes) as executor:
+                return self._map_partial_vectors(executor, shards, items_indices_map_dict)
+
+        return self._map_partial_vectors(executor, shards, items_indices_map_dict)
+
+    def _map_partial_vectors(self, executor, shards, items_indices_map_dict):
+        # each process builds the vector of a contiguous shard of files
+        partial_vectors = list(executor.map(
+            _build_partial_vector, repeat(type(self)), repeat(self._engine_object),
+            shards, repeat(items_indices_map_dict)
+        ))
+
+        return self._reduce_partial_vectors(partial_vectors)
+
+    def _has_partial_vector_builder(self):
+        return type(self)._build_partial_vector is not EngineObjectBase._build_partial_vector
+
+    def _build_partial_vector(self, readers, items_indices_map_dict):
+        raise NotImplementedError()
+
+    def _reduce_partial_vectors(self, partial_vectors):
+        partial_vectors = [vector for vector in partial_vectors if vector is not None]
+        if not partial_vectors:
+            return None
+
+        vector = partial_vectors[0].copy()
+        for partial_vector in partial_vectors[1:]:
+            if self.__export_reduction__ == 'sum':
+                vector += partial_vector
+            else:
+                # the rows of the matrices are written whole
+                written = partial_vector != 0
+                if written.ndim > 1:
+                    written = written.any(axis=tuple(range(1, written.ndim)))
+
+                vector[written] = partial_vector[written]
+
+        return vector
+
+    def set_items_indices_map_dict(self, items_indices_map_dict):
+        self._items_indices_map_dict = items_indices_map_dict
+
     async def _get_items_indices_map_dict(self, items_indices_map, session):
-        items_indices_map_dict = await items_indices_map.get_all(session)
+        items_indices_map_dict = self._items_indices_map_dict
+        if items_indices_map_dict is None:
+            items_indices_map_dict = await items_indices_map.get_shared_snapshot(session)
 
-        if not items_indices_map_dict.values():
+        if not items_indices_map_dict.total_items:
             raise EngineError(
                 "The Indices Map for '{}' is empty. Please update these items"
                 .format(self._engine_object['item_type']['name']))
 
         return items_indices_map_dict
 
+    async def remap_indices(self, session, transaction, compaction):
+        return 0
+
+    async def publish_remapped_indices(self, session):
+        pass
+
     def _run_coro(self, coro, session):
         return run_coro(coro, session)
     
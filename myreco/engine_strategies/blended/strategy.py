@@ -0,0 +1,139 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import asyncio
+from copy import deepcopy
+
+import numpy as np
+from myreco.engine_strategies.neighborhood.strategy import NeighborhoodEngineStrategy
+from myreco.engine_strategies.strategy_base import EngineStrategyBase
+from myreco.engine_strategies.top_seller.strategy import TopSellerEngineStrategy
+from myreco.engine_strategies.visual_similarity.strategy import \
+    VisualSimilarityEngineStrategy
+
+
+_STRATEGIES = {
+    'top_seller_array': TopSellerEngineStrategy,
+    'neighborhood_matrix': NeighborhoodEngineStrategy,
+    'visual_similarity_index': VisualSimilarityEngineStrategy
+}
+
+
+def _build_object_schema(object_type, strategy_class):
+    schema = deepcopy(strategy_class.configuration_schema['properties'][object_type])
+    schema['properties']['weight'] = {'type': 'number'}
+    schema['properties']['normalization'] = {'enum': ['rank', 'min_max', 'z_score']}
+    return schema
+
+
+def _normalize_min_max(vector):
+    minimum = vector.min()
+    range_ = vector.max() - minimum
+    vector -= minimum
+    if range_:
+        vector /= range_
+
+
+def _normalize_z_score(vector):
+    vector -= vector.mean()
+    std = vector.std()
+    if std:
+        vector /= std
+
+    # the lowest score is shifted to zero, only the positive scores are recommended
+    vector -= vector.min()
+
+
+def _normalize_rank(vector):
+    # the items without score keep the zero score
+    scored = np.flatnonzero(vector)
+    order = np.argsort(-vector[scored], kind='mergesort')
+    vector[:] = 0
+    vector[scored[order]] = 1 - np.arange(scored.size, dtype=vector.dtype) / scored.size
+
+
+_NORMALIZERS = {
+    'min_max': _normalize_min_max,
+    'z_score': _normalize_z_score,
+    'rank': _normalize_rank
+}
+
+
+class BlendedEngineStrategy(EngineStrategyBase):
+    configuration_schema = {
+        'type': 'object',
+        'minProperties': 1,
+        'additionalProperties': False,
+        'properties': {
+            object_type: _build_object_schema(object_type, strategy_class)
+            for object_type, strategy_class in _STRATEGIES.items()
+        }
+    }
+    object_types = {
+        object_type: strategy_class.object_types[object_type]
+        for object_type, strategy_class in _STRATEGIES.items()
+    }
+
+    def __init__(self, engine, items_model=None):
+        super().__init__(engine, items_model)
+        self._strategies = [
+            (obj['type'], self._build_strategy(engine, obj['type'], items_model))
+            for obj in engine['objects']
+        ]
+
+    def _build_strategy(self, engine, object_type, items_model):
+        # the objects are shared, the subclasses can set their own object types
+        strategy = _STRATEGIES[object_type](dict(engine, objects=[]), items_model)
+        strategy.objects = {object_type: self.objects[object_type]}
+        strategy._config = {object_type: self._config[object_type]}
+        return strategy
+
+    def get_variables(self):
+        variables = dict()
+        for _, strategy in self._strategies:
+            for variable in strategy.get_variables():
+                variables.setdefault(variable['name'], variable)
+
+        return list(variables.values())
+
+    async def _build_items_vector(self, session, items_model, **external_variables):
+        vectors = await asyncio.gather(*[
+            strategy._build_items_vector(session, items_model, **external_variables)
+            for _, strategy in self._strategies
+        ])
+        vectors = [(object_type, vector) for (object_type, _), vector
+                   in zip(self._strategies, vectors) if vector is not None and vector.size]
+        if not vectors:
+            return None
+
+        # the vectors of older exports can be shorter, the missing items have no score
+        blended_vector = np.zeros(max(vector.size for _, vector in vectors), dtype=np.float32)
+
+        for object_type, vector in vectors:
+            config = self._config[object_type]
+            vector = vector.astype(np.float32)
+            _NORMALIZERS[config.get('normalization', 'min_max')](vector)
+            vector *= config.get('weight', 1.0)
+            blended_vector[:vector.size] += vector
+
+        return blended_vector
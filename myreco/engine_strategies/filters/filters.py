@@ -21,14 +21,50 @@
 # SOFTWARE.
 
 
-from collections import defaultdict
+from array import array
 from zlib import compress, decompress
 
 import numpy as np
 
 
+class FilterColumn(object):
+
+    def __init__(self):
+        self._codes_map = dict()
+        self.values = []
+        self.codes = array('i')
+        self.indices = array('i')
+
+    def __len__(self):
+        return len(self.indices)
+
+    def append(self, value, index):
+        code = self._codes_map.get(value)
+        if code is None:
+            code = self._codes_map[value] = len(self.values)
+            self.values.append(value)
+
+        self.codes.append(code)
+        self.indices.append(index)
+
+    def group(self):
+        if not len(self):
+            return
+
+        codes = np.frombuffer(self.codes, dtype=np.int32)
+        indices = np.frombuffer(self.indices, dtype=np.int32)
+        order = np.argsort(codes, kind='mergesort')
+        sorted_codes = codes[order]
+        bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+        starts = np.concatenate(([0], bounds))
+
+        for start, group in zip(starts, np.split(indices[order], bounds)):
+            yield self.values[sorted_codes[start]], group
+
+
 class FilterBaseBy(object):
     dtype = np.bool
+    sets_vector_values = False
 
     def __init__(self, items_model, name, is_inclusive=True, id_names=None, skip_values=None):
         self.key = items_model.__key__ + '_' + name + '_filter'
@@ -72,19 +108,80 @@ class FilterBaseBy(object):
     def _not_skip_value(self, value):
         return (self.skip_values is None or value not in self.skip_values)
 
+    async def get_selectivity(self, session, items_vector_size, ids):
+        return None
 
-class BooleanFilterBy(FilterBaseBy):
+    def _build_selectivity(self, items_quantity, items_vector_size):
+        selectivity = \
+            min(items_quantity, items_vector_size) / items_vector_size if items_vector_size else 0.0
+        return selectivity if self.is_inclusive else 1.0 - selectivity
+
+    def has_exact_selectivity(self, ids):
+        # the items counts of the values can overlap, only an inclusive zero is exact
+        return self.is_inclusive
+
+    def _get_item_values(self, item):
+        return (item.get(self.name),)
+
+    def append_item(self, column, item):
+        index = item.get('index')
+        if index is not None:
+            for value in self._get_item_values(item):
+                if value is not None and self._not_skip_value(value):
+                    column.append(value, index)
+
+    def build_column(self, items):
+        column = FilterColumn()
+        for item in items:
+            self.append_item(column, item)
+
+        return column
 
     async def update(self, session, items, array_size):
+        return await self.update_from_column(session, self.build_column(items), array_size)
+
+    async def remap(self, session, transaction, compaction):
+        return 0
+
+
+class BooleanFilterBy(FilterBaseBy):
+
+    def __init__(self, *args, **kwargs):
+        FilterBaseBy.__init__(self, *args, **kwargs)
+        self.count_key = self.key + ':count'
+
+    def has_exact_selectivity(self, ids):
+        return True
+
+    async def update_from_column(self, session, column, array_size):
         filter_ = self._build_empty_array(array_size)
 
-        for item in items:
-            value = item.get(self.name)
-            if value is not None and self._not_skip_value(value):
-                filter_[item['index']] = value
+        for value, indices in column.group():
+            filter_[indices] = value
 
+        return await self._set_filter(session, filter_)
+
+    async def _set_filter(self, session, filter_):
+        true_values = int(np.count_nonzero(filter_))
         await session.redis_bind.set(self.key, self._pack_filter(filter_))
-        return {'true_values': np.nonzero(filter_)[0].size}
+        await session.redis_bind.set(self.count_key, true_values)
+        return {'true_values': true_values}
+
+    async def exists(self, session):
+        return bool(await session.redis_bind.exists(self.key))
+
+    async def update_indices(self, session, true_indices, false_indices, array_size):
+        filter_ = await session.redis_bind.get(self.key)
+        filter_ = self._build_empty_array(array_size) if filter_ is None \
+            else self._unpack_filter(filter_, array_size)
+        filter_[true_indices] = True
+        filter_[false_indices] = False
+        return await self._set_filter(session, filter_)
+
+    async def get_selectivity(self, session, items_vector_size, *args, **kwargs):
+        true_values = await session.redis_bind.get(self.count_key)
+        if true_values is not None:
+            return self._build_selectivity(int(true_values), items_vector_size)
 
     async def filter(self, session, items_vector, *args, **kwargs):
         filter_ = await session.redis_bind.get(self.key)
@@ -92,14 +189,74 @@ class BooleanFilterBy(FilterBaseBy):
             filter_ = self._unpack_filter(filter_, items_vector.size)
             self._filter(filter_, items_vector)
 
+    async def remap(self, session, transaction, compaction):
+        old_filter = await session.redis_bind.get(self.key)
+        if old_filter is None:
+            return 0
+
+        filter_ = compaction.remap_vector(self._unpack_filter(old_filter))
+        true_values = int(np.count_nonzero(filter_))
+        filter_ = self._pack_filter(filter_)
+        transaction.set(self.key, filter_)
+        transaction.set(self.count_key, true_values)
+        return len(old_filter) - len(filter_)
+
 
 class MultipleFilterBy(FilterBaseBy):
+    _pipeline_max_bytes = 64 * 1024 * 1024
+    _old_versions_ttl = 60
+
+    def __init__(self, *args, **kwargs):
+        FilterBaseBy.__init__(self, *args, **kwargs)
+        self.version_key = self.key + ':version'
+        self._versions_counter_key = self.key + ':counter'
+
+    def _build_version_key(self, version):
+        return '{}:v{}'.format(self.key, version)
+
+    def _build_counts_key(self, version_key):
+        return version_key + ':counts'
+
+    async def get_version(self, session):
+        if not hasattr(self, '_version'):
+            version = await session.redis_bind.get(self.version_key)
+            self._version = None if version is None else int(version)
+
+        return self._version
+
+    async def _get_current_key(self, session):
+        version = await self.get_version(session)
+        return self.key if version is None else self._build_version_key(version)
+
+    async def _get_filters(self, session, ids):
+        key = await self._get_current_key(session)
+        return await session.redis_bind.hmget(key, *ids)
+
+    def _get_filter_ids(self, ids):
+        return self._list_cast(ids)
+
+    def has_exact_selectivity(self, ids):
+        return self.is_inclusive or len(self._get_filter_ids(ids)) == 1
+
+    async def get_selectivity(self, session, items_vector_size, ids):
+        ids = self._get_filter_ids(ids)
+        if not ids:
+            return 1.0
+
+        # filters published before the versioning don't have counts
+        if await self.get_version(session) is None:
+            return None
+
+        key = self._build_counts_key(await self._get_current_key(session))
+        counts = await session.redis_bind.hmget(key, *ids)
+        items_quantity = sum([int(count) for count in counts if count is not None])
+        return self._build_selectivity(items_quantity, items_vector_size)
 
     async def filter(self, session, items_vector, ids):
         ids = self._list_cast(ids)
 
         if ids:
-            filters = await session.redis_bind.hmget(self.key, *ids)
+            filters = await self._get_filters(session, ids)
             filters = [self._unpack_filter(filter_, items_vector.size)
                         for filter_ in filters if filter_ is not None]
             final_filter = np.zeros(items_vector.size, dtype=np.bool)
@@ -109,43 +266,90 @@ class MultipleFilterBy(FilterBaseBy):
 
             self._filter(final_filter, items_vector)
 
-    async def update(self, session, items, array_size):
-        filter_map = defaultdict(list)
-        set_data = dict()
-        size = array_size
+    async def update_from_column(self, session, column, array_size):
+        version = await session.redis_bind.incr(self._versions_counter_key)
+        key = self._build_version_key(version)
+        counts_key = self._build_counts_key(key)
+        pipeline = session.redis_bind.pipeline()
+        pipeline_bytes = 0
+        filters_quantity = 0
+
+        for filter_id, items_indices in column.group():
+            filter_ = self._pack_filter(self._build_filter_array(items_indices, array_size))
+            pipeline.hset(key, filter_id, filter_)
+            pipeline.hset(counts_key, filter_id, items_indices.size)
+            pipeline_bytes += len(filter_)
+            filters_quantity += 1
+
+            if pipeline_bytes >= self._pipeline_max_bytes:
+                await pipeline.execute()
+                pipeline = session.redis_bind.pipeline()
+                pipeline_bytes = 0
+
+        if pipeline_bytes:
+            await pipeline.execute()
+
+        await self._publish_version(session, version)
+        return {'filters_quantity': filters_quantity}
+
+    async def _publish_version(self, session, version):
+        old_version = await session.redis_bind.getset(self.version_key, version)
+
+        # readers which already got the old version still have some time to read it
+        if old_version is None:
+            await session.redis_bind.expire(self.key, self._old_versions_ttl)
+        else:
+            old_key = self._build_version_key(int(old_version))
+            await session.redis_bind.expire(old_key, self._old_versions_ttl)
+            await session.redis_bind.expire(
+                self._build_counts_key(old_key), self._old_versions_ttl)
 
-        [self._update_filter(filter_map, item) for item in items]
-        for filter_id, items_indices in filter_map.items():
-            filter_ = self._build_filter_array(items_indices, size)
-            set_data[filter_id] = self._pack_filter(filter_)
+    def _build_filter_array(self, items_indices, size):
+        filter_ = self._build_empty_array(size)
+        filter_[items_indices] = True
+        return filter_
 
-        if set_data:
-            await session.redis_bind.hmset_dict(self.key, set_data)
+    async def remap(self, session, transaction, compaction):
+        old_key = await self._get_current_key(session)
+        old_filters = await session.redis_bind.hgetall(old_key)
+        if not old_filters:
+            return 0
 
-        return {'filters_quantity': len(set_data)}
+        version = await session.redis_bind.incr(self._versions_counter_key)
+        key = self._build_version_key(version)
+        counts_key = self._build_counts_key(key)
+        reclaimed_bytes = 0
 
-    def _update_filter(self, filter_map, value, item):
-        index = item.get('index')
-        if value is not None and self._not_skip_value(value) and index is not None:
-            filter_map[value].append(index)
+        for filter_id, old_filter in old_filters.items():
+            filter_, items_quantity = \
+                self._remap_filter(self._unpack_filter(old_filter), compaction)
+            filter_ = self._pack_filter(filter_)
+            transaction.hset(key, filter_id, filter_)
+            transaction.hset(counts_key, filter_id, items_quantity)
+            reclaimed_bytes += len(old_filter) - len(filter_)
 
-    def _build_filter_array(self, items_indices, size):
-        filter_ = self._build_empty_array(size)
-        filter_[np.array(items_indices, dtype=np.int32)] = True
-        return filter_
+        # the new version is published with the remapped indices map
+        transaction.set(self.version_key, version)
+        transaction.expire(old_key, self._old_versions_ttl)
+        if old_key != self.key:
+            transaction.expire(self._build_counts_key(old_key), self._old_versions_ttl)
 
+        self._version = version
+        return reclaimed_bytes
 
-class SimpleFilterBy(MultipleFilterBy):
+    def _remap_filter(self, filter_, compaction):
+        filter_ = compaction.remap_vector(filter_)
+        return filter_, int(np.count_nonzero(filter_))
 
-    def _update_filter(self, filter_map, item):
-        MultipleFilterBy._update_filter(self, filter_map, item.get(self.name), item)
+
+class SimpleFilterBy(MultipleFilterBy):
+    pass
 
 
 class ObjectFilterBy(MultipleFilterBy):
 
-    def _update_filter(self, filter_map, item):
-        value = self._get_id_from_property(item)
-        MultipleFilterBy._update_filter(self, filter_map, value, item)
+    def _get_item_values(self, item):
+        return (self._get_id_from_property(item),)
 
     def _get_id_from_property(self, item):
         property_obj = item.get(self.name)
@@ -153,22 +357,26 @@ class ObjectFilterBy(MultipleFilterBy):
             ids = [property_obj[id_name] for id_name in self.id_names]
             return repr(tuple([id_ for _, id_ in sorted(zip(self.id_names, ids), key=lambda x: x[0])]))
 
-    async def filter(self, session, items_vector, properties):
+    def _get_filter_ids(self, properties):
         properties = self._list_cast(properties)
-        ids = [self._get_id_from_property({self.name: prop}) for prop in properties]
+        return [self._get_id_from_property({self.name: prop}) for prop in properties]
+
+    async def filter(self, session, items_vector, properties):
+        ids = self._get_filter_ids(properties)
         await MultipleFilterBy.filter(self, session, items_vector, ids)
 
 
 class ArrayFilterBy(SimpleFilterBy):
 
-    def _update_filter(self, filter_map, item):
-        property_list = item.get(self.name, [])
-        for value in property_list:
-            MultipleFilterBy._update_filter(self, filter_map, value, item)
+    def _get_item_values(self, item):
+        return item.get(self.name) or ()
 
 
 class SimpleFilterOf(SimpleFilterBy):
 
+    async def get_selectivity(self, *args, **kwargs):
+        return None
+
     async def filter(self, session, items_vector, items_keys):
         items = await self.items_model.get(session, items_keys)
         filter_ids = [item.get(self.name) for item in items]
@@ -177,6 +385,9 @@ class SimpleFilterOf(SimpleFilterBy):
 
 class ObjectFilterOf(ObjectFilterBy):
 
+    async def get_selectivity(self, *args, **kwargs):
+        return None
+
     async def filter(self, session, items_vector, items_keys):
         items = await self.items_model.get(session, items_keys)
         filter_ids = [item.get(self.name) for item in items]
@@ -185,6 +396,9 @@ class ObjectFilterOf(ObjectFilterBy):
 
 class ArrayFilterOf(ArrayFilterBy):
 
+    async def get_selectivity(self, *args, **kwargs):
+        return None
+
     async def filter(self, session, items_vector, items_keys):
         items = await self.items_model.get(session, items_keys)
         filter_ids = []
@@ -193,10 +407,21 @@ class ArrayFilterOf(ArrayFilterBy):
 
 
 class IndexFilterOf(FilterBaseBy):
+    sets_vector_values = True
 
     async def update(self, *args, **kwargs):
         return 'OK'
 
+    async def update_from_column(self, *args, **kwargs):
+        return 'OK'
+
+    async def get_selectivity(self, session, items_vector_size, items_keys):
+        items_keys = self._list_cast(items_keys)
+        if not items_keys:
+            return 1.0
+
+        return self._build_selectivity(len(items_keys), items_vector_size)
+
     async def filter(self, session, items_vector, items_keys):
         indices = await self.items_model.indices_map.get_indices(items_keys, session)
         if indices:
@@ -220,11 +445,18 @@ class IndexFilterByPropertyOf(SimpleFilterOf, IndexFilterOf):
     def _build_filter_array(self, items_indices, size):
         return np.array(items_indices, dtype=np.int32)
 
+    async def update(self, session, items, array_size):
+        return await FilterBaseBy.update(self, session, items, array_size)
+
+    def _remap_filter(self, filter_, compaction):
+        filter_ = compaction.remap_indices(filter_)
+        return filter_, int(filter_.size)
+
     async def filter(self, session, items_vector, items_keys):
         items = await self.items_model.get(session, items_keys)
         filter_ids = [item[self.name] for item in items]
         if filter_ids:
-            filters = await session.redis_bind.hmget(self.key, *filter_ids)
+            filters = await self._get_filters(session, filter_ids)
             filters = [self._unpack_filter(filter_) for filter_ in filters if filter_ is not None]
 
             if filters:
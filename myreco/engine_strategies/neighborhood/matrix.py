@@ -0,0 +1,214 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import numpy as np
+from myreco.engine_objects.object_base import EngineObjectBase
+from myreco.exceptions import EngineError
+from scipy import sparse
+
+import ujson
+
+
+class NeighborhoodMatrix(EngineObjectBase):
+    __logs_chunk_size__ = 100000
+    __max_neighbors__ = 100
+    __rows_chunk_size__ = 10000
+
+    def get_data(self, items_model, session):
+        # the logs are written on the data path by the stores, there is nothing to import
+        self._log_get_data_started()
+        files = len(self._get_data_filenames())
+        self._log_get_data_finished()
+        return {'files': files}
+
+    def export(self, items_model, session):
+        self._logger.info("Started export objects")
+
+        items_indices_map_dict = self._run_coro(
+            self._get_items_indices_map_dict(items_model.indices_map, session),
+            session
+        )
+
+        cooccurrences = self._build_files_vector(items_indices_map_dict)
+        if cooccurrences is None:
+            raise EngineError(
+                "No data found for engine object '{}'".format(self._engine_object['name']))
+
+        matrix = self._build_similarity_matrix(cooccurrences)
+        self._set_matrix(matrix, session)
+
+        self._logger.info("Finished export objects")
+        return {
+            'length': int(matrix.shape[0]),
+            'items_with_neighbors': int(np.count_nonzero(np.diff(matrix.indptr))),
+            'neighbors': int(matrix.nnz)
+        }
+
+    def _build_partial_vector(self, readers, items_indices_map_dict):
+        length = len(items_indices_map_dict)
+        cooccurrences = sparse.csr_matrix((length, length), dtype=np.float64)
+        has_baskets = False
+
+        for reader in readers:
+            for baskets, keys in self._read_baskets_chunks(reader):
+                indices = items_indices_map_dict.get_indices(keys)
+                found = indices != -1
+                if not found.any():
+                    continue
+
+                baskets_items = sparse.csr_matrix(
+                    (np.ones(int(found.sum())), (baskets[found], indices[found])),
+                    shape=(int(baskets[-1]) + 1, length)
+                )
+                # an item repeated in a basket is counted once
+                baskets_items.data[:] = 1
+                cooccurrences = cooccurrences + baskets_items.T.dot(baskets_items).tocsr()
+                has_baskets = True
+
+        return cooccurrences if has_baskets else None
+
+    def _read_baskets_chunks(self, reader):
+        chunk = []
+
+        for line in reader:
+            if line.strip():
+                chunk.append(line)
+
+            if len(chunk) == self.__logs_chunk_size__:
+                yield self._parse_baskets_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            yield self._parse_baskets_chunk(chunk)
+
+    def _parse_baskets_chunk(self, lines):
+        # all the lines of the chunk are parsed as one json array
+        if isinstance(lines[0], bytes):
+            baskets = ujson.loads(b'[' + b','.join(lines) + b']')
+        else:
+            baskets = ujson.loads('[' + ','.join(lines) + ']')
+
+        baskets = [basket['item_keys'] for basket in baskets]
+        sizes = np.fromiter((len(basket) for basket in baskets), dtype=np.int64, count=len(baskets))
+        keys = [key for basket in baskets for key in basket]
+        return np.repeat(np.arange(sizes.size), sizes), keys
+
+    def _build_similarity_matrix(self, cooccurrences):
+        cooccurrences = cooccurrences.tocoo()
+        counts = np.zeros(cooccurrences.shape[0])
+        diagonal = cooccurrences.row == cooccurrences.col
+        counts[cooccurrences.row[diagonal]] = cooccurrences.data[diagonal]
+
+        # the cosine similarity of the items baskets
+        rows = cooccurrences.row[~diagonal]
+        cols = cooccurrences.col[~diagonal]
+        data = cooccurrences.data[~diagonal] / np.sqrt(counts[rows] * counts[cols])
+
+        # only the top N neighbors of each row are kept
+        max_neighbors = self._engine_object.get('configuration', {}).get(
+            'max_neighbors', self.__max_neighbors__)
+        order = np.lexsort((-data, rows))
+        rows, cols, data = rows[order], cols[order], data[order]
+        rows_starts = np.searchsorted(rows, rows)
+        top = np.arange(rows.size) - rows_starts < max_neighbors
+
+        return sparse.csr_matrix(
+            (data[top].astype(np.float32), (rows[top], cols[top])),
+            shape=cooccurrences.shape
+        )
+
+    def _set_matrix(self, matrix, session):
+        tmp_key = self._redis_key + '_tmp'
+        self._run_coro(session.redis_bind.delete(tmp_key), session)
+        rows = np.flatnonzero(np.diff(matrix.indptr))
+
+        # the rows are written in chunks and the matrix is replaced at once
+        for i in range(0, rows.size, self.__rows_chunk_size__):
+            self._run_coro(
+                session.redis_bind.hmset_dict(tmp_key, {
+                    int(row): self._pack_row(
+                        matrix.indices[matrix.indptr[row]:matrix.indptr[row+1]],
+                        matrix.data[matrix.indptr[row]:matrix.indptr[row+1]]
+                    ) for row in rows[i:i+self.__rows_chunk_size__]
+                }),
+                session
+            )
+
+        if rows.size:
+            self._run_coro(session.redis_bind.rename(tmp_key, self._redis_key), session)
+        else:
+            self._run_coro(session.redis_bind.delete(self._redis_key), session)
+
+    def _pack_row(self, indices, data):
+        return indices.astype('<i4').tobytes() + data.astype('<f4').tobytes()
+
+    def _unpack_row(self, row):
+        size = len(row) // 8
+        return (np.frombuffer(row, dtype='<i4', count=size),
+                np.frombuffer(row, dtype='<f4', count=size, offset=size*4))
+
+    async def get_items_vector(self, session, indices, length):
+        vector = np.zeros(length, dtype=np.float32)
+        if not indices:
+            return vector
+
+        rows = [row for row in await session.redis_bind.hmget(self._redis_key, *indices)
+                if row is not None]
+        if rows:
+            rows = [self._unpack_row(row) for row in rows]
+            neighbors = np.concatenate([neighbors for neighbors, _ in rows])
+            similarities = np.concatenate([similarities for _, similarities in rows])
+            valid = neighbors < length
+            np.add.at(vector, neighbors[valid], similarities[valid])
+
+        # the context items aren't recommended
+        vector[[index for index in indices if index < length]] = 0
+        return vector
+
+    async def remap_indices(self, session, transaction, compaction):
+        old_rows = await session.redis_bind.hgetall(self._redis_key)
+        if not old_rows:
+            return 0
+
+        rows = dict()
+        for row, data in old_rows.items():
+            row = int(row)
+            if row >= compaction.old_length or compaction.new_indices[row] == -1:
+                continue
+
+            neighbors, similarities = self._unpack_row(data)
+            valid = neighbors < compaction.old_length
+            neighbors, similarities = neighbors[valid], similarities[valid]
+            neighbors = compaction.new_indices[neighbors]
+            kept = neighbors != -1
+
+            if kept.any():
+                rows[int(compaction.new_indices[row])] = \
+                    self._pack_row(neighbors[kept], similarities[kept])
+
+        transaction.delete(self._redis_key)
+        if rows:
+            transaction.hmset_dict(self._redis_key, rows)
+
+        return sum(len(data) for data in old_rows.values()) - \
+            sum(len(data) for data in rows.values())
@@ -0,0 +1,226 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import numpy as np
+from myreco.engine_objects.object_base import EngineObjectBase
+from myreco.exceptions import EngineError
+from scipy import sparse
+
+import ujson
+
+
+class UserAffinities(EngineObjectBase):
+    __events_chunk_size__ = 100000
+    __max_affinities__ = 200
+    __users_chunk_size__ = 10000
+
+    def get_data(self, items_model, session):
+        # the events are written on the data path by the stores, there is nothing to import
+        self._log_get_data_started()
+        files = len(self._get_data_filenames())
+        self._log_get_data_finished()
+        return {'files': files}
+
+    def export(self, items_model, session):
+        self._logger.info("Started export objects")
+
+        items_indices_map_dict = self._run_coro(
+            self._get_items_indices_map_dict(items_model.indices_map, session),
+            session
+        )
+
+        users_ids, affinities = self._prune_affinities(
+            self._build_files_vector(items_indices_map_dict))
+        if affinities is None:
+            raise EngineError(
+                "No data found for engine object '{}'".format(self._engine_object['name']))
+
+        users = self._set_affinities(users_ids, affinities, session)
+
+        self._logger.info("Finished export objects")
+        return {'users': users, 'affinities': int(affinities.nnz)}
+
+    def _build_partial_vector(self, readers, items_indices_map_dict):
+        users_rows = dict()
+        users_ids = []
+        rows, cols, data = [], [], []
+
+        for reader in readers:
+            for events_users_ids, keys, values in self._read_events_chunks(reader):
+                indices = items_indices_map_dict.get_indices(keys)
+                found = indices != -1
+                if not found.any():
+                    continue
+
+                events_rows = np.empty(len(events_users_ids), dtype=np.int64)
+                for i, user_id in enumerate(events_users_ids):
+                    row = users_rows.get(user_id)
+                    if row is None:
+                        row = users_rows[user_id] = len(users_ids)
+                        users_ids.append(user_id)
+
+                    events_rows[i] = row
+
+                rows.append(events_rows[found])
+                cols.append(indices[found])
+                data.append(values[found])
+
+        if not rows:
+            return None
+
+        # the events of the same user and item are summed
+        affinities = sparse.coo_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(len(users_ids), len(items_indices_map_dict))
+        ).tocsr()
+        return users_ids, affinities
+
+    def _reduce_partial_vectors(self, partial_vectors):
+        partial_vectors = [partial for partial in partial_vectors if partial is not None]
+        if not partial_vectors:
+            return None
+
+        users_rows = dict()
+        rows, cols, data = [], [], []
+
+        for users_ids, affinities in partial_vectors:
+            partial_rows = np.array(
+                [users_rows.setdefault(user_id, len(users_rows)) for user_id in users_ids],
+                dtype=np.int64
+            )
+            affinities = affinities.tocoo()
+            rows.append(partial_rows[affinities.row])
+            cols.append(affinities.col)
+            data.append(affinities.data)
+
+        affinities = sparse.coo_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(len(users_rows), partial_vectors[0][1].shape[1])
+        ).tocsr()
+        return list(users_rows), affinities
+
+    def _prune_affinities(self, partial_affinities):
+        if partial_affinities is None:
+            return [], None
+
+        users_ids, affinities = partial_affinities
+        affinities = affinities.tocoo()
+
+        # only the top N affinities of each user are kept
+        max_affinities = self._engine_object.get('configuration', {}).get(
+            'max_affinities', self.__max_affinities__)
+        rows, cols, data = affinities.row, affinities.col, affinities.data
+        order = np.lexsort((-data, rows))
+        rows, cols, data = rows[order], cols[order], data[order]
+        top = np.arange(rows.size) - np.searchsorted(rows, rows) < max_affinities
+
+        return users_ids, sparse.csr_matrix(
+            (data[top].astype(np.float32), (rows[top], cols[top])),
+            shape=affinities.shape
+        )
+
+    def _read_events_chunks(self, reader):
+        chunk = []
+
+        for line in reader:
+            if line.strip():
+                chunk.append(line)
+
+            if len(chunk) == self.__events_chunk_size__:
+                yield self._parse_events_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            yield self._parse_events_chunk(chunk)
+
+    def _parse_events_chunk(self, lines):
+        # all the lines of the chunk are parsed as one json array
+        if isinstance(lines[0], bytes):
+            events = ujson.loads(b'[' + b','.join(lines) + b']')
+        else:
+            events = ujson.loads('[' + ','.join(lines) + ']')
+
+        users_ids = [str(event['user_id']) for event in events]
+        keys = [event['item_key'] for event in events]
+        values = np.fromiter(
+            (event.get('value', 1) for event in events), dtype=np.float64, count=len(events))
+        return users_ids, keys, values
+
+    def _set_affinities(self, users_ids, affinities, session):
+        tmp_key = self._redis_key + '_tmp'
+        self._run_coro(session.redis_bind.delete(tmp_key), session)
+        rows = np.flatnonzero(np.diff(affinities.indptr))
+
+        # the users are written in chunks and the affinities are replaced at once
+        for i in range(0, rows.size, self.__users_chunk_size__):
+            self._run_coro(
+                session.redis_bind.hmset_dict(tmp_key, {
+                    users_ids[row]: self._pack_affinities(
+                        affinities.indices[affinities.indptr[row]:affinities.indptr[row+1]],
+                        affinities.data[affinities.indptr[row]:affinities.indptr[row+1]]
+                    ) for row in rows[i:i+self.__users_chunk_size__]
+                }),
+                session
+            )
+
+        if rows.size:
+            self._run_coro(session.redis_bind.rename(tmp_key, self._redis_key), session)
+        else:
+            self._run_coro(session.redis_bind.delete(self._redis_key), session)
+
+        return int(rows.size)
+
+    def _pack_affinities(self, indices, weights):
+        return indices.astype('<i4').tobytes() + weights.astype('<f4').tobytes()
+
+    def _unpack_affinities(self, affinities):
+        size = len(affinities) // 8
+        return (np.frombuffer(affinities, dtype='<i4', count=size),
+                np.frombuffer(affinities, dtype='<f4', count=size, offset=size*4))
+
+    async def get_affinities(self, session, user_id):
+        affinities = await session.redis_bind.hget(self._redis_key, user_id)
+        return None if affinities is None else self._unpack_affinities(affinities)
+
+    async def remap_indices(self, session, transaction, compaction):
+        old_affinities = await session.redis_bind.hgetall(self._redis_key)
+        if not old_affinities:
+            return 0
+
+        users_affinities = dict()
+        for user_id, affinities in old_affinities.items():
+            indices, weights = self._unpack_affinities(affinities)
+            valid = indices < compaction.old_length
+            indices = compaction.new_indices[indices[valid]]
+            kept = indices != -1
+
+            if kept.any():
+                users_affinities[user_id] = \
+                    self._pack_affinities(indices[kept], weights[valid][kept])
+
+        transaction.delete(self._redis_key)
+        if users_affinities:
+            transaction.hmset_dict(self._redis_key, users_affinities)
+
+        return sum(len(affinities) for affinities in old_affinities.values()) - \
+            sum(len(affinities) for affinities in users_affinities.values())
@@ -0,0 +1,93 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import asyncio
+
+import numpy as np
+from myreco.engine_strategies.personalized.affinities import UserAffinities
+from myreco.engine_strategies.strategy_base import EngineStrategyBase
+from myreco.engine_strategies.top_seller.array import TopSellerArray
+from myreco.engine_strategies.top_seller.strategy import TopSellerEngineStrategy
+
+
+class PersonalizedEngineStrategy(EngineStrategyBase):
+    configuration_schema = {
+        'type': 'object',
+        'required': ['user_affinities'],
+        'additionalProperties': False,
+        'properties': {
+            'user_affinities': {
+                'type': 'object',
+                'additionalProperties': False,
+                'properties': {
+                    'max_affinities': {'type': 'integer', 'minimum': 1},
+                    'weight': {'type': 'number'}
+                }
+            },
+            'top_seller_array':
+                TopSellerEngineStrategy.configuration_schema['properties']['top_seller_array']
+        }
+    }
+    object_types = {
+        'user_affinities': UserAffinities,
+        'top_seller_array': TopSellerArray
+    }
+
+    def get_variables(self):
+        return [{'name': 'user_id', 'schema': {'type': 'string'}}]
+
+    async def _build_items_vector(self, session, items_model, user_id=None,
+                                  **external_variables):
+        base_vector, affinities = await asyncio.gather(
+            self._get_base_vector(session),
+            self._get_affinities(session, user_id)
+        )
+
+        if base_vector is None:
+            if affinities is None:
+                return None
+
+            length = await items_model.indices_map.get_length(session)
+            base_vector = np.zeros(length or 0, dtype=np.float32)
+
+        # only the items of the user profile are changed on the shared base vector
+        if affinities is not None:
+            indices, weights = affinities
+            valid = indices < base_vector.size
+            weight = self._config['user_affinities'].get('weight', 1.0)
+            np.add.at(base_vector, indices[valid], weights[valid] * weight)
+
+        return base_vector
+
+    async def _get_base_vector(self, session):
+        base_object = self.objects.get('top_seller_array')
+        if base_object is None:
+            return None
+
+        return await base_object.get_numpy_array(session, np.float32)
+
+    async def _get_affinities(self, session, user_id):
+        if user_id is None:
+            return None
+
+        return await self.objects['user_affinities'].get_affinities(session, user_id)
@@ -21,6 +21,7 @@
 # SOFTWARE.
 
 
+import asyncio
 from abc import ABCMeta, abstractmethod
 
 from jsonschema import Draft4Validator
@@ -74,13 +75,36 @@ class EngineStrategyBase(metaclass=EngineStrategyMetaBase):
         items_vector = await self._build_items_vector(session, items_model, **external_variables)
 
         if items_vector is not None:
-            for filter_, ids in filters.items():
+            filters = await self._sort_filters_by_selectivity(session, filters, items_vector.size)
+
+            for filter_, ids, selectivity in filters:
+                # an empty vector can't give recommendations, the fallbacks will be used
+                if selectivity == 0.0 and filter_.has_exact_selectivity(ids):
+                    return []
+
                 await filter_.filter(session, items_vector, ids)
 
+                if not items_vector.any():
+                    return []
+
             return await self._build_rec_list(session, items_vector, max_items, show_details)
 
         return []
 
+    async def _sort_filters_by_selectivity(self, session, filters, items_vector_size):
+        filters = list(filters.items())
+        selectivities = await asyncio.gather(*[
+            filter_.get_selectivity(session, items_vector_size, ids) for filter_, ids in filters
+        ])
+        filters = [(filter_, ids, selectivity)
+            for (filter_, ids), selectivity in zip(filters, selectivities)]
+
+        # filters which sets the vector values must be applied before the masks,
+        # and filters without statistics are applied after the known ones
+        return sorted(filters, key=lambda f: (
+            not f[0].sets_vector_values, f[2] is None, f[2] or 0.0
+        ))
+
     @abstractmethod
     async def _build_items_vector(self, session, **external_variables):
         pass
@@ -21,6 +21,10 @@
 # SOFTWARE.
 
 
+import os.path
+from datetime import date, datetime, timedelta
+from glob import glob
+
 import numpy as np
 from myreco.engine_objects.object_base import EngineObjectBase
 from myreco.exceptions import EngineError
@@ -29,65 +33,238 @@ import ujson
 
 
 class TopSellerArray(EngineObjectBase):
+    __sales_chunk_size__ = 100000
+    __date_format__ = '%Y-%m-%d'
+    _arrays = dict()
+
+    @property
+    def _version_key(self):
+        return self._redis_key + '_version'
 
     def export(self, items_model, session):
         self._logger.info("Started export objects")
 
-        readers = self._build_csv_readers()
-
         items_indices_map_dict = self._run_coro(
             self._get_items_indices_map_dict(items_model.indices_map, session),
             session
         )
 
-        ret = self.update(readers, session, items_indices_map_dict)
-
-        self._logger.info("Finished export objects")
-        return ret
-
-    def update(self, readers, session, items_indices_map_dict):
-        self._build_top_seller_vector(readers, session, items_indices_map_dict)
+        vector = self._build_window_vector(items_indices_map_dict)
+        if vector is None:
+            raise EngineError(
+                "No data found for engine object '{}'".format(self._engine_object['name']))
 
+        self.numpy_array = vector
         self._run_coro(
             session.redis_bind.set(
                 self._redis_key,
-                self._pack_array(self.numpy_array, compress=False)
+                self._pack_chunked_array(self.numpy_array)
             ),
             session
         )
+        self._run_coro(session.redis_bind.incr(self._version_key), session)
 
+        self._logger.info("Finished export objects")
         return {
             'length': int(self.numpy_array.size),
             'max_sells': int(max(self.numpy_array)),
             'min_sells': int(min(self.numpy_array))
         }
 
-    def _build_top_seller_vector(self, readers, session, items_indices_map_dict):
-        error_message = "No data found for engine object '{}'".format(self._engine_object['name'])
-        if not len(readers):
-            raise EngineError(error_message)
+    def _build_window_vector(self, items_indices_map_dict):
+        configuration = self._engine_object.get('configuration', {})
+        half_life = configuration.get('decay_half_life')
+        today = self._get_today()
+        vector = np.zeros(
+            len(items_indices_map_dict), dtype=np.int32 if half_life is None else np.float64)
+        days_interval = configuration.get('days_interval', 1)
+        has_sales = False
+        executor = self._build_export_executor()
+
+        try:
+            # the files without a date prefix are counted as sales of the current day
+            days_sales = self._iter_days_sales(today, days_interval, executor)
+
+            for age, sales in days_sales:
+                if sales is None:
+                    continue
+
+                keys, values = sales
+                indices = items_indices_map_dict.get_indices(keys)
+                found = indices != -1
+
+                if found.any():
+                    values = values[found]
+                    if half_life is not None:
+                        values = values * 0.5 ** (age / half_life)
+
+                    np.add.at(vector, indices[found], values.astype(vector.dtype))
+                    has_sales = True
+
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self._remove_old_days_sales(today, days_interval)
+
+        if not has_sales:
+            return None
+
+        return np.rint(vector).astype(np.int32) if half_life is not None else vector
+
+    def _iter_days_sales(self, today, days_interval, executor):
+        yield 0, self._build_files_vector(
+            None, filenames=self._get_undated_filenames(), executor=executor)
+
+        for age in range(days_interval):
+            day = (today - timedelta(days=age)).strftime(self.__date_format__)
+            yield age, self._get_day_sales(day, age > 0, executor)
+
+    def _get_today(self):
+        return date.today()
+
+    def _get_undated_filenames(self):
+        date_length = len(self._get_today().strftime(self.__date_format__))
+        filenames = []
+
+        for filename in self._get_data_filenames():
+            try:
+                datetime.strptime(os.path.basename(filename)[:date_length], self.__date_format__)
+            except ValueError:
+                filenames.append(filename)
+
+        return filenames
+
+    def _get_day_sales(self, day, is_complete_day, executor=None):
+        aggregate_filename = os.path.join(self._data_path, 'aggregates', day + '.npz')
+        filenames = self._get_data_filenames(day)
+
+        # the aggregate is built again when some file of the day was changed after it
+        if os.path.exists(aggregate_filename):
+            aggregate_mtime = os.path.getmtime(aggregate_filename)
+            if all(os.path.getmtime(filename) <= aggregate_mtime for filename in filenames):
+                with np.load(aggregate_filename) as aggregate:
+                    return aggregate['keys'], aggregate['values']
+
+        if not filenames:
+            return None
 
-        indices_values_map = dict()
+        sales = self._build_files_vector(None, filenames=filenames, executor=executor)
+        if sales is None:
+            return None
+
+        # the current day is aggregated again on each export, it can have new files
+        if is_complete_day:
+            self._save_day_sales(aggregate_filename, *sales)
+
+        return sales
+
+    def _save_day_sales(self, filename, keys, values):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+
+        with open(tmp_filename, 'wb') as file_:
+            np.savez(file_, keys=keys, values=values)
+
+        os.replace(tmp_filename, filename)
+
+    def _remove_old_days_sales(self, today, days_interval):
+        first_day = today - timedelta(days=days_interval - 1)
+        aggregates_path = os.path.join(self._data_path, 'aggregates')
+
+        for filename in glob(os.path.join(aggregates_path, '*.npz')):
+            try:
+                day = datetime.strptime(
+                    os.path.basename(filename)[:-len('.npz')], self.__date_format__).date()
+            except ValueError:
+                continue
+
+            if day < first_day:
+                os.remove(filename)
+
+    def _build_partial_vector(self, readers, items_indices_map_dict):
+        # the sales are kept by item key, the items can be mapped after they were sold
+        keys, values = [], []
 
         for reader in readers:
-            self._set_indices_values_map(indices_values_map, items_indices_map_dict, reader)
+            for chunk_keys, chunk_values in self._read_sales_chunks(reader):
+                keys.extend(chunk_keys)
+                values.append(chunk_values)
 
-        if not indices_values_map:
-            raise EngineError(error_message)
+        if not keys:
+            return None
 
-        vector = np.zeros(len(items_indices_map_dict), dtype=np.int32)
-        indices = np.array(list(indices_values_map.keys()), dtype=np.int32)
-        vector[indices] = np.array(list(indices_values_map.values()), dtype=np.int32)
-        self.numpy_array = vector
+        keys = np.array([key.encode() if isinstance(key, str) else key for key in keys],
+                        dtype=bytes)
+        return self._sum_sales(keys, np.concatenate(values))
+
+    def _reduce_partial_vectors(self, partial_vectors):
+        partial_vectors = [sales for sales in partial_vectors if sales is not None]
+        if not partial_vectors:
+            return None
+
+        return self._sum_sales(
+            np.concatenate([keys for keys, _ in partial_vectors]),
+            np.concatenate([values for _, values in partial_vectors])
+        )
+
+    def _sum_sales(self, keys, values):
+        keys, inverse = np.unique(keys, return_inverse=True)
+        sums = np.zeros(keys.size, dtype=np.int64)
+        np.add.at(sums, inverse, values)
+        return keys, sums
+
+    def _read_sales_chunks(self, reader):
+        chunk = []
 
-    def _set_indices_values_map(self, indices_values_map, items_indices_map_dict, reader):
         for line in reader:
-            line = ujson.loads(line)
-            index = items_indices_map_dict.get(line['item_key'])
-            if index is not None:
-                indices_values_map[index] = int(line['value'])
+            if line.strip():
+                chunk.append(line)
+
+            if len(chunk) == self.__sales_chunk_size__:
+                yield self._parse_sales_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            yield self._parse_sales_chunk(chunk)
+
+    def _parse_sales_chunk(self, lines):
+        # all the lines of the chunk are parsed as one json array
+        if isinstance(lines[0], bytes):
+            sales = ujson.loads(b'[' + b','.join(lines) + b']')
+        else:
+            sales = ujson.loads('[' + ','.join(lines) + ']')
+
+        keys = [sale['item_key'] for sale in sales]
+        values = np.fromiter(
+            (int(sale['value']) for sale in sales), dtype=np.int32, count=len(sales))
+        return keys, values
+
+    async def get_numpy_array(self, session, dtype=np.int32):
+        # the whole vector is filtered and ranked, so it is decompressed once by version
+        version = await session.redis_bind.get(self._version_key)
+        cached = self._arrays.get(self._redis_key)
+
+        if version is not None and cached is not None and cached[0] == version:
+            return cached[1].astype(dtype)
 
-    async def get_numpy_array(self, session):
         items_vector = await session.redis_bind.get(self._redis_key)
-        if items_vector is not None:
-            return self._unpack_array(items_vector, np.int32, compress=False)
+        numpy_array = self._unpack_chunked_array(items_vector, np.int32)
+
+        if version is not None and numpy_array is not None:
+            numpy_array.setflags(write=False)
+            self._arrays[self._redis_key] = (version, numpy_array)
+            return numpy_array.astype(dtype)
+
+        return None if numpy_array is None else numpy_array.astype(dtype, copy=False)
+
+    async def remap_indices(self, session, transaction, compaction):
+        old_vector = await session.redis_bind.get(self._redis_key)
+        if old_vector is None:
+            return 0
+
+        vector = compaction.remap_vector(self._unpack_chunked_array(old_vector, np.int32))
+        vector = self._pack_chunked_array(vector)
+        transaction.set(self._redis_key, vector)
+        transaction.incr(self._version_key)
+        return len(old_vector) - len(vector)
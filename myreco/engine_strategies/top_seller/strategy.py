@@ -36,7 +36,13 @@ class TopSellerEngineStrategy(EngineStrategyBase):
                 'required': ['days_interval'],
                 'additionalProperties': False,
                 'properties': {
-                    'days_interval': {'type': 'integer'}
+                    'days_interval': {'type': 'integer'},
+                    'export_processes': {'type': 'integer', 'minimum': 1},
+                    'decay_half_life': {
+                        'type': 'number',
+                        'minimum': 0,
+                        'exclusiveMinimum': True
+                    }
                 }
             }
         }
@@ -0,0 +1,339 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os.path
+import shutil
+from glob import glob
+
+import numpy as np
+from myreco.engine_objects.object_base import EngineObjectBase
+from myreco.exceptions import EngineError
+from scipy import sparse
+
+import ujson
+
+
+class IVFIndex(object):
+    _arrays = ('centroids', 'lists_offsets', 'items_indices', 'vectors', 'positions')
+
+    def __init__(self, centroids, lists_offsets, items_indices,
+                 vectors, positions, version=None):
+        self.centroids = centroids
+        self.lists_offsets = lists_offsets
+        self.items_indices = items_indices
+        self.vectors = vectors
+        self.positions = positions
+        self.version = version
+
+    @classmethod
+    def build(cls, embeddings, lists, train_size, iterations, random_state=0):
+        norms = np.linalg.norm(embeddings, axis=1)
+        items_indices = np.flatnonzero(norms)
+        if not items_indices.size:
+            return None
+
+        vectors = embeddings[items_indices] / norms[items_indices, None]
+        centroids = cls._train_centroids(
+            vectors, min(lists, items_indices.size), train_size, iterations, random_state)
+        assignments = cls._assign(vectors, centroids)
+
+        # the vectors of each list are contiguous, a probe reads only one slice
+        order = np.argsort(assignments, kind='mergesort')
+        lists_offsets = np.searchsorted(
+            assignments[order], np.arange(centroids.shape[0] + 1)).astype(np.int64)
+        items_indices = items_indices[order].astype(np.int32)
+        positions = np.full(embeddings.shape[0], -1, dtype=np.int64)
+        positions[items_indices] = np.arange(items_indices.size)
+
+        return cls(centroids, lists_offsets, items_indices,
+                   vectors[order].astype(np.float32), positions)
+
+    @classmethod
+    def _train_centroids(cls, vectors, lists, train_size, iterations, random_state):
+        random_state = np.random.RandomState(random_state)
+        sample = vectors[random_state.choice(
+            vectors.shape[0], min(vectors.shape[0], train_size), replace=False)]
+        centroids = sample[random_state.choice(sample.shape[0], lists, replace=False)]
+
+        # spherical k-means, the centroids are the normalized sums of their vectors
+        for _ in range(iterations):
+            assignments = np.argmax(sample.dot(centroids.T), axis=1)
+            members = sparse.csr_matrix(
+                (np.ones(sample.shape[0], dtype=np.float32),
+                 (assignments, np.arange(sample.shape[0]))),
+                shape=(lists, sample.shape[0])
+            )
+            sums = np.asarray(members.dot(sample))
+            norms = np.linalg.norm(sums, axis=1)
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled, None]
+
+        return centroids.astype(np.float32)
+
+    @classmethod
+    def _assign(cls, vectors, centroids, batch_size=65536):
+        return np.concatenate([
+            np.argmax(vectors[i:i+batch_size].dot(centroids.T), axis=1)
+            for i in range(0, vectors.shape[0], batch_size)
+        ])
+
+    def remap(self, compaction):
+        items_indices = np.asarray(self.items_indices, dtype=np.int64)
+        new_items_indices = np.full(items_indices.size, -1, dtype=np.int64)
+        valid = items_indices < compaction.old_length
+        new_items_indices[valid] = compaction.new_indices[items_indices[valid]]
+        kept = new_items_indices != -1
+
+        # the removed items are dropped from their lists, the lists keep contiguous
+        kept_counts = np.concatenate(([0], np.cumsum(kept)))
+        items_indices = new_items_indices[kept].astype(np.int32)
+        positions = np.full(compaction.new_length, -1, dtype=np.int64)
+        positions[items_indices] = np.arange(items_indices.size)
+
+        return type(self)(np.asarray(self.centroids), kept_counts[self.lists_offsets],
+                          items_indices, np.asarray(self.vectors)[kept], positions)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self._arrays)
+
+    def save(self, path):
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        os.makedirs(tmp_path, exist_ok=True)
+
+        for name in self._arrays:
+            np.save(os.path.join(tmp_path, name + '.npy'), getattr(self, name))
+
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, version=None):
+        return cls(*[np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                     for name in cls._arrays], version=version)
+
+    def get_scores(self, seeds_indices, probes):
+        scores = np.zeros(self.positions.size, dtype=np.float32)
+        seeds_indices = np.array(seeds_indices, dtype=np.int64)
+        seeds_indices = seeds_indices[
+            (seeds_indices >= 0) & (seeds_indices < self.positions.size)]
+        positions = self.positions[seeds_indices]
+        positions = positions[positions != -1]
+        if not positions.size:
+            return scores
+
+        query = self.vectors[positions].sum(axis=0)
+        query /= np.linalg.norm(query) or 1
+
+        # only the vectors of the nearest lists are compared to the seeds
+        lists = np.argsort(-self.centroids.dot(query))[:probes]
+        for list_ in lists:
+            start, end = self.lists_offsets[list_], self.lists_offsets[list_+1]
+            scores[self.items_indices[start:end]] = self.vectors[start:end].dot(query)
+
+        scores[seeds_indices] = 0
+        return scores
+
+
+class VisualSimilarityIndex(EngineObjectBase):
+    __embeddings_chunk_size__ = 10000
+    __lists__ = 1024
+    __probes__ = 8
+    __train_size__ = 100000
+    __train_iterations__ = 10
+    _indices = dict()
+    _remapped_index_path = None
+
+    def get_data(self, items_model, session):
+        # the embeddings are written on the data path by the stores, there is nothing to import
+        self._log_get_data_started()
+        files = len(self._get_data_filenames())
+        self._log_get_data_finished()
+        return {'files': files}
+
+    def export(self, items_model, session):
+        self._logger.info("Started export objects")
+
+        items_indices_map_dict = self._run_coro(
+            self._get_items_indices_map_dict(items_model.indices_map, session),
+            session
+        )
+
+        rows = self._build_files_vector(items_indices_map_dict)
+        index = None if rows is None else IVFIndex.build(
+            self._build_embeddings(len(items_indices_map_dict), *rows),
+            self._get_config('lists', self.__lists__),
+            self.__train_size__,
+            self.__train_iterations__
+        )
+        if index is None:
+            raise EngineError(
+                "No data found for engine object '{}'".format(self._engine_object['name']))
+
+        version = self._run_coro(session.redis_bind.incr(self._redis_key + '_version'), session)
+        index_path = self._build_index_path(self._data_path, version)
+        index.save(index_path)
+        self._run_coro(session.redis_bind.set(self._redis_key, version), session)
+        self._remove_old_indices(index_path)
+
+        self._logger.info("Finished export objects")
+        return {
+            'length': int(index.positions.size),
+            'items': int(index.items_indices.size),
+            'lists': int(index.centroids.shape[0]),
+            'dimension': int(index.vectors.shape[1])
+        }
+
+    def _get_config(self, name, default):
+        return self._engine_object.get('configuration', {}).get(name, default)
+
+    def _build_index_path(self, data_path, version):
+        return os.path.join(data_path, 'ivf_v{}'.format(version))
+
+    def _remove_old_indices(self, index_path):
+        # mapped files keep valid for the processes which still use them
+        for path in glob(self._build_index_path(self._data_path, '*')):
+            if path != index_path:
+                shutil.rmtree(path, ignore_errors=True)
+
+    async def remap_indices(self, session, transaction, compaction):
+        data_path = getattr(self, '_data_path', None)
+        version = await session.redis_bind.get(self._redis_key)
+        if data_path is None or version is None:
+            return 0
+
+        index_path = self._build_index_path(data_path, int(version))
+        if not os.path.exists(index_path):
+            return 0
+
+        # the remapped index gets a version after the new indices map is committed
+        index = IVFIndex.load(index_path)
+        remapped_index = index.remap(compaction)
+        self._remapped_index_path = index_path + '_remapped'
+        shutil.rmtree(self._remapped_index_path, ignore_errors=True)
+        remapped_index.save(self._remapped_index_path)
+        return index.nbytes - remapped_index.nbytes
+
+    async def publish_remapped_indices(self, session):
+        remapped_index_path = self._remapped_index_path
+        if remapped_index_path is None:
+            return
+
+        # the old index is removed by the next export
+        self._remapped_index_path = None
+        version = await session.redis_bind.incr(self._redis_key + '_version')
+        os.rename(remapped_index_path, self._build_index_path(self._data_path, version))
+        await session.redis_bind.set(self._redis_key, version)
+
+    def _build_embeddings(self, length, indices, rows):
+        embeddings = np.zeros((length, rows.shape[1]), dtype=np.float32)
+        embeddings[indices] = rows
+        return embeddings
+
+    def _build_partial_vector(self, readers, items_indices_map_dict):
+        # only the rows of the mapped items are sent back by the export processes
+        indices, rows = [], []
+
+        for reader in readers:
+            for keys, vectors in self._read_embeddings_chunks(reader):
+                chunk_indices = items_indices_map_dict.get_indices(keys)
+                found = chunk_indices != -1
+                indices.append(chunk_indices[found])
+                rows.append(vectors[found])
+
+        if not indices:
+            return None
+
+        return self._keep_last_rows(np.concatenate(indices), np.concatenate(rows))
+
+    def _reduce_partial_vectors(self, partial_vectors):
+        partial_vectors = [rows for rows in partial_vectors if rows is not None]
+        if not partial_vectors:
+            return None
+
+        return self._keep_last_rows(
+            np.concatenate([indices for indices, _ in partial_vectors]),
+            np.concatenate([rows for _, rows in partial_vectors])
+        )
+
+    def _keep_last_rows(self, indices, rows):
+        # the whole embedding of the last written row of each item is kept
+        if not indices.size:
+            return None
+
+        _, last = np.unique(indices[::-1], return_index=True)
+        last = indices.size - 1 - last
+        return indices[last], rows[last]
+
+    def _read_embeddings_chunks(self, reader):
+        chunk = []
+
+        for line in reader:
+            if line.strip():
+                chunk.append(line)
+
+            if len(chunk) == self.__embeddings_chunk_size__:
+                yield self._parse_embeddings_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            yield self._parse_embeddings_chunk(chunk)
+
+    def _parse_embeddings_chunk(self, lines):
+        # all the lines of the chunk are parsed as one json array
+        if isinstance(lines[0], bytes):
+            embeddings = ujson.loads(b'[' + b','.join(lines) + b']')
+        else:
+            embeddings = ujson.loads('[' + ','.join(lines) + ']')
+
+        keys = [embedding['item_key'] for embedding in embeddings]
+        vectors = np.array([embedding['embedding'] for embedding in embeddings], dtype=np.float32)
+        return keys, vectors
+
+    async def get_items_vector(self, session, indices, items_model):
+        index = await self._get_index(session, items_model)
+        if index is None:
+            return None
+
+        return index.get_scores(indices, self._get_config('probes', self.__probes__))
+
+    async def _get_index(self, session, items_model):
+        data_path = getattr(items_model, '__data_path__', None)
+        if data_path is None:
+            return None
+
+        # the index files are mapped once by version
+        version = await session.redis_bind.get(self._redis_key)
+        if version is None:
+            return None
+
+        index = self._indices.get(self._redis_key)
+        if index is None or index.version != int(version):
+            index_path = self._build_index_path(
+                os.path.join(data_path, self._redis_key), int(version))
+            if not os.path.exists(index_path):
+                return None
+
+            index = IVFIndex.load(index_path, int(version))
+            self._indices[self._redis_key] = index
+
+        return index
@@ -0,0 +1,62 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from myreco.engine_strategies.strategy_base import EngineStrategyBase
+from myreco.engine_strategies.visual_similarity.index import VisualSimilarityIndex
+
+
+class VisualSimilarityEngineStrategy(EngineStrategyBase):
+    configuration_schema = {
+        'type': 'object',
+        'required': ['visual_similarity_index'],
+        'additionalProperties': False,
+        'properties': {
+            'visual_similarity_index': {
+                'type': 'object',
+                'additionalProperties': False,
+                'properties': {
+                    'lists': {'type': 'integer', 'minimum': 1},
+                    'probes': {'type': 'integer', 'minimum': 1}
+                }
+            }
+        }
+    }
+    object_types = {'visual_similarity_index': VisualSimilarityIndex}
+
+    def get_variables(self):
+        return [{
+            'name': 'item_keys',
+            'schema': {'type': 'array', 'items': {'type': 'string'}}
+        }]
+
+    async def _build_items_vector(self, session, items_model, item_keys=None,
+                                  **external_variables):
+        if not item_keys:
+            return None
+
+        indices = await items_model.indices_map.get_indices(item_keys, session)
+        if not indices:
+            return None
+
+        return await self.objects['visual_similarity_index'].get_items_vector(
+            session, indices, items_model)
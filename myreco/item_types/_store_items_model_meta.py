@@ -30,12 +30,24 @@ class _StoreItemsModelBaseMeta(ModelRedisElSearchMeta):
     def __init__(cls, name, bases_classes, attributes):
         super().__init__(name, bases_classes, attributes)
         cls.indices_map = ItemsIndicesMap(cls)
+        cls.fingerprints_key = cls.__key__ + '_fingerprints'
 
-    async def insert(cls, session, objs, skip_validation=False, **kwargs):
+    async def insert(cls, session, objs, skip_validation=False, fingerprints=None, **kwargs):
         if not skip_validation:
             cls._validate_objs(objs, 'insert')
 
-        return await ModelRedisElSearchMeta.insert(cls, session, objs, **kwargs)
+        objs = await ModelRedisElSearchMeta.insert(cls, session, objs, **kwargs)
+        keys = [cls.get_instance_key(obj) for obj in objs]
+        await cls.indices_map.log_changes(session, keys)
+        await cls._set_fingerprints(session, keys, fingerprints)
+        return objs
+
+    async def _set_fingerprints(cls, session, keys, fingerprints=None):
+        # the items changed without a fingerprint will be rewritten by the next import
+        if fingerprints:
+            await session.redis_bind.hmset_dict(cls.fingerprints_key, fingerprints)
+        elif keys:
+            await session.redis_bind.hdel(cls.fingerprints_key, *keys)
 
     def _validate_objs(cls, objs, type_):
         validator_name = type_ + '_validator'
@@ -47,7 +59,14 @@ class _StoreItemsModelBaseMeta(ModelRedisElSearchMeta):
         if not skip_validation:
             cls._validate_objs(objs, 'update')
 
-        return await ModelRedisElSearchMeta.update(cls, session, objs, **kwargs)
+        objs = cls._to_list(objs)
+        deleted_keys = [cls.get_instance_key(obj) for obj in objs
+                        if obj.get('_operation') == 'delete']
+        keys = [cls.get_instance_key(obj) for obj in objs]
+        objs = await ModelRedisElSearchMeta.update(cls, session, objs, **kwargs)
+        await cls.indices_map.log_changes(session, deleted_keys)
+        await cls._set_fingerprints(session, keys)
+        return objs
 
     async def atomic_update(cls, session, objs, ids=None, skip_validation=False, **kwargs):
         if not skip_validation:
@@ -55,9 +74,16 @@ class _StoreItemsModelBaseMeta(ModelRedisElSearchMeta):
 
         return await ModelRedisElSearchMeta.atomic_update(cls, session, objs, ids, **kwargs)
 
+    async def delete(cls, session, ids, **kwargs):
+        ret = await ModelRedisElSearchMeta.delete(cls, session, ids, **kwargs)
+        await cls.indices_map.log_changes(session, cls._to_list(ids))
+        await cls._set_fingerprints(session, cls._to_list(ids))
+        return ret
+
     async def get(cls, session, ids=None, limit=None, offset=None, **kwargs):
         items_per_page, page = kwargs.get('items_per_page', 1000), kwargs.get('page', 1)
-        limit = items_per_page * page
+        # the base 'get' uses 'offset + limit' as the end of the slice
+        limit = items_per_page
         offset = items_per_page * (page-1)
         return await \
             ModelRedisElSearchMeta.get(cls, session, ids=ids, limit=limit, offset=offset, **kwargs)
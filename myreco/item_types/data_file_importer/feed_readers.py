@@ -0,0 +1,254 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import csv
+from abc import ABCMeta, abstractmethod
+from gzip import GzipFile
+from hashlib import md5
+from io import TextIOWrapper
+from zipfile import ZipFile
+
+from myreco.item_types.model import build_item_validator
+from swaggerit.json_builder import JsonBuilder
+
+import ujson
+
+try:
+    import pyarrow.parquet as parquet
+except ImportError:
+    parquet = None
+
+
+_schemas = dict()
+
+
+def _get_schema(schema):
+    compiled_schema = _schemas.get(schema)
+    if compiled_schema is None:
+        schema_dict = ujson.loads(schema)
+        compiled_schema = _schemas[schema] = (
+            schema_dict,
+            build_item_validator(schema_dict),
+            build_item_validator({'type': 'array', 'items': schema_dict})
+        )
+
+    return compiled_schema
+
+
+def _validate_items(schema, items, items_lines):
+    _, validator, batch_validator = _get_schema(schema)
+    errors = []
+
+    # the items are validated one by one only when the batch is invalid
+    if not batch_validator.check(items):
+        valid_items = []
+        for item, line in zip(items, items_lines):
+            try:
+                validator.validate(item)
+                valid_items.append(item)
+            except Exception as error:
+                errors.append((line, str(error)))
+
+        items = valid_items
+
+    return items, [_build_fingerprint(item) for item in items], errors
+
+
+def _build_fingerprint(item):
+    return md5(ujson.dumps(item, sort_keys=True).encode()).digest()[:8]
+
+
+def _process_lines(schema, lines):
+    items = []
+    items_lines = []
+    errors = []
+    empty_lines = 0
+
+    for line in lines:
+        try:
+            item = _parse_line(line)
+            if item is None:
+                empty_lines += 1
+            else:
+                items.append(item)
+                items_lines.append(line)
+
+        except Exception as error:
+            errors.append((line, str(error)))
+
+    items, fingerprints, validation_errors = _validate_items(schema, items, items_lines)
+    return items, fingerprints, errors + validation_errors, empty_lines
+
+
+def _parse_line(line):
+    line = line.strip()
+
+    if isinstance(line, bytes):
+        line = line.decode()
+
+    if not line:
+        return None
+
+    return ujson.loads(line)
+
+
+def _process_csv_rows(schema, chunk):
+    properties = _get_schema(schema)[0].get('properties', {})
+    header, rows = chunk
+    items = []
+    items_lines = []
+    errors = []
+    empty_lines = 0
+
+    for row in rows:
+        if not any(row):
+            empty_lines += 1
+            continue
+
+        try:
+            items.append({
+                name: _build_csv_value(value, properties.get(name, {}))
+                for name, value in zip(header, row) if value != ''
+            })
+            items_lines.append(row)
+
+        except Exception as error:
+            errors.append((row, str(error)))
+
+    items, fingerprints, validation_errors = _validate_items(schema, items, items_lines)
+    return items, fingerprints, errors + validation_errors, empty_lines
+
+
+def _build_csv_value(value, schema):
+    type_ = schema.get('type')
+
+    # the arrays and the objects are written as json on the csv cells
+    if type_ in ('array', 'object'):
+        return ujson.loads(value)
+
+    elif type_ in ('string', 'number', 'integer', 'boolean'):
+        return JsonBuilder.build(value, schema)
+
+    return value
+
+
+def _process_records(schema, records):
+    items = [{name: value for name, value in record.items() if value is not None}
+             for record in records]
+    items, fingerprints, errors = _validate_items(schema, items, records)
+    return items, fingerprints, errors, 0
+
+
+class FeedReader(metaclass=ABCMeta):
+
+    def __init__(self, stream, content_type):
+        self._file = self._open(stream, content_type)
+        self.feed = self._file
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def _open(self, stream, content_type):
+        return stream
+
+    def pre_process_feed(self, store_items_model, session):
+        pass
+
+    @abstractmethod
+    def read_chunks(self, chunk_size):
+        pass
+
+    def close(self):
+        self._file.close()
+
+
+class NDJSONFeedReader(FeedReader):
+    process_chunk = staticmethod(_process_lines)
+
+    def _open(self, stream, content_type):
+        # the lines are decompressed from the spooled file while they are read
+        if content_type.endswith('gzip'):
+            return GzipFile(fileobj=stream, mode='rb')
+
+        elif content_type.endswith('zip'):
+            zfile = ZipFile(stream)
+            return zfile.open(zfile.namelist()[0])
+
+        return stream
+
+    # the feeds hooks of the stores receive the json lines
+    def pre_process_feed(self, store_items_model, session):
+        self.feed = store_items_model.pre_process_feed(self.feed, session)
+
+    def read_chunks(self, chunk_size):
+        chunk = []
+        for line in self.feed:
+            chunk.append(line)
+
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+
+class CSVFeedReader(FeedReader):
+    process_chunk = staticmethod(_process_csv_rows)
+
+    def _open(self, stream, content_type):
+        return TextIOWrapper(stream, encoding='utf-8', newline='')
+
+    def read_chunks(self, chunk_size):
+        rows = csv.reader(self.feed)
+        header = next(rows, None)
+        chunk = []
+
+        for row in rows:
+            chunk.append(row)
+
+            if len(chunk) == chunk_size:
+                yield header, chunk
+                chunk = []
+
+        if chunk:
+            yield header, chunk
+
+
+class ParquetFeedReader(FeedReader):
+    process_chunk = staticmethod(_process_records)
+
+    @classmethod
+    def is_available(cls):
+        return parquet is not None
+
+    def _open(self, stream, content_type):
+        return parquet.ParquetFile(stream)
+
+    def read_chunks(self, chunk_size):
+        for batch in self.feed.iter_batches(batch_size=chunk_size):
+            yield batch.to_pylist()
+
+    def close(self):
+        pass
@@ -23,48 +23,226 @@
 
 import asyncio
 import gc
-import os
 from collections import namedtuple
-from gzip import GzipFile
-from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from hashlib import md5
+from queue import Queue
 from tempfile import NamedTemporaryFile
-from zipfile import ZipFile
+from threading import Thread
 
 import boto3
-from myreco.item_types.model import ItemTypesModelBase, ItemValidator
+from myreco.item_types.data_file_importer.feed_readers import (CSVFeedReader,
+                                                               NDJSONFeedReader,
+                                                               ParquetFeedReader)
+from myreco.item_types.model import ItemTypesModelBase
 from myreco.utils import extend_swagger_json, run_coro
 from swaggerit.exceptions import SwaggerItModelError
 
 import ujson
 
 
+class _ImportCheckpoint(object):
+
+    def __init__(self, store_items_model, feed_digest, chunk_size):
+        self.key = store_items_model.__key__ + '_import_checkpoint'
+        self.new_keys_key = store_items_model.__key__ + '_import_new_keys'
+        self.changed_keys_key = store_items_model.__key__ + '_import_changed_keys'
+        self.feed_digest = feed_digest
+        self.chunk_size = chunk_size
+        self.chunks = 0
+
+    async def load(self, session, counters, new_keys, changed_keys):
+        checkpoint = await session.redis_bind.hgetall(self.key)
+
+        # a checkpoint of other feed or with other chunks can't be resumed,
+        # the spooled feed is removed by its job, the same feed is posted again to resume
+        if checkpoint.get(b'feed_digest') != self.feed_digest.encode() or \
+                int(checkpoint.get(b'chunk_size', 0)) != self.chunk_size:
+            await self.clear(session)
+            return 0
+
+        self.chunks = int(checkpoint[b'chunks'])
+        for name in counters:
+            counters[name] = int(checkpoint[name.encode()])
+
+        new_keys.update(await session.redis_bind.smembers(self.new_keys_key))
+        changed_keys.update(await session.redis_bind.smembers(self.changed_keys_key))
+        return self.chunks
+
+    async def save(self, session, counters, new_keys, changed_keys):
+        checkpoint = dict(counters)
+        checkpoint.update(
+            feed_digest=self.feed_digest,
+            chunk_size=self.chunk_size,
+            chunks=self.chunks
+        )
+
+        transaction = session.redis_bind.multi_exec()
+        if new_keys:
+            transaction.sadd(self.new_keys_key, *new_keys)
+        if changed_keys:
+            transaction.sadd(self.changed_keys_key, *changed_keys)
+        transaction.hmset_dict(self.key, checkpoint)
+        await transaction.execute()
+
+    async def clear(self, session):
+        await session.redis_bind.delete(self.key, self.new_keys_key, self.changed_keys_key)
+
+
+class _ImportWriter(Thread):
+
+    def __init__(self, model, chunks_queue, store_items_model,
+                 session, counters, new_keys, changed_keys, checkpoint=None):
+        Thread.__init__(self, daemon=True)
+        self._model = model
+        self._chunks_queue = chunks_queue
+        self._store_items_model = store_items_model
+        self._session = session
+        self._counters = counters
+        self._new_keys = new_keys
+        self._changed_keys = changed_keys
+        self._checkpoint = checkpoint
+        self._warning_message = \
+            "Invalid line for model '{}': ".format(store_items_model.__key__) + '{}'
+        self.error = None
+
+    def run(self):
+        chunk = self._chunks_queue.get()
+
+        while chunk is not None:
+            # the queue is drained after an error to don't block the reader
+            if self.error is None:
+                try:
+                    self._write_chunk(*chunk.result())
+                except Exception as error:
+                    self.error = error
+
+            chunk = self._chunks_queue.get()
+
+    def _write_chunk(self, items, fingerprints, errors, empty_lines):
+        for line, error in errors:
+            self._model._logger.warning(self._warning_message.format(line))
+            self._model._logger.warning(error)
+
+        keys = [self._store_items_model.get_instance_key(item) for item in items]
+        changed_items, changed_fingerprints = \
+            self._get_changed_items(keys, items, fingerprints)
+
+        # the checkpoint is saved before the insert, the changed keys
+        # of a chunk are not lost when the chunk is imported again
+        if self._checkpoint is not None:
+            self._model._run_coro(
+                self._checkpoint.save(
+                    self._session, self._counters, keys, changed_fingerprints.keys()),
+                self._session
+            )
+
+        if changed_items:
+            self._model._run_coro(
+                self._store_items_model.insert(
+                    self._session, changed_items, skip_validation=True,
+                    fingerprints=changed_fingerprints
+                ),
+                self._session
+            )
+
+        self._new_keys.update(keys)
+        self._changed_keys.update(changed_fingerprints.keys())
+
+        self._counters['success_lines'] += len(items)
+        self._counters['errors_lines'] += len(errors)
+        self._counters['empty_lines'] += empty_lines
+        self._counters['changed_lines'] += len(changed_items)
+        self._counters['unchanged_lines'] += len(items) - len(changed_items)
+
+        if self._checkpoint is not None:
+            self._checkpoint.chunks += 1
+
+    def _get_changed_items(self, keys, items, fingerprints):
+        changed_items = []
+        changed_fingerprints = dict()
+
+        if not keys:
+            return changed_items, changed_fingerprints
+
+        old_fingerprints = self._model._run_coro(
+            self._session.redis_bind.hmget(self._store_items_model.fingerprints_key, *keys),
+            self._session
+        )
+
+        for key, item, fingerprint, old_fingerprint in \
+                zip(keys, items, fingerprints, old_fingerprints):
+            if fingerprint != old_fingerprint:
+                changed_items.append(item)
+                changed_fingerprints[key] = fingerprint
+
+        return changed_items, changed_fingerprints
+
+
 class ItemTypesDataFileImporterModelBase(ItemTypesModelBase):
     __swagger_json__ = extend_swagger_json(
         ItemTypesModelBase.__swagger_json__,
         __file__
     )
+    __import_processes__ = 4
+    __import_chunk_size__ = 1000
+    __import_queue_size__ = 8
+    __delete_chunk_size__ = 1000
+    __upload_chunk_size__ = 1024 * 1024
+    __feed_readers__ = {
+        'application/zip': NDJSONFeedReader,
+        'application/gzip': NDJSONFeedReader,
+        'application/x-ndjson': NDJSONFeedReader,
+        'text/csv': CSVFeedReader,
+        'application/vnd.apache.parquet': ParquetFeedReader
+    }
+
+    @classmethod
+    def register_feed_reader(cls, content_type, reader_class):
+        # the readers are copied to don't change the readers of the parent classes
+        feed_readers = dict(cls.__feed_readers__)
+        feed_readers[content_type] = reader_class
+        cls.__feed_readers__ = feed_readers
 
     @classmethod
     async def post_import_data_file_job(cls, req, session):
         content_type = req.headers.get('content-type')
-        if content_type != 'application/zip' and content_type != 'application/gzip':
+        reader_class = cls.__feed_readers__.get(content_type)
+        if reader_class is None or not reader_class.is_available():
             raise SwaggerItModelError("Invalid content type '{}'".format(content_type))
 
-        stream = BytesIO()
-        async for line in req.body:
-            stream.write(line)
-        stream.seek(0)
+        # the feed is spooled to disk, it can have some gigabytes
+        stream = NamedTemporaryFile()
+
+        try:
+            feed_digest = md5()
+            chunk = await req.body.read(cls.__upload_chunk_size__)
+            while chunk:
+                stream.write(chunk)
+                feed_digest.update(chunk)
+                chunk = await req.body.read(cls.__upload_chunk_size__)
+            stream.seek(0)
 
-        return await cls._create_job(
-            cls._run_import_data_file_job,
-            req, session, '_importer',
-            stream=stream, content_type=content_type)
+            return await cls._create_job(
+                cls._run_import_data_file_job,
+                req, session, '_importer',
+                stream=stream, content_type=content_type,
+                feed_digest=feed_digest.hexdigest())
+
+        except BaseException:
+            stream.close()
+            raise
 
     @classmethod
-    async def _create_job(cls, func, req, session, jobs_id_prefix, stream=None, content_type=None):
+    async def _create_job(cls, func, req, session, jobs_id_prefix,
+                          stream=None, content_type=None, feed_digest=None):
         store_id = req.query['store_id']
         store_items_model = await cls._get_store_items_model(req, session)
         if store_items_model is None:
+            # the stream is closed by the job, it isn't created here
+            if stream is not None:
+                stream.close()
+
             return cls._build_response(404)
 
         session = cls._copy_session(session)
@@ -73,19 +251,31 @@ class ItemTypesDataFileImporterModelBase(ItemTypesModelBase):
             func, jobs_id,
             req, session,
             store_items_model, store_id,
-            stream=stream, content_type=content_type
+            stream=stream, content_type=content_type,
+            feed_digest=feed_digest
         )
 
     @classmethod
     def _run_import_data_file_job(
             cls, req, session, store_items_model,
-            store_id, stream, content_type):
+            store_id, stream, content_type, feed_digest):
         upload_file = req.query.get('upload_file', True)
-        if upload_file:
-            cls._put_file_on_s3(stream, store_items_model, session, store_id)
-            stream.seek(0)
+        checkpoint = _ImportCheckpoint(
+            store_items_model, feed_digest, cls.__import_chunk_size__)
+
+        if not req.query.get('resume', False):
+            cls._run_coro(checkpoint.clear(session), session)
+
+        try:
+            if upload_file:
+                cls._put_file_on_s3(stream, store_items_model, session, store_id)
+                stream.seek(0)
+
+            result = cls._update_items_from_zipped_file(
+                stream, store_items_model, content_type, session, checkpoint)
 
-        result = cls._update_items_from_zipped_file(stream, store_items_model, content_type, session)
+        finally:
+            stream.close()
 
         gc.collect()
         return result
@@ -117,126 +307,121 @@ class ItemTypesDataFileImporterModelBase(ItemTypesModelBase):
         return run_coro(coro, session)
 
     @classmethod
-    def _update_items_from_zipped_file(cls, stream, store_items_model, content_type, session):
-        feed = cls._unzip_file(content_type, stream)
-        result = cls._update_items_from_file(feed, store_items_model, session)
+    def _update_items_from_zipped_file(cls, stream, store_items_model,
+                                       content_type, session, checkpoint=None):
+        reader = cls.__feed_readers__[content_type](stream, content_type)
 
-        feed.close()
-
-        if os.path.isfile(feed.name):
-            os.remove(feed.name)
-
-        return result
+        try:
+            return cls._update_items_from_file(reader, store_items_model, session, checkpoint)
+        finally:
+            reader.close()
 
     @classmethod
-    def _unzip_file(cls, content_type, stream=None, mode=None):
-        tempfile = NamedTemporaryFile(delete=False)
-        filename = tempfile.name
-        kwargs = {'mode': mode} if mode else {}
-        if stream is not None:
-            tempfile.write(stream.read())
-
-        tempfile.close()
-
-        if content_type.endswith('gzip'):
-            zfile = GzipFile(filename, **kwargs)
-
-        else:
-            zfile = ZipFile(filename, **kwargs)
-            zfile = zfile.open(zfile.namelist()[0])
-
-        return zfile
-
-
-    @classmethod
-    def _update_items_from_file(cls, feed, store_items_model, session):
+    def _update_items_from_file(cls, reader, store_items_model, session, checkpoint=None):
         cls._logger.info(
             "Started update items from file for '{}'".format(store_items_model.__key__)
         )
-        warning_message = "Invalid line for model '{}': ".format(store_items_model.__key__) + '{}'
-        validator = ItemValidator(store_items_model.item_type['schema'])
-        new_keys = set()
-        success_lines = 0
-        errors_lines = 0
-        empty_lines = 0
+        schema = ujson.dumps(store_items_model.item_type['schema'])
         old_keys = cls._run_coro(
             session.redis_bind.hkeys(store_items_model.__key__),
             session
         )
         old_keys = set(old_keys)
-        lines = []
+        counters = {
+            'success_lines': 0,
+            'errors_lines': 0,
+            'empty_lines': 0,
+            'changed_lines': 0,
+            'unchanged_lines': 0
+        }
+        new_keys = set()
+        changed_keys = set()
+        resumed_chunks = 0
 
-        if hasattr(store_items_model, 'pre_process_feed'):
-            feed = store_items_model.pre_process_feed(feed, session)
-
-        for line in feed:
-            try:
-                line = cls._try_to_process_line(line, validator, store_items_model)
-                if line is None:
-                    empty_lines += 1
-                    continue
-                else:
-                    success_lines += 1
-                    new_keys.add(store_items_model.get_instance_key(line))
-                    lines.append(line)
-
-                    if len(lines) == 1000:
-                        cls._run_coro(
-                            store_items_model.insert(session, lines, skip_validation=True),
-                            session
-                        )
-                        lines = []
-
-            except Exception as error:
-                errors_lines += 1
-                cls._logger.warning(warning_message.format(line))
-                cls._logger.warning(error)
-                continue
-
-        if lines:
-            cls._run_coro(
-                store_items_model.insert(session, lines, skip_validation=True),
+        if checkpoint is not None:
+            resumed_chunks = cls._run_coro(
+                checkpoint.load(session, counters, new_keys, changed_keys),
                 session
             )
 
-        del lines
-        old_keys.difference_update(new_keys)
+            if resumed_chunks:
+                cls._logger.info("Resuming import after {} chunks for '{}'".format(
+                    resumed_chunks, store_items_model.__key__))
 
-        if old_keys:
-            cls._run_coro(
-                session.redis_bind.hdel(store_items_model.__key__, *old_keys),
-                session
-            )
+        if hasattr(store_items_model, 'pre_process_feed'):
+            reader.pre_process_feed(store_items_model, session)
+
+        # the feed is read in this thread, parsed and validated in
+        # the pool and written to redis by the writer thread
+        chunks_queue = Queue(maxsize=cls.__import_queue_size__)
+        writer = _ImportWriter(
+            cls, chunks_queue, store_items_model, session,
+            counters, new_keys, changed_keys, checkpoint)
+        writer.start()
+
+        try:
+            with cls._build_import_executor() as executor:
+                for i, chunk in enumerate(reader.read_chunks(cls.__import_chunk_size__)):
+                    # the feed isn't read after an error of the writer
+                    if writer.error is not None:
+                        break
+
+                    # the committed chunks are only read to reach the checkpoint
+                    if i < resumed_chunks:
+                        continue
+
+                    chunks_queue.put(executor.submit(reader.process_chunk, schema, chunk))
+        finally:
+            chunks_queue.put(None)
+            writer.join()
+
+        if writer.error is not None:
+            raise writer.error
+
+        old_keys.difference_update(new_keys)
+        del new_keys
+        counters['deleted_lines'] = cls._delete_old_items(store_items_model, session, old_keys)
 
         cls._run_coro(
-            cls._set_stock_filter(store_items_model, session),
+            cls._update_stock_filter(store_items_model, session, changed_keys, old_keys),
             session
         )
 
+        if checkpoint is not None:
+            cls._run_coro(checkpoint.clear(session), session)
+
         cls._logger.info(
             "Finished update items from file for '{}'".format(store_items_model.__key__)
         )
 
-        return {
-            'success_lines': success_lines,
-            'errors_lines': errors_lines,
-            'empty_lines': empty_lines
-        }
+        return counters
 
     @classmethod
-    def _try_to_process_line(cls, line, validator, store_items_model):
-        line = line.strip()
+    def _delete_old_items(cls, store_items_model, session, old_keys):
+        old_keys = list(old_keys)
+        deleted_items = 0
 
-        if isinstance(line, bytes):
-            line = line.decode()
+        # small chunks don't block the redis for the recommendations requests
+        for i in range(0, len(old_keys), cls.__delete_chunk_size__):
+            keys = old_keys[i:i+cls.__delete_chunk_size__]
+            pipeline = session.redis_bind.pipeline()
+            pipeline.hdel(store_items_model.__key__, *keys)
+            pipeline.hdel(store_items_model.fingerprints_key, *keys)
+            pipeline.sadd(store_items_model.indices_map.changes_key, *keys)
+            cls._run_coro(pipeline.execute(), session)
+            deleted_items += len(keys)
 
-        if not line:
-            return None
+            cls._logger.info("Deleted {} of {} old items for '{}'".format(
+                deleted_items, len(old_keys), store_items_model.__key__))
 
-        line = ujson.loads(line)
-        validator.validate(line)
+        return deleted_items
 
-        return line
+    @classmethod
+    def _build_import_executor(cls):
+        if cls.__import_processes__ > 1:
+            return ProcessPoolExecutor(cls.__import_processes__)
+        else:
+            return ThreadPoolExecutor(1)
 
     @classmethod
     async def get_import_data_file_job(cls, req, session):
@@ -246,6 +431,10 @@ class ItemTypesDataFileImporterModelBase(ItemTypesModelBase):
     async def _get_job(cls, sufix, req, session):
         store_items_model = await cls._get_store_items_model(req, session)
         if store_items_model is None:
+            # the stream is closed by the job, it isn't created here
+            if stream is not None:
+                stream.close()
+
             return cls._build_response(404)
 
         jobs_id = store_items_model.__key__ + sufix
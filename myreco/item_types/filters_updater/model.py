@@ -21,8 +21,11 @@
 # SOFTWARE.
 
 
+import asyncio
+
 from myreco.engine_strategies.filters.factory import FiltersFactory
-from myreco.engine_strategies.filters.filters import BooleanFilterBy
+from myreco.engine_strategies.filters.filters import (BooleanFilterBy,
+                                                      FilterColumn)
 from myreco.item_types.data_file_importer.model import \
     ItemTypesDataFileImporterModelBase
 from myreco.utils import extend_swagger_json
@@ -34,6 +37,9 @@ class ItemTypesFiltersUpdaterModelBase(ItemTypesDataFileImporterModelBase):
         ItemTypesDataFileImporterModelBase.__swagger_json__,
         __file__
     )
+    __items_per_page__ = 100000
+    __updater_lock_timeout__ = 60*60
+    __updater_lock_interval__ = 1
 
     @classmethod
     async def post_update_filters_job(cls, req, session):
@@ -51,6 +57,33 @@ class ItemTypesFiltersUpdaterModelBase(ItemTypesDataFileImporterModelBase):
 
     @classmethod
     async def update_enabled_filters(cls, store_items_model, session, store_id):
+        await cls._acquire_updater_lock(store_items_model, session)
+
+        try:
+            return await cls._update_enabled_filters(store_items_model, session, store_id)
+        finally:
+            await cls._release_updater_lock(store_items_model, session)
+
+    @classmethod
+    async def _acquire_updater_lock(cls, store_items_model, session):
+        # the indices map and the filters are changed by one update or compaction at a time
+        lock_key = cls._build_updater_lock_key(store_items_model)
+
+        while not await session.redis_bind.set(
+                lock_key, 1, expire=cls.__updater_lock_timeout__,
+                exist=session.redis_bind.SET_IF_NOT_EXIST):
+            await asyncio.sleep(cls.__updater_lock_interval__)
+
+    @classmethod
+    async def _release_updater_lock(cls, store_items_model, session):
+        await session.redis_bind.delete(cls._build_updater_lock_key(store_items_model))
+
+    @classmethod
+    def _build_updater_lock_key(cls, store_items_model):
+        return store_items_model.__key__ + '_updater_lock'
+
+    @classmethod
+    async def _update_enabled_filters(cls, store_items_model, session, store_id):
         items_indices_map = store_items_model.indices_map
         items_indices_map_ret = await items_indices_map.update(session)
         items_indices_map_len = await items_indices_map.get_length(session)
@@ -58,24 +91,118 @@ class ItemTypesFiltersUpdaterModelBase(ItemTypesDataFileImporterModelBase):
         filters_factory = cls.get_model('slot_filters').__factory__
         enabled_filters = await cls._get_enabled_filters(store_items_model, session, store_id)
         filters_ret = dict()
-        items_indices_map_dict = await items_indices_map.get_all(session)
-        items = await cls._get_items_with_indices_and_stock(
-            store_items_model, session, items_indices_map_dict
-        )
+        items_indices_map_snapshot = await items_indices_map.get_snapshot(session)
 
         stock_filter = BooleanFilterBy(store_items_model, 'stock')
-        await stock_filter.update(session, items, items_indices_map_len)
-
-        for slot_filter, schema in enabled_filters:
-            filter_ = filters_factory.make(
+        filters = [
+            filters_factory.make(
                 store_items_model, slot_filter,
                 schema, slot_filter['skip_values']
-            )
-            filters_ret[filter_.name] = await filter_.update(session, items, items_indices_map_len)
+            ) for slot_filter, schema in enabled_filters
+        ]
+        columns = await cls._build_filters_columns(
+            [stock_filter] + filters, store_items_model,
+            session, items_indices_map_snapshot
+        )
+        del items_indices_map_snapshot
+
+        await stock_filter.update_from_column(session, columns[0], items_indices_map_len)
+
+        for filter_, column in zip(filters, columns[1:]):
+            filters_ret[filter_.name] = \
+                await filter_.update_from_column(session, column, items_indices_map_len)
 
         cls._logger.info("Finished update filters for '{}'".format(store_items_model.__key__))
         return {'items_indices_map': items_indices_map_ret, 'filters': filters_ret}
 
+    @classmethod
+    async def post_compact_indices_job(cls, req, session):
+        return await cls._create_job(cls._run_compact_indices_job, req, session, '_compacter')
+
+    @classmethod
+    async def _run_compact_indices_job(cls, req, session, store_items_model, store_id, **kwargs):
+        cls._logger.info("Started compact indices for '{}'".format(store_items_model.__key__))
+
+        return await cls.compact_indices(store_items_model, session, store_id)
+
+    @classmethod
+    async def get_compact_indices_job(cls, req, session):
+        return await cls._get_job('_compacter', req, session)
+
+    @classmethod
+    async def compact_indices(cls, store_items_model, session, store_id):
+        await cls._acquire_updater_lock(store_items_model, session)
+
+        try:
+            return await cls._compact_indices(store_items_model, session, store_id)
+        finally:
+            await cls._release_updater_lock(store_items_model, session)
+
+    @classmethod
+    async def _compact_indices(cls, store_items_model, session, store_id):
+        items_indices_map = store_items_model.indices_map
+        await items_indices_map.update(session)
+        compaction = await items_indices_map.build_compaction(session)
+        ret = {
+            'items_indices_map': compaction.get_report(),
+            'filters': {},
+            'engine_objects': {},
+            'reclaimed_bytes': 0
+        }
+
+        if not compaction.reclaimed_slots:
+            cls._logger.info("The indices of '{}' are already compacted"
+                             .format(store_items_model.__key__))
+            return ret
+
+        # all the remapped vectors are published with the new indices map
+        transaction = session.redis_bind.multi_exec()
+
+        for filter_ in await cls._get_stored_filters(store_items_model, session, store_id):
+            ret['filters'][filter_.name] = await filter_.remap(session, transaction, compaction)
+
+        engine_objects = await cls._get_engine_objects_instances(
+            store_items_model, session, store_id)
+
+        for name, engine_object in engine_objects:
+            ret['engine_objects'][name] = \
+                await engine_object.remap_indices(session, transaction, compaction)
+
+        items_indices_map.set_compaction(transaction, compaction)
+        await transaction.execute()
+
+        # the objects which keep their data out of redis publish it after the commit
+        for _, engine_object in engine_objects:
+            await engine_object.publish_remapped_indices(session)
+
+        ret['reclaimed_bytes'] = \
+            sum(ret['filters'].values()) + sum(ret['engine_objects'].values())
+        cls._logger.info("Finished compact indices for '{}'".format(store_items_model.__key__))
+        return ret
+
+    @classmethod
+    async def _get_stored_filters(cls, store_items_model, session, store_id):
+        filters_factory = cls.get_model('slot_filters').__factory__
+        enabled_filters = await cls._get_enabled_filters(store_items_model, session, store_id)
+        return [BooleanFilterBy(store_items_model, 'stock')] + [
+            filters_factory.make(
+                store_items_model, slot_filter,
+                schema, slot_filter['skip_values']
+            ) for slot_filter, schema in enabled_filters
+        ]
+
+    @classmethod
+    async def _get_engine_objects_instances(cls, store_items_model, session, store_id):
+        engine_objects_model = cls.get_model('engine_objects')
+        engine_objects = await engine_objects_model.get(
+            session, todict=False, store_id=store_id,
+            item_type_id=store_items_model.item_type['id']
+        )
+        return [
+            (engine_object.name, engine_objects_model.get_engine_object_instance(engine_object))
+            for engine_object in engine_objects
+        ]
+
     @classmethod
     async def _get_enabled_filters(cls, store_items_model, session, store_id):
         slots_model = cls.get_model('slots')
@@ -98,21 +225,31 @@ class ItemTypesFiltersUpdaterModelBase(ItemTypesDataFileImporterModelBase):
         return filters_external_variables
 
     @classmethod
-    async def _get_items_with_indices_and_stock(cls, store_items_model, session, items_indices_map_dict):
-        items = []
+    async def _build_filters_columns(cls, filters, store_items_model,
+                                     session, items_indices_map_snapshot):
+        columns = [FilterColumn() for _ in filters]
         page = 1
-        items_part = await store_items_model.get(session, page=page, items_per_page=100000)
+        items_part = await cls._get_items_page(store_items_model, session, page)
 
         while items_part:
-            items.extend(items_part)
+            indices = items_indices_map_snapshot.get_indices(
+                [store_items_model.get_instance_key(item) for item in items_part])
+
+            for item, index in zip(items_part, indices.tolist()):
+                if index != -1:
+                    item['index'] = index
+                    item['stock'] = True
+
+                    for filter_, column in zip(filters, columns):
+                        filter_.append_item(column, item)
+
+            del items_part
             page += 1
-            items_part = await store_items_model.get(session, page=page, items_per_page=100000)
+            items_part = await cls._get_items_page(store_items_model, session, page)
 
-        for item in items:
-            item_key = store_items_model.get_instance_key(item)
-            index = items_indices_map_dict.get(item_key)
-            if index is not None:
-                item['index'] = index
-                item['stock'] = True
+        return columns
 
-        return items
+    @classmethod
+    async def _get_items_page(cls, store_items_model, session, page):
+        return await store_items_model.get(
+            session, page=page, items_per_page=cls.__items_per_page__)
@@ -21,11 +21,179 @@
 # SOFTWARE.
 
 
+import os
+import struct
+import time
+from glob import glob
+
+import numpy as np
+
+
+class ItemsIndicesSnapshot(object):
+    _header = struct.Struct('<4sIIq')
+    _magic = b'MRIS'
+
+    def __init__(self, keys, indices, length, version=None):
+        self.keys = keys
+        self.indices = indices
+        self.length = length
+        self.version = version
+
+    @classmethod
+    def from_dict(cls, items_indices_map, version=None):
+        if not items_indices_map:
+            return cls(np.array([], dtype='S1'), np.array([], dtype=np.int32), 0, version)
+
+        keys = np.array([k if isinstance(k, bytes) else k.encode()
+                         for k in items_indices_map.keys()], dtype=bytes)
+        indices = np.fromiter(
+            items_indices_map.values(), dtype=np.int32, count=keys.size)
+        order = np.argsort(keys, kind='mergesort')
+        return cls(keys[order], indices[order], int(indices.max())+1, version)
+
+    def pack(self):
+        keys = self.keys.tobytes()
+        padding = b'\x00' * (-(self._header.size + len(keys)) % 8)
+        header = self._header.pack(
+            self._magic, self.keys.size, self.keys.dtype.itemsize, self.length)
+        return b''.join((header, keys, padding, self.indices.tobytes()))
+
+    @classmethod
+    def unpack(cls, data, version=None):
+        magic, size, width, length = cls._header.unpack_from(data)
+        if magic != cls._magic:
+            raise ValueError('Invalid items indices snapshot')
+
+        offset = cls._header.size
+        keys = np.frombuffer(data, dtype='S{}'.format(width), count=size, offset=offset)
+        offset += size * width
+        offset += -offset % 8
+        indices = np.frombuffer(data, dtype=np.int32, count=size, offset=offset)
+        return cls(keys, indices, length, version)
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def total_items(self):
+        return int(self.keys.size)
+
+    def get_indices(self, keys):
+        if not isinstance(keys, np.ndarray) or keys.dtype.kind != 'S':
+            keys = np.array(
+                [k if isinstance(k, bytes) else k.encode() for k in keys], dtype=bytes)
+
+        indices = np.full(keys.size, -1, dtype=np.int32)
+
+        if self.keys.size and keys.size:
+            positions = np.searchsorted(self.keys, keys)
+            positions[positions == self.keys.size] = 0
+            found = self.keys[positions] == keys
+            indices[found] = self.indices[positions[found]]
+
+        return indices
+
+    def get(self, key, default=None):
+        index = int(self.get_indices((key,))[0])
+        return default if index == -1 else index
+
+    def apply_changes(self, removed_keys, added_map, length):
+        keys, indices = self.keys, self.indices
+
+        if removed_keys and keys.size:
+            removed_keys = np.array(removed_keys, dtype=bytes)
+            positions = np.searchsorted(keys, removed_keys)
+            positions[positions == keys.size] = 0
+            keep = np.ones(keys.size, dtype=bool)
+            keep[positions[keys[positions] == removed_keys]] = False
+            keys, indices = keys[keep], indices[keep]
+
+        if added_map:
+            keys = np.concatenate((keys, np.array(list(added_map.keys()), dtype=bytes)))
+            indices = np.concatenate((
+                indices,
+                np.fromiter(added_map.values(), dtype=np.int32, count=len(added_map))
+            ))
+            order = np.argsort(keys, kind='mergesort')
+            keys, indices = keys[order], indices[order]
+
+        return type(self)(keys, indices, length, self.version)
+
+
+class ItemsIndicesCompaction(object):
+
+    def __init__(self, snapshot):
+        self.old_length = len(snapshot)
+        self.old_indices = np.sort(snapshot.indices, kind='mergesort')
+        self.new_indices = np.full(self.old_length, -1, dtype=np.int32)
+        self.new_indices[self.old_indices] = \
+            np.arange(self.old_indices.size, dtype=np.int32)
+        self.snapshot = ItemsIndicesSnapshot(
+            snapshot.keys, self.new_indices[snapshot.indices],
+            int(self.old_indices.size), snapshot.version
+        )
+
+    @property
+    def new_length(self):
+        return len(self.snapshot)
+
+    @property
+    def reclaimed_slots(self):
+        return self.old_length - self.new_length
+
+    def remap_vector(self, vector):
+        remapped = np.zeros(self.new_length, dtype=vector.dtype)
+        valid = self.old_indices < vector.size
+        remapped[valid] = vector[self.old_indices[valid]]
+        return remapped
+
+    def remap_indices(self, indices):
+        indices = self.new_indices[indices[(indices >= 0) & (indices < self.old_length)]]
+        return indices[indices != -1]
+
+    def get_report(self):
+        return {
+            'total_items': self.snapshot.total_items,
+            'old_length': self.old_length,
+            'new_length': self.new_length,
+            'reclaimed_slots': self.reclaimed_slots
+        }
+
+
+class ItemsIndicesReverseArray(object):
+
+    def __init__(self, keys, version=None):
+        self.keys = keys
+        self.version = version
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        keys = np.zeros(len(snapshot), dtype=snapshot.keys.dtype)
+        keys[snapshot.indices] = snapshot.keys
+        return cls(keys, snapshot.version)
+
+    def save(self, filename):
+        tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmp_filename, 'wb') as file_:
+            np.save(file_, self.keys)
+
+        os.replace(tmp_filename, filename)
+
+    @classmethod
+    def load(cls, filename, version=None):
+        return cls(np.load(filename, mmap_mode='r'), version)
+
+    def get_items(self, indices):
+        indices = np.array(indices, dtype=np.int64)
+        indices = indices[(indices >= 0) & (indices < self.keys.size)]
+        return [key for key in self.keys[indices].tolist() if key]
+
+
 class ItemsIndicesDict(dict):
 
     def __init__(self, items_indices_map, items_model):
         self.items_model = items_model
-        dict.__init__(self, items_indices_map)
+        super().__init__(items_indices_map)
 
     def __len__(self):
         values = self.values()
@@ -37,17 +205,28 @@ class ItemsIndicesDict(dict):
     def get(self, key, default=None):
         if isinstance(key, str):
             key = key.encode()
-        v = dict.get(self, key, default)
+        v = super().get(key, default)
         return v
 
 
 class ItemsIndicesMap(object):
+    _old_reverse_arrays_ttl = 60
+    _shared_snapshots = dict()
 
     def __init__(self, items_model):
         self.items_model = items_model
         self.key = items_model.__key__ + '_indices_map'
         self.indices_items_key = items_model.__key__ + '_items_map'
         self.length_key = items_model.__key__ + '_indices_length'
+        self.snapshot_key = items_model.__key__ + '_indices_snapshot'
+        self.version_key = items_model.__key__ + '_indices_version'
+        self.changes_key = items_model.__key__ + '_indices_changes'
+        self.processing_changes_key = items_model.__key__ + '_indices_processing_changes'
+        self.free_indices_key = items_model.__key__ + '_indices_free'
+        data_path = getattr(items_model, '__data_path__', None)
+        self._reverse_arrays_path = \
+            None if data_path is None else os.path.join(data_path, 'indices_maps')
+        self._reverse_array = None
 
     async def get_all(self, session):
         items_indices_map = await session.redis_bind.hgetall(self.key)
@@ -58,7 +237,17 @@ class ItemsIndicesMap(object):
         map_ = await session.redis_bind.hgetall(self.indices_items_key)
         return {int(k): v.decode() for k, v in map_.items()}
 
+    async def log_changes(self, session, keys):
+        if keys:
+            await session.redis_bind.sadd(self.changes_key, *keys)
+
     async def update(self, session):
+        if await session.redis_bind.exists(self.snapshot_key):
+            return await self._update_from_changes(session)
+
+        # the full update covers all the logged changes
+        await session.redis_bind.delete(self.changes_key, self.processing_changes_key)
+
         items_indices_map = await self.get_all(session)
         indices_items_map = await self.get_indices_items_map(session)
 
@@ -94,8 +283,143 @@ class ItemsIndicesMap(object):
             await session.redis_bind.hmset_dict(self.indices_items_key, indices_items_map)
             await session.redis_bind.set(self.length_key, len(items_indices_map))
 
+        await self._set_snapshot(session, items_indices_map)
         return self._format_output(await self.get_all(session))
 
+    async def _set_snapshot(self, session, items_indices_map):
+        snapshot = ItemsIndicesSnapshot.from_dict(items_indices_map)
+        free_indices = set(range(len(items_indices_map))).difference(items_indices_map.values())
+        transaction = session.redis_bind.multi_exec()
+        transaction.set(self.snapshot_key, snapshot.pack())
+        transaction.incr(self.version_key)
+        transaction.delete(self.free_indices_key)
+
+        if free_indices:
+            transaction.sadd(self.free_indices_key, *free_indices)
+
+        await transaction.execute()
+
+    async def _update_from_changes(self, session):
+        # the changes are kept on the processing key until they are applied,
+        # the ones of a failed update are merged with the new ones
+        transaction = session.redis_bind.multi_exec()
+        transaction.sunionstore(
+            self.processing_changes_key, self.processing_changes_key, self.changes_key)
+        transaction.delete(self.changes_key)
+        transaction.smembers(self.processing_changes_key)
+        _, _, changed_keys = await transaction.execute()
+        snapshot = await self.get_snapshot(session)
+
+        if not changed_keys:
+            return self._format_snapshot_output(snapshot)
+
+        changed_keys = list(changed_keys)
+        indices = await session.redis_bind.hmget(self.key, *changed_keys)
+        pipeline = session.redis_bind.pipeline()
+        exists_futures = [pipeline.hexists(self.items_model.__key__, key) for key in changed_keys]
+        await pipeline.execute()
+
+        new_keys = []
+        removed_map = dict()
+        for key, index, exists_future in zip(changed_keys, indices, exists_futures):
+            exists = exists_future.result()
+            if index is None and exists:
+                new_keys.append(key)
+            elif index is not None and not exists:
+                removed_map[key] = int(index)
+
+        if not new_keys and not removed_map:
+            await session.redis_bind.delete(self.processing_changes_key)
+            return self._format_snapshot_output(snapshot)
+
+        free_indices = [int(i) for i in await session.redis_bind.smembers(self.free_indices_key)]
+        free_indices = sorted(free_indices + list(removed_map.values()))
+        length = len(snapshot)
+        added_map = dict()
+
+        for key in new_keys:
+            if free_indices:
+                added_map[key] = free_indices.pop(0)
+            else:
+                added_map[key] = length
+                length += 1
+
+        snapshot = snapshot.apply_changes(list(removed_map.keys()), added_map, length)
+        await self._set_changes(session, removed_map, added_map, free_indices, snapshot)
+        return self._format_snapshot_output(snapshot)
+
+    async def _set_changes(self, session, removed_map, added_map, free_indices, snapshot):
+        transaction = session.redis_bind.multi_exec()
+
+        if removed_map:
+            transaction.hdel(self.key, *removed_map.keys())
+            transaction.hdel(self.indices_items_key, *removed_map.values())
+
+        if added_map:
+            transaction.hmset_dict(self.key, added_map)
+            transaction.hmset_dict(
+                self.indices_items_key, {i: k for k, i in added_map.items()})
+
+        transaction.delete(self.free_indices_key)
+        if free_indices:
+            transaction.sadd(self.free_indices_key, *free_indices)
+
+        transaction.set(self.length_key, len(snapshot))
+        transaction.set(self.snapshot_key, snapshot.pack())
+        transaction.incr(self.version_key)
+        transaction.delete(self.processing_changes_key)
+        await transaction.execute()
+
+    def _format_snapshot_output(self, snapshot):
+        maximum_index = int(snapshot.indices.max()) if snapshot.total_items else None
+        return {'total_items': snapshot.total_items, 'maximum_index': maximum_index}
+
+    async def build_compaction(self, session):
+        return ItemsIndicesCompaction(await self.get_snapshot(session))
+
+    def set_compaction(self, transaction, compaction):
+        snapshot = compaction.snapshot
+        keys = snapshot.keys.tolist()
+        indices = snapshot.indices.tolist()
+        transaction.delete(self.key, self.indices_items_key, self.free_indices_key)
+
+        if keys:
+            transaction.hmset_dict(self.key, dict(zip(keys, indices)))
+            transaction.hmset_dict(self.indices_items_key, dict(zip(indices, keys)))
+
+        transaction.set(self.length_key, len(snapshot))
+        transaction.set(self.snapshot_key, snapshot.pack())
+        transaction.incr(self.version_key)
+
+    async def get_snapshot(self, session):
+        transaction = session.redis_bind.multi_exec()
+        transaction.get(self.snapshot_key)
+        transaction.get(self.version_key)
+        snapshot, version = await transaction.execute()
+        version = None if version is None else int(version)
+
+        if snapshot is None:
+            return ItemsIndicesSnapshot.from_dict(await self.get_all(session), version)
+
+        return ItemsIndicesSnapshot.unpack(snapshot, version)
+
+    async def get_shared_snapshot(self, session):
+        # the snapshots are shared by all the readers of the process until the version changes
+        version = await session.redis_bind.get(self.version_key)
+        snapshot = self._shared_snapshots.get(self.key)
+
+        if version is not None and snapshot is not None and snapshot.version == int(version):
+            return snapshot
+
+        snapshot = await self.get_snapshot(session)
+
+        if snapshot.version is not None:
+            snapshot.keys.setflags(write=False)
+            snapshot.indices.setflags(write=False)
+            self._shared_snapshots[self.key] = snapshot
+
+        return snapshot
+
     async def _get_items_keys(self, session):
         return set(await self.items_model.get_keys(session))
 
@@ -106,11 +430,74 @@ class ItemsIndicesMap(object):
 
     async def get_items(self, indices, session):
         if indices:
+            reverse_array = await self.get_reverse_array(session)
+            if reverse_array is not None:
+                return reverse_array.get_items(indices)
+
             return [item for item in \
                 await session.redis_bind.hmget(self.indices_items_key, *indices) if item is not None]
         else:
             return []
 
+    async def get_reverse_array(self, session):
+        if self._reverse_arrays_path is None:
+            return None
+
+        # the files are mapped once by version
+        version = await session.redis_bind.get(self.version_key)
+
+        if version is None:
+            self._reverse_array = None
+
+        elif self._reverse_array is None or self._reverse_array.version != int(version):
+            self._reverse_array = await self._load_reverse_array(session, int(version))
+
+        return self._reverse_array
+
+    async def _load_reverse_array(self, session, version):
+        try:
+            return ItemsIndicesReverseArray.load(
+                self._build_reverse_array_filename(version), version)
+        except FileNotFoundError:
+            pass
+
+        snapshot = await self.get_snapshot(session)
+        if snapshot.version is None:
+            return None
+
+        reverse_array = ItemsIndicesReverseArray.from_snapshot(snapshot)
+        os.makedirs(self._reverse_arrays_path, exist_ok=True)
+        filename = self._build_reverse_array_filename(snapshot.version)
+        reverse_array.save(filename)
+        self._remove_old_reverse_arrays()
+        return reverse_array
+
+    def _build_reverse_array_filename(self, version):
+        return os.path.join(
+            self._reverse_arrays_path, '{}_v{}.npy'.format(self.indices_items_key, version))
+
+    def _remove_old_reverse_arrays(self):
+        # the old files are kept by some time after they are replaced,
+        # the processes which read the old versions still can load them
+        prefix = self._build_reverse_array_filename('')[:-len('.npy')]
+        filenames = []
+
+        for filename in glob(self._build_reverse_array_filename('*')):
+            try:
+                filenames.append((int(filename[len(prefix):-len('.npy')]), filename))
+            except ValueError:
+                continue
+
+        filenames = [filename for _, filename in sorted(filenames)]
+        now = time.time()
+
+        for filename, newer_filename in zip(filenames, filenames[1:]):
+            try:
+                if now - os.path.getmtime(newer_filename) > self._old_reverse_arrays_ttl:
+                    os.remove(filename)
+            except OSError:
+                pass
+
     async def get_indices(self, keys, session):
         return [int(index.decode()) for index in \
             await session.redis_bind.hmget(self.key, *keys) if index is not None]
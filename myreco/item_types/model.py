@@ -28,6 +28,7 @@ from jsonschema import ValidationError, validate
 from jsonschema.validators import Draft4Validator, create
 from myreco.engine_strategies.filters.filters import BooleanFilterBy
 from myreco.item_types._store_items_model_meta import _StoreItemsModelBaseMeta
+from myreco.item_types.validator import CompiledValidator
 from myreco.utils import ModuleObjectLoader, build_class_name, build_item_key
 from sqlalchemy.ext.declarative import AbstractConcreteBase, declared_attr
 from swaggerit.method import SwaggerMethod
@@ -42,6 +43,10 @@ ItemValidator = create(store_items_metaschema, Draft4Validator.VALIDATORS)
 ItemValidator.DEFAULT_TYPES['simpleObject'] = dict
 
 
+def build_item_validator(schema):
+    return CompiledValidator(schema, ItemValidator)
+
+
 class _ItemTypesModelBase(AbstractConcreteBase):
     __tablename__ = 'item_types'
     __swagger_json__ = get_swagger_json(__file__)
@@ -168,8 +173,9 @@ class _StoreItemsOperationsMixin(object):
             extra_attributes={
                 'insert_validator': cls._build_insert_validator(item_type),
                 'update_validator': cls._build_update_validator(item_type),
-                'atomic_update_validator': ItemValidator(item_type['schema']),
-                'item_type': item_type
+                'atomic_update_validator': build_item_validator(item_type['schema']),
+                'item_type': item_type,
+                '__data_path__': cls.__data_path__
             }
         )
 
@@ -182,7 +188,7 @@ class _StoreItemsOperationsMixin(object):
 
     @classmethod
     def _build_insert_validator(cls, item_type):
-        return ItemValidator({
+        return build_item_validator({
             'type': 'array',
             'minItems': 1,
             'items': item_type['schema']
@@ -195,7 +201,7 @@ class _StoreItemsOperationsMixin(object):
         if properties:
             properties['_operation'] = {'enum': ['delete', 'update']}
 
-        return ItemValidator({
+        return build_item_validator({
             'type': 'array',
             'minItems': 1,
             'items': schema
@@ -280,6 +286,24 @@ class _StoreItemsOperationsMixin(object):
             stock_filter = BooleanFilterBy(store_items_model, 'stock')
             await stock_filter.update(session, items, items_indices_map_len)
 
+    @classmethod
+    async def _update_stock_filter(cls, store_items_model, session,
+                                   in_stock_keys, out_of_stock_keys):
+        items_indices_map = store_items_model.indices_map
+        stock_filter = BooleanFilterBy(store_items_model, 'stock')
+
+        if not await stock_filter.exists(session):
+            return await cls._set_stock_filter(store_items_model, session)
+
+        snapshot = await items_indices_map.get_snapshot(session)
+        true_indices = snapshot.get_indices(list(in_stock_keys))
+        false_indices = snapshot.get_indices(list(out_of_stock_keys))
+
+        await stock_filter.update_indices(
+            session, true_indices[true_indices != -1], false_indices[false_indices != -1],
+            await items_indices_map.get_length(session)
+        )
+
     @classmethod
     def _set_stock_item(cls, store_items_model, keys, items_indices_map_dict, value, items):
         for key in keys:
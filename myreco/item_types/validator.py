@@ -0,0 +1,225 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import numbers
+import re
+
+
+class _UnsupportedSchema(Exception):
+    pass
+
+
+def _is_number(instance):
+    return isinstance(instance, numbers.Number) and not isinstance(instance, bool)
+
+
+def _is_integer(instance):
+    return isinstance(instance, int) and not isinstance(instance, bool)
+
+
+_TYPES_CHECKERS = {
+    'array': lambda instance: isinstance(instance, list),
+    'boolean': lambda instance: isinstance(instance, bool),
+    'integer': _is_integer,
+    'null': lambda instance: instance is None,
+    'number': _is_number,
+    'object': lambda instance: isinstance(instance, dict),
+    'simpleObject': lambda instance: isinstance(instance, dict),
+    'string': lambda instance: isinstance(instance, str)
+}
+
+# keywords without validation or which are validated with other keyword
+_IGNORED_KEYWORDS = {
+    'id', '$schema', 'title', 'description', 'default', 'definitions',
+    'format', 'id_names', 'exclusiveMinimum', 'exclusiveMaximum'
+}
+
+
+class SchemaCompiler(object):
+
+    def compile(self, schema):
+        checks = []
+
+        for keyword, value in schema.items():
+            if keyword in _IGNORED_KEYWORDS:
+                continue
+
+            compiler = getattr(self, '_compile_' + keyword, None)
+            if compiler is None:
+                raise _UnsupportedSchema(keyword)
+
+            checks.append(compiler(value, schema))
+
+        if not checks:
+            return lambda instance: True
+
+        elif len(checks) == 1:
+            return checks[0]
+
+        return lambda instance: all(check(instance) for check in checks)
+
+    def _compile_type(self, types, schema):
+        types = types if isinstance(types, list) else [types]
+        try:
+            checkers = [_TYPES_CHECKERS[type_] for type_ in types]
+        except KeyError as error:
+            raise _UnsupportedSchema(str(error))
+
+        if len(checkers) == 1:
+            return checkers[0]
+
+        return lambda instance: any(checker(instance) for checker in checkers)
+
+    def _compile_enum(self, enums, schema):
+        return lambda instance: instance in enums
+
+    def _compile_properties(self, properties, schema):
+        checks = [(name, self.compile(subschema)) for name, subschema in properties.items()]
+
+        def check(instance):
+            if not isinstance(instance, dict):
+                return True
+
+            for name, property_check in checks:
+                if name in instance and not property_check(instance[name]):
+                    return False
+
+            return True
+
+        return check
+
+    def _compile_required(self, required, schema):
+        return lambda instance: \
+            not isinstance(instance, dict) or all(name in instance for name in required)
+
+    def _compile_additionalProperties(self, additional_properties, schema):
+        if 'patternProperties' in schema:
+            raise _UnsupportedSchema('patternProperties')
+
+        properties = set(schema.get('properties', {}))
+
+        if additional_properties is True:
+            return lambda instance: True
+
+        elif additional_properties is False:
+            return lambda instance: \
+                not isinstance(instance, dict) or properties.issuperset(instance)
+
+        additional_check = self.compile(additional_properties)
+        return lambda instance: not isinstance(instance, dict) or all(
+            additional_check(value) for name, value in instance.items()
+            if name not in properties
+        )
+
+    def _compile_items(self, items, schema):
+        if not isinstance(items, dict):
+            raise _UnsupportedSchema('items')
+
+        items_check = self.compile(items)
+        return lambda instance: \
+            not isinstance(instance, list) or all(items_check(item) for item in instance)
+
+    def _compile_minItems(self, min_items, schema):
+        return lambda instance: not isinstance(instance, list) or len(instance) >= min_items
+
+    def _compile_maxItems(self, max_items, schema):
+        return lambda instance: not isinstance(instance, list) or len(instance) <= max_items
+
+    def _compile_uniqueItems(self, unique_items, schema):
+        if not unique_items:
+            return lambda instance: True
+
+        # the bools and the unhashable items are checked by the full validator
+        def check(instance):
+            if not isinstance(instance, list):
+                return True
+
+            if any(isinstance(item, (bool, list, dict)) for item in instance):
+                return False
+
+            return len(set(instance)) == len(instance)
+
+        return check
+
+    def _compile_minimum(self, minimum, schema):
+        if schema.get('exclusiveMinimum', False):
+            return lambda instance: not _is_number(instance) or instance > minimum
+
+        return lambda instance: not _is_number(instance) or instance >= minimum
+
+    def _compile_maximum(self, maximum, schema):
+        if schema.get('exclusiveMaximum', False):
+            return lambda instance: not _is_number(instance) or instance < maximum
+
+        return lambda instance: not _is_number(instance) or instance <= maximum
+
+    def _compile_minLength(self, min_length, schema):
+        return lambda instance: not isinstance(instance, str) or len(instance) >= min_length
+
+    def _compile_maxLength(self, max_length, schema):
+        return lambda instance: not isinstance(instance, str) or len(instance) <= max_length
+
+    def _compile_pattern(self, pattern, schema):
+        pattern = re.compile(pattern)
+        return lambda instance: not isinstance(instance, str) or \
+            pattern.search(instance) is not None
+
+    def _compile_allOf(self, schemas, schema):
+        checks = [self.compile(subschema) for subschema in schemas]
+        return lambda instance: all(check(instance) for check in checks)
+
+    def _compile_anyOf(self, schemas, schema):
+        checks = [self.compile(subschema) for subschema in schemas]
+        return lambda instance: any(check(instance) for check in checks)
+
+    # 'oneOf' and 'not' aren't compiled because a compiled check
+    # can fail for a valid instance, so their results can't be trusted
+
+
+class CompiledValidator(object):
+
+    def __init__(self, schema, validator_class):
+        self.schema = schema
+        self._validator = validator_class(schema)
+
+        try:
+            self._check = SchemaCompiler().compile(schema)
+        except _UnsupportedSchema:
+            self._check = None
+
+    def validate(self, instance):
+        # the full validator runs for the invalid instances to build the same errors
+        if self._check is None or not self._check(instance):
+            self._validator.validate(instance)
+
+    def is_valid(self, instance):
+        if self.check(instance):
+            return True
+
+        return self._validator.is_valid(instance)
+
+    def check(self, instance):
+        return self._check is not None and self._check(instance)
+
+    def iter_errors(self, instance):
+        return self._validator.iter_errors(instance)
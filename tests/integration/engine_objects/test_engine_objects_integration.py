@@ -24,6 +24,7 @@
 import asyncio
 import tempfile
 from datetime import datetime
+from io import BytesIO
 from time import sleep
 from unittest import mock
 
@@ -264,7 +265,13 @@ class TestEngineObjectsModelUriTemplatePatch(object):
                 'required': ['days_interval'],
                 'additionalProperties': False,
                 'properties': {
-                    'days_interval': {'type': 'integer'}
+                    'days_interval': {'type': 'integer'},
+                    'export_processes': {'type': 'integer', 'minimum': 1},
+                    'decay_half_life': {
+                        'type': 'number',
+                        'minimum': 0,
+                        'exclusiveMinimum': True
+                    }
                 }
              }
         }
@@ -486,9 +493,8 @@ def set_readers_builders_patch(monkeypatch, values=None):
     if values is None:
         values = [[ujson.dumps({'value': 1, 'item_key': 'test'}).encode()]]
 
-    readers_builder = values
     mock_ = mock.MagicMock()
-    mock_.return_value = readers_builder
+    mock_.side_effect = lambda *args, **kwargs: [BytesIO(b'\n'.join(lines)) for lines in values]
 
     monkeypatch.setattr(
         'myreco.engine_objects.object_base.EngineObjectBase._build_csv_readers',
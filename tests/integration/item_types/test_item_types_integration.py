@@ -726,6 +726,11 @@ def datetime_mock():
 
 
 
+async def _get_versioned_filter(redis, key):
+    version = int(await redis.get(key + ':version'))
+    return await redis.hgetall('{}:v{}'.format(key, version))
+
+
 def set_patches(monkeypatch):
     monkeypatch.setattr('swaggerit.models.orm._jobs_meta.random.getrandbits',
         mock.MagicMock(return_value=131940827655846590526331314439483569710))
@@ -935,7 +940,7 @@ class TestItemTypesModelFiltersUpdater(object):
         for k, v in indices_items_map.items():
             expected2[k] = False if v == 'test' or v == 'test2' else True
 
-        filter_ = await redis.hgetall('store_items_products_1_filter1_filter')
+        filter_ = await _get_versioned_filter(redis, 'store_items_products_1_filter1_filter')
         key1 = '1'.encode()
         key2 = '2'.encode()
         filter_[key1] = np.fromstring(filter_[key1], dtype=np.bool).tolist()
@@ -995,7 +1000,7 @@ class TestItemTypesModelFiltersUpdater(object):
         for k, v in indices_items_map.items():
             expected2[k] = False if v == 'test' or v == 'test2' else True
 
-        filter_ = await redis.hgetall('store_items_products_1_filter3_filter')
+        filter_ = await _get_versioned_filter(redis, 'store_items_products_1_filter3_filter')
         key1 = 'test'.encode()
         key2 = 'test2'.encode()
         filter_[key1] = np.fromstring(filter_[key1], dtype=np.bool).tolist()
@@ -1055,7 +1060,7 @@ class TestItemTypesModelFiltersUpdater(object):
         for k, v in indices_items_map.items():
             expected2[k] = False if v == 'test' or v == 'test2' else True
 
-        filter_ = await redis.hgetall('store_items_products_1_filter4_filter')
+        filter_ = await _get_versioned_filter(redis, 'store_items_products_1_filter4_filter')
         key1 = '(1,)'.encode()
         key2 = '(2,)'.encode()
         filter_[key1] = np.fromstring(filter_[key1], dtype=np.bool).tolist()
@@ -1119,7 +1124,7 @@ class TestItemTypesModelFiltersUpdater(object):
         for k, v in indices_items_map.items():
             expected3[k] = True if v == 'test3' else False
 
-        filter_ = await redis.hgetall('store_items_products_1_filter5_filter')
+        filter_ = await _get_versioned_filter(redis, 'store_items_products_1_filter5_filter')
         key1 = '1'.encode()
         key2 = '2'.encode()
         key3 = '3'.encode()
@@ -0,0 +1,124 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from unittest import mock
+
+import numpy as np
+import pytest
+from myreco.engine_strategies.blended.strategy import BlendedEngineStrategy
+from myreco.engine_strategies.top_seller.array import TopSellerArray
+
+
+class TopSellerArrayTest(TopSellerArray):
+
+    def get_data(self, items_model, session):
+        pass
+
+
+class BlendedEngineStrategyTest(BlendedEngineStrategy):
+    object_types = dict(BlendedEngineStrategy.object_types, top_seller_array=TopSellerArrayTest)
+
+
+def build_object(object_type, configuration):
+    return {
+        'id': 1,
+        'name': object_type,
+        'type': object_type,
+        'strategy': {'name': 'blended'},
+        'configuration': configuration
+    }
+
+
+def build_strategy(*objects_vectors):
+    strategy = BlendedEngineStrategyTest(
+        {'objects': [build_object(type_, config) for type_, config, _ in objects_vectors]})
+
+    for (_, component), (_, _, vector) in zip(strategy._strategies, objects_vectors):
+        async def build_items_vector(session, items_model, vector=vector, **variables):
+            return vector
+
+        component._build_items_vector = build_items_vector
+
+    return strategy
+
+
+class TestBlendedEngineStrategy(object):
+
+    def test_if_config_is_validated_with_objects_schemas(self):
+        strategy = BlendedEngineStrategyTest({'objects': [
+            build_object('top_seller_array', {'days_interval': 7, 'weight': 0.5}),
+            build_object('neighborhood_matrix', {'normalization': 'z_score'})
+        ]})
+        strategy.validate_config()
+
+        strategy._config['neighborhood_matrix']['normalization'] = 'invalid'
+        with pytest.raises(Exception):
+            strategy.validate_config()
+
+    def test_if_variables_are_merged(self):
+        strategy = BlendedEngineStrategyTest({'objects': [
+            build_object('neighborhood_matrix', {}),
+            build_object('visual_similarity_index', {})
+        ]})
+
+        assert [variable['name'] for variable in strategy.get_variables()] == ['item_keys']
+
+    async def test_if_vectors_are_normalized_and_weighted(self):
+        strategy = build_strategy(
+            ('top_seller_array', {'days_interval': 7},
+             np.array([0, 10, 5, 20], dtype=np.int32)),
+            ('neighborhood_matrix', {'normalization': 'rank', 'weight': 2},
+             np.array([0.5, 0, 0.1], dtype=np.float32))
+        )
+        vector = await strategy._build_items_vector(None, mock.MagicMock())
+
+        assert vector.dtype == np.float32
+        assert np.allclose(vector, [0 + 2, 0.5, 0.25 + 1, 1])
+
+    async def test_if_z_score_normalization_scales_and_shifts_vector(self):
+        strategy = build_strategy(
+            ('top_seller_array', {'days_interval': 7, 'normalization': 'z_score'},
+             np.array([1, 2, 3], dtype=np.int32))
+        )
+        vector = await strategy._build_items_vector(None, mock.MagicMock())
+
+        assert np.allclose(vector, [0, 1.2247449, 2.4494898])
+
+    async def test_if_z_score_normalization_keeps_scored_items_on_best_indices(self):
+        strategy = build_strategy(
+            ('top_seller_array', {'days_interval': 7, 'normalization': 'z_score'},
+             np.array([0, 1, 3, 2], dtype=np.int32)),
+            ('neighborhood_matrix', {'normalization': 'z_score'},
+             np.array([0, 0, 0, 5], dtype=np.float32))
+        )
+        vector = await strategy._build_items_vector(None, mock.MagicMock())
+
+        assert strategy._get_best_indices(vector, 4) == [3, 2, 1]
+
+    async def test_if_empty_vectors_are_ignored(self):
+        strategy = build_strategy(
+            ('top_seller_array', {'days_interval': 7}, None),
+            ('neighborhood_matrix', {}, None)
+        )
+
+        assert await strategy._build_items_vector(None, mock.MagicMock()) is None
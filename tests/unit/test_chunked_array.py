@@ -0,0 +1,93 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from unittest import mock
+
+import numpy as np
+import pytest
+from myreco.engine_objects import chunked_array
+from myreco.engine_objects.chunked_array import ChunkedArray
+
+
+@pytest.fixture
+def array():
+    return np.random.RandomState(0).randint(-100, 1000, 1000).astype(np.int32)
+
+
+class TestChunkedArray(object):
+
+    @pytest.mark.parametrize('codec', ['raw', 'zlib', 'delta_bitpack'])
+    @pytest.mark.parametrize('dtype', [np.int8, np.int32, np.uint64, np.int64])
+    def test_if_pack_and_unpack_keeps_array(self, array, codec, dtype):
+        array = array.astype(dtype)
+        chunked = ChunkedArray(ChunkedArray.pack(array, codec, chunk_size=300))
+
+        assert chunked.dtype == array.dtype
+        assert chunked.shape == (1000,)
+        assert chunked.chunks == 4
+        assert np.array_equal(chunked.to_array(), array)
+
+    @pytest.mark.parametrize('codec', ['lz4', 'zstd'])
+    def test_if_optional_codecs_keeps_array(self, array, codec):
+        if getattr(chunked_array, codec) is None:
+            pytest.skip("'{}' isn't installed".format(codec))
+
+        chunked = ChunkedArray(ChunkedArray.pack(array, codec, chunk_size=300))
+        assert np.array_equal(chunked.to_array(), array)
+
+    def test_if_delta_bitpack_keeps_extreme_values(self):
+        array = np.array([np.iinfo(np.int64).min, np.iinfo(np.int64).max, 0, -5])
+        chunked = ChunkedArray(ChunkedArray.pack(array, 'delta_bitpack'))
+
+        assert np.array_equal(chunked.to_array(), array)
+
+    def test_if_delta_bitpack_raises_error_for_floats(self):
+        with pytest.raises(ValueError):
+            ChunkedArray.pack(np.zeros(10), 'delta_bitpack')
+
+    def test_if_pack_keeps_shape(self):
+        array = np.arange(12.).reshape(3, 4)
+        chunked = ChunkedArray(ChunkedArray.pack(array, chunk_size=5))
+
+        assert chunked.shape == (3, 4)
+        assert np.array_equal(chunked.to_array(), array)
+
+    def test_if_uncompressible_chunks_are_stored_raw(self):
+        array = np.zeros(200, dtype=np.int8)
+        array[100:] = np.random.RandomState(0).randint(-128, 127, 100)
+        chunked = ChunkedArray(ChunkedArray.pack(array, 'zlib', chunk_size=100))
+
+        assert chunked._codecs.tolist() == [chunked_array.ZLIB, chunked_array.RAW]
+        assert np.array_equal(chunked.to_array(), array)
+
+    def test_if_get_slice_decompresses_only_needed_chunks(self, array):
+        chunked = ChunkedArray(ChunkedArray.pack(array, chunk_size=300))
+
+        with mock.patch.object(chunked, 'get_chunk', wraps=chunked.get_chunk) as get_chunk:
+            assert np.array_equal(chunked.get_slice(310, 650), array[310:650])
+
+        assert get_chunk.call_args_list == [mock.call(1), mock.call(2)]
+
+    def test_if_unpack_raises_error_for_invalid_data(self):
+        with pytest.raises(ValueError):
+            ChunkedArray(b'\x00' * 32)
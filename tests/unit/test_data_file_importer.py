@@ -0,0 +1,382 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import asyncio
+from gzip import GzipFile
+from tempfile import NamedTemporaryFile
+from unittest import mock
+from zipfile import ZipFile
+
+import pytest
+from myreco.item_types.data_file_importer.feed_readers import (CSVFeedReader,
+                                                               NDJSONFeedReader,
+                                                               _build_fingerprint,
+                                                               _process_csv_rows,
+                                                               _process_lines)
+from myreco.item_types.data_file_importer.model import (ItemTypesDataFileImporterModelBase,
+                                                        _ImportCheckpoint)
+
+import ujson
+
+
+schema = {
+    'type': 'object',
+    'id_names': ['id'],
+    'properties': {'id': {'type': 'integer'}}
+}
+
+
+def CoroMock():
+    coro = mock.MagicMock(name="CoroutineResult")
+    corofunc = mock.MagicMock(name="CoroutineFunction", side_effect=asyncio.coroutine(coro))
+    corofunc.coro = coro
+    return corofunc
+
+
+def build_reader(lines):
+    return NDJSONFeedReader(lines, 'application/x-ndjson')
+
+
+@pytest.fixture
+def importer():
+    class ImporterTest(ItemTypesDataFileImporterModelBase):
+        __import_processes__ = 1
+        __import_chunk_size__ = 2
+        _logger = mock.MagicMock()
+        _update_stock_filter = mock.MagicMock()
+
+        @classmethod
+        def _run_coro(cls, coro, session):
+            return coro
+
+    return ImporterTest
+
+
+@pytest.fixture
+def store_items_model():
+    model = mock.MagicMock()
+    model.__key__ = 'test'
+    model.fingerprints_key = 'test_fingerprints'
+    model.item_type = {'schema': schema}
+    model.get_instance_key.side_effect = lambda item: str(item['id']).encode()
+    del model.pre_process_feed
+    return model
+
+
+@pytest.fixture
+def session():
+    session = mock.MagicMock()
+    session.redis_bind.hkeys.return_value = [b'1', b'9']
+    session.redis_bind.hmget.side_effect = lambda key, *keys: [None] * len(keys)
+    return session
+
+
+class TestProcessLines(object):
+
+    def test_if_process_lines_counts_lines(self):
+        items, fingerprints, errors, empty_lines = _process_lines(
+            ujson.dumps(schema), [b'{"id": 1}\n', b'\n', b'{"id": "a"}\n', 'invalid'])
+
+        assert items == [{'id': 1}]
+        assert fingerprints == [_build_fingerprint({'id': 1})]
+        assert [line for line, _ in errors] == ['invalid', b'{"id": "a"}\n']
+        assert empty_lines == 1
+
+    def test_if_process_lines_validates_items_one_by_one_when_batch_is_invalid(self):
+        items, _, errors, _ = _process_lines(
+            ujson.dumps(schema), [b'{"id": "a"}', b'{"id": 2}', b'{"id": "b"}'])
+
+        assert items == [{'id': 2}]
+        assert [line for line, _ in errors] == [b'{"id": "a"}', b'{"id": "b"}']
+
+
+class TestProcessCSVRows(object):
+
+    def test_if_process_csv_rows_builds_items_with_schema_types(self):
+        csv_schema = {
+            'type': 'object',
+            'id_names': ['id'],
+            'properties': {
+                'id': {'type': 'integer'},
+                'name': {'type': 'string'},
+                'tags': {'type': 'array', 'items': {'type': 'string'}}
+            }
+        }
+        items, fingerprints, errors, empty_lines = _process_csv_rows(
+            ujson.dumps(csv_schema), (['id', 'name', 'tags'], [
+                ['1', 'test', '["a","b"]'], ['', '', ''], ['2', '', ''], ['c', '', '']
+            ])
+        )
+
+        assert items == [{'id': 1, 'name': 'test', 'tags': ['a', 'b']}, {'id': 2}]
+        assert fingerprints == [_build_fingerprint(item) for item in items]
+        assert [line for line, _ in errors] == [['c', '', '']]
+        assert empty_lines == 1
+
+    def test_if_process_csv_rows_keeps_columns_outside_schema_as_strings(self):
+        csv_schema = {'type': 'object', 'id_names': ['id'], 'properties': {'id': {}}}
+        items, _, errors, _ = _process_csv_rows(
+            ujson.dumps(csv_schema), (['id', 'color'], [['1', 'blue'], ['2', '[1]']]))
+
+        assert items == [{'id': '1', 'color': 'blue'}, {'id': '2', 'color': '[1]'}]
+        assert errors == []
+
+
+class TestUpdateItemsFromFile(object):
+
+    def test_if_update_returns_counters(self, importer, store_items_model, session):
+        feed = [b'{"id": 1}', b'', b'{"id": 2}', b'{"id": 3}', b'{"id": "a"}']
+        assert importer._update_items_from_file(build_reader(feed), store_items_model, session) == \
+            {'success_lines': 3, 'errors_lines': 1, 'empty_lines': 1,
+             'changed_lines': 3, 'unchanged_lines': 0, 'deleted_lines': 1}
+
+    def test_if_update_inserts_chunks_in_order(self, importer, store_items_model, session):
+        feed = [b'{"id": 1}', b'{"id": 2}', b'{"id": 3}']
+        importer._update_items_from_file(build_reader(feed), store_items_model, session)
+
+        assert store_items_model.insert.call_args_list == [
+            mock.call(session, [{'id': 1}, {'id': 2}], skip_validation=True, fingerprints={
+                b'1': _build_fingerprint({'id': 1}), b'2': _build_fingerprint({'id': 2})
+            }),
+            mock.call(session, [{'id': 3}], skip_validation=True,
+                      fingerprints={b'3': _build_fingerprint({'id': 3})})
+        ]
+
+    def test_if_update_skips_unchanged_items(self, importer, store_items_model, session):
+        session.redis_bind.hmget.side_effect = \
+            lambda key, *keys: [_build_fingerprint({'id': 1}), b'old']
+        feed = [b'{"id": 1}', b'{"id": 2}']
+        ret = importer._update_items_from_file(build_reader(feed), store_items_model, session)
+
+        assert store_items_model.insert.call_args_list == [
+            mock.call(session, [{'id': 2}], skip_validation=True,
+                      fingerprints={b'2': _build_fingerprint({'id': 2})})
+        ]
+        assert ret['changed_lines'] == 1
+        assert ret['unchanged_lines'] == 1
+
+    def test_if_fingerprint_ignores_keys_order(self):
+        assert _build_fingerprint({'id': 1, 'name': 'a'}) == \
+            _build_fingerprint({'name': 'a', 'id': 1})
+
+    def test_if_update_deletes_old_keys(self, importer, store_items_model, session):
+        store_items_model.indices_map.changes_key = 'test_indices_changes'
+        ret = importer._update_items_from_file(
+            build_reader([b'{"id": 1}']), store_items_model, session)
+        pipeline = session.redis_bind.pipeline.return_value
+
+        assert ret['deleted_lines'] == 1
+        assert pipeline.hdel.call_args_list == [
+            mock.call('test', b'9'), mock.call('test_fingerprints', b'9')
+        ]
+        assert pipeline.sadd.call_args_list == [mock.call('test_indices_changes', b'9')]
+
+    def test_if_update_deletes_old_keys_in_chunks(self, importer, store_items_model, session):
+        importer.__delete_chunk_size__ = 2
+        session.redis_bind.hkeys.return_value = [b'7', b'8', b'9']
+        ret = importer._update_items_from_file(
+            build_reader([b'{"id": 1}']), store_items_model, session)
+
+        assert ret['deleted_lines'] == 3
+        assert session.redis_bind.pipeline.return_value.execute.call_count == 2
+
+    def test_if_update_changes_stock_of_changed_and_old_items(
+            self, importer, store_items_model, session):
+        importer._update_items_from_file(
+            build_reader([b'{"id": 1}']), store_items_model, session)
+
+        assert importer._update_stock_filter.call_args_list == \
+            [mock.call(store_items_model, session, {b'1'}, {b'9'})]
+
+    def test_if_update_raises_writer_error(self, importer, store_items_model, session):
+        store_items_model.insert.side_effect = ValueError('test')
+
+        with pytest.raises(ValueError):
+            importer._update_items_from_file(
+                build_reader([b'{"id": 1}']), store_items_model, session)
+
+    def test_if_update_stops_reading_after_writer_error(
+            self, importer, store_items_model, session):
+        importer.__import_queue_size__ = 1
+        store_items_model.insert.side_effect = ValueError('test')
+        read_lines = []
+
+        def read_feed():
+            for i in range(200):
+                read_lines.append(i)
+                yield ujson.dumps({'id': i}).encode()
+
+        with pytest.raises(ValueError):
+            importer._update_items_from_file(
+                build_reader(read_feed()), store_items_model, session)
+
+        assert len(read_lines) < 20
+
+    async def test_if_post_closes_spooled_feed_without_store_items(
+            self, importer, monkeypatch):
+        spooled_files = []
+
+        def build_spooled_file():
+            spooled_files.append(NamedTemporaryFile())
+            return spooled_files[-1]
+
+        monkeypatch.setattr(
+            'myreco.item_types.data_file_importer.model.NamedTemporaryFile', build_spooled_file)
+        importer._get_store_items_model = CoroMock()
+        importer._get_store_items_model.coro.return_value = None
+        importer._build_response = mock.MagicMock()
+        req = mock.MagicMock(
+            headers={'content-type': 'application/x-ndjson'}, query={'store_id': 1})
+        req.body.read = CoroMock()
+        req.body.read.coro.side_effect = [b'{"id": 1}', b'']
+        await importer.post_import_data_file_job(req, mock.MagicMock())
+
+        assert importer._build_response.call_args == mock.call(404)
+        assert spooled_files[0].closed
+
+
+class TestImportCheckpoint(object):
+
+    def test_if_update_skips_checkpointed_chunks(self, importer, store_items_model, session):
+        checkpoint = mock.MagicMock(chunks=0)
+        checkpoint.load.return_value = 1
+        feed = [b'{"id": 1}', b'{"id": 2}', b'{"id": 3}']
+        importer._update_items_from_file(
+            build_reader(feed), store_items_model, session, checkpoint)
+
+        assert store_items_model.insert.call_args_list == [
+            mock.call(session, [{'id': 3}], skip_validation=True,
+                      fingerprints={b'3': _build_fingerprint({'id': 3})})
+        ]
+        assert checkpoint.chunks == 1
+        assert checkpoint.clear.call_args_list == [mock.call(session)]
+
+    def test_if_update_saves_checkpoint_before_insert(
+            self, importer, store_items_model, session):
+        checkpoint = mock.MagicMock(chunks=0)
+        checkpoint.load.return_value = 0
+        store_items_model.insert.side_effect = ValueError('test')
+
+        with pytest.raises(ValueError):
+            importer._update_items_from_file(
+                build_reader([b'{"id": 1}']), store_items_model, session, checkpoint)
+
+        assert checkpoint.save.call_args_list == [
+            mock.call(session, mock.ANY, [b'1'], {b'1': mock.ANY}.keys())
+        ]
+        assert checkpoint.chunks == 0
+
+    async def test_if_load_restores_checkpoint(self, store_items_model):
+        session = mock.MagicMock()
+        session.redis_bind.hgetall = CoroMock()
+        session.redis_bind.hgetall.coro.return_value = {
+            b'feed_digest': b'test', b'chunk_size': b'2', b'chunks': b'3',
+            b'success_lines': b'6'
+        }
+        session.redis_bind.smembers = CoroMock()
+        session.redis_bind.smembers.coro.side_effect = [{b'1', b'2'}, {b'2'}]
+        checkpoint = _ImportCheckpoint(store_items_model, 'test', 2)
+        counters = {'success_lines': 0}
+        new_keys = set()
+        changed_keys = set()
+
+        assert await checkpoint.load(session, counters, new_keys, changed_keys) == 3
+        assert counters == {'success_lines': 6}
+        assert new_keys == {b'1', b'2'}
+        assert changed_keys == {b'2'}
+
+    async def test_if_load_clears_checkpoint_of_other_feed(self, store_items_model):
+        session = mock.MagicMock()
+        session.redis_bind.hgetall = CoroMock()
+        session.redis_bind.hgetall.coro.return_value = \
+            {b'feed_digest': b'other', b'chunk_size': b'2', b'chunks': b'3'}
+        session.redis_bind.delete = CoroMock()
+        checkpoint = _ImportCheckpoint(store_items_model, 'test', 2)
+
+        assert await checkpoint.load(session, {}, set(), set()) == 0
+        assert session.redis_bind.delete.call_args_list == [mock.call(
+            'test_import_checkpoint', 'test_import_new_keys', 'test_import_changed_keys'
+        )]
+
+
+@pytest.fixture
+def spooled_file():
+    return NamedTemporaryFile()
+
+
+class TestFeedReaders(object):
+
+    def test_if_ndjson_reader_reads_gzip_stream(self, spooled_file):
+        with GzipFile(fileobj=spooled_file, mode='wb') as file_:
+            file_.write(b'{"id": 1}\n{"id": 2}\n{"id": 3}\n')
+        spooled_file.seek(0)
+
+        reader = NDJSONFeedReader(spooled_file, 'application/gzip')
+        assert list(reader.read_chunks(2)) == \
+            [[b'{"id": 1}\n', b'{"id": 2}\n'], [b'{"id": 3}\n']]
+
+    def test_if_ndjson_reader_reads_zip_stream(self, spooled_file):
+        with ZipFile(spooled_file, 'w') as file_:
+            file_.writestr('feed.json', b'{"id": 1}\n')
+        spooled_file.seek(0)
+
+        reader = NDJSONFeedReader(spooled_file, 'application/zip')
+        assert list(reader.read_chunks(2)) == [[b'{"id": 1}\n']]
+
+    def test_if_csv_reader_yields_header_with_rows(self, spooled_file):
+        spooled_file.write(b'id,name\n1,"a,b"\n2,c\n3,d\n')
+        spooled_file.seek(0)
+
+        reader = CSVFeedReader(spooled_file, 'text/csv')
+        assert list(reader.read_chunks(2)) == [
+            (['id', 'name'], [['1', 'a,b'], ['2', 'c']]),
+            (['id', 'name'], [['3', 'd']])
+        ]
+
+    def test_if_csv_reader_dont_calls_lines_hook(self, spooled_file):
+        spooled_file.write(b'id\n1\n')
+        spooled_file.seek(0)
+        store_items_model = mock.MagicMock()
+
+        reader = CSVFeedReader(spooled_file, 'text/csv')
+        reader.pre_process_feed(store_items_model, mock.MagicMock())
+
+        assert not store_items_model.pre_process_feed.called
+        assert list(reader.read_chunks(2)) == [(['id'], [['1']])]
+
+    def test_if_update_imports_csv_file(self, importer, store_items_model,
+                                        session, spooled_file):
+        spooled_file.write(b'id\n1\n2\n')
+        spooled_file.seek(0)
+
+        ret = importer._update_items_from_zipped_file(
+            spooled_file, store_items_model, 'text/csv', session)
+
+        assert ret['success_lines'] == 2
+        assert ret['deleted_lines'] == 1
+
+    def test_if_register_feed_reader_dont_changes_parent_readers(self, importer):
+        importer.register_feed_reader('text/plain', NDJSONFeedReader)
+
+        assert importer.__feed_readers__['text/plain'] is NDJSONFeedReader
+        assert 'text/plain' not in ItemTypesDataFileImporterModelBase.__feed_readers__
@@ -0,0 +1,277 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import asyncio
+from unittest import mock
+
+import pytest
+from myreco.engine_objects.exporter.model import EngineObjectsExporterModelBase
+from myreco.exceptions import EngineError
+
+import ujson
+
+
+class TransactionTest(object):
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def hdel(self, *args):
+        self.commands.append(self.redis.hdel(*args))
+
+    def delete(self, *args):
+        self.commands.append(self.redis.delete(*args))
+
+    async def execute(self):
+        return [await command for command in self.commands]
+
+
+class RedisTest(object):
+    SET_IF_NOT_EXIST = 'SET_IF_NOT_EXIST'
+
+    def __init__(self):
+        self.hashes = dict()
+        self.strings = dict()
+
+    async def set(self, key, value, expire=0, exist=None):
+        if exist is self.SET_IF_NOT_EXIST and key in self.strings:
+            return None
+
+        self.strings[key] = value
+        return True
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.strings.pop(key, None)
+
+    async def hmset_dict(self, key, dict_):
+        self.hashes.setdefault(key, dict()).update(dict_)
+
+    async def hset(self, key, field, value):
+        self.hashes.setdefault(key, dict())[field] = value
+
+    async def hdel(self, key, *fields):
+        for field in fields:
+            self.hashes.get(key, {}).pop(field, None)
+
+    async def hgetall(self, key):
+        return {k.encode(): v.encode() for k, v in self.hashes.get(key, {}).items()}
+
+    def multi_exec(self):
+        return TransactionTest(self)
+
+
+class ExporterModelTest(EngineObjectsExporterModelBase):
+    _logger = mock.MagicMock()
+
+    @classmethod
+    def _pack_obj(cls, obj):
+        return ujson.dumps(obj)
+
+    @classmethod
+    def _unpack_obj(cls, obj):
+        return ujson.loads(obj)
+
+    @classmethod
+    def _build_response(cls, status, body=None):
+        return status, body
+
+    @classmethod
+    def get_engine_object_instance(cls, engine_object):
+        return engine_object.instance
+
+    @classmethod
+    def _get_items_model(cls, engine_object):
+        return engine_object.items_model
+
+
+def build_engine_object(id_, items_model, configuration={}):
+    engine_object = mock.MagicMock(id=id_, type='top_seller_array', items_model=items_model)
+    engine_object.strategy.name = 'top_seller'
+    engine_object.instance.export.return_value = {'length': id_}
+    engine_object.instance.get_input_key = lambda items_model: \
+        ('top_seller_array', items_model.__key__, ujson.dumps(configuration, sort_keys=True))
+    return engine_object
+
+
+@pytest.fixture
+def session():
+    return mock.MagicMock(redis_bind=RedisTest(), loop=asyncio.get_event_loop())
+
+
+@pytest.fixture
+def items_model():
+    items_model = mock.MagicMock(__key__='products_1')
+
+    async def get_shared_snapshot(session):
+        return 'snapshot'
+
+    items_model.indices_map.get_shared_snapshot = mock.MagicMock(side_effect=get_shared_snapshot)
+    return items_model
+
+
+async def run_export_objects_jobs(session, engine_objects, query={}):
+    return await session.loop.run_in_executor(
+        None, ExporterModelTest._run_export_objects_jobs,
+        mock.MagicMock(query=query), session, engine_objects
+    )
+
+
+async def run_export_objects_job(session, engine_object, query={}):
+    return await session.loop.run_in_executor(
+        None, ExporterModelTest._run_export_objects_job,
+        mock.MagicMock(query=query), session, engine_object
+    )
+
+
+class TestEngineObjectsExporterScheduler(object):
+
+    async def test_if_objects_sharing_input_import_once(self, session, items_model):
+        leader, follower = build_engine_object(1, items_model), build_engine_object(2, items_model)
+        leader.instance.get_data.return_value = 'imported'
+        ret = await run_export_objects_jobs(session, [leader, follower], {'import_data': True})
+
+        assert ret == {
+            'done': {
+                'top_seller_top_seller_array_1_exporter': {
+                    'importer': 'imported', 'exporter': {'length': 1}
+                },
+                'top_seller_top_seller_array_2_exporter': {
+                    'importer': {'shared_with': 'top_seller_top_seller_array_1_exporter'},
+                    'exporter': {'length': 2}
+                }
+            },
+            'error': {},
+            'skipped': []
+        }
+        assert not follower.instance.get_data.called
+        follower.instance.share_data_path.assert_called_once_with(leader.instance)
+
+    async def test_if_objects_with_other_input_import_apart(self, session, items_model):
+        other_items_model = mock.MagicMock(__key__='products_2')
+        other_items_model.indices_map = items_model.indices_map
+        engine_objects = [build_engine_object(1, items_model),
+                          build_engine_object(2, other_items_model)]
+        ret = await run_export_objects_jobs(session, engine_objects, {'import_data': True})
+
+        assert len(ret['done']) == 2
+        for engine_object in engine_objects:
+            assert engine_object.instance.get_data.call_count == 1
+            assert not engine_object.instance.share_data_path.called
+
+    async def test_if_objects_with_other_configuration_import_apart(self, session, items_model):
+        engine_objects = [build_engine_object(1, items_model, {'days_interval': 1}),
+                          build_engine_object(2, items_model, {'days_interval': 2})]
+        ret = await run_export_objects_jobs(session, engine_objects, {'import_data': True})
+
+        assert len(ret['done']) == 2
+        for engine_object in engine_objects:
+            assert engine_object.instance.get_data.call_count == 1
+
+    async def test_if_import_error_is_set_on_all_objects_of_input(self, session, items_model):
+        engine_objects = [build_engine_object(1, items_model), build_engine_object(2, items_model)]
+        engine_objects[0].instance.get_data.side_effect = ValueError('test')
+        ret = await run_export_objects_jobs(session, engine_objects, {'import_data': True})
+
+        assert ret['done'] == {}
+        assert list(ret['error'].values()) == [{'name': 'ValueError', 'message': 'test'}] * 2
+        assert not engine_objects[1].instance.export.called
+
+    async def test_if_indices_map_is_loaded_once_by_items(self, session, items_model):
+        engine_objects = [build_engine_object(i, items_model) for i in range(3)]
+        await run_export_objects_jobs(session, engine_objects)
+
+        assert items_model.indices_map.get_shared_snapshot.call_count == 1
+        for engine_object in engine_objects:
+            engine_object.instance.set_items_indices_map_dict.assert_called_once_with('snapshot')
+
+    async def test_if_locked_objects_are_skipped(self, session, items_model):
+        session.redis_bind.strings[ExporterModelTest._build_export_lock_key(
+            'top_seller_top_seller_array_1_exporter')] = 1
+        engine_objects = [build_engine_object(i, items_model) for i in (1, 2)]
+        ret = await run_export_objects_jobs(session, engine_objects)
+
+        assert ret['skipped'] == ['top_seller_top_seller_array_1_exporter']
+        assert list(ret['done']) == ['top_seller_top_seller_array_2_exporter']
+        assert not engine_objects[0].instance.export.called
+
+    async def test_if_locks_are_released_after_export(self, session, items_model):
+        engine_objects = [build_engine_object(i, items_model) for i in (1, 2)]
+        engine_objects[1].instance.export.side_effect = ValueError('test')
+        await run_export_objects_jobs(session, engine_objects)
+
+        assert session.redis_bind.strings == {}
+        assert list((await run_export_objects_jobs(session, engine_objects[:1]))['done']) == \
+            ['top_seller_top_seller_array_1_exporter']
+
+    async def test_if_locks_are_released_on_job_error(self, session, items_model):
+        items_model.indices_map.get_shared_snapshot.side_effect = ValueError('test')
+
+        with pytest.raises(ValueError):
+            await run_export_objects_jobs(session, [build_engine_object(1, items_model)])
+
+        assert session.redis_bind.strings == {}
+        assert session.redis_bind.hashes[ExporterModelTest.__export_queue_key__] == {}
+
+    async def test_if_finished_objects_are_removed_from_queue(self, session, items_model):
+        engine_objects = [build_engine_object(i, items_model) for i in (1, 2)]
+        engine_objects[1].instance.export.side_effect = ValueError('test')
+        ret = await run_export_objects_jobs(session, engine_objects)
+        status, _ = await ExporterModelTest.get_export_queue(mock.MagicMock(), session)
+
+        assert ret['error'] == {
+            'top_seller_top_seller_array_2_exporter': {'name': 'ValueError', 'message': 'test'}
+        }
+        assert status == 404
+
+    async def test_if_single_export_skips_locked_object(self, session, items_model):
+        engine_object = build_engine_object(1, items_model)
+        lock_key = ExporterModelTest._build_export_lock_key(
+            'top_seller_top_seller_array_1_exporter')
+        session.redis_bind.strings[lock_key] = 1
+
+        with pytest.raises(EngineError):
+            await run_export_objects_job(session, engine_object)
+
+        assert not engine_object.instance.export.called
+        assert session.redis_bind.strings == {lock_key: 1}
+
+    async def test_if_single_export_releases_its_lock(self, session, items_model):
+        engine_object = build_engine_object(1, items_model)
+        engine_object.instance.export.side_effect = ValueError('test')
+
+        with pytest.raises(ValueError):
+            await run_export_objects_job(session, engine_object)
+
+        assert session.redis_bind.strings == {}
+        assert list((await run_export_objects_jobs(session, [engine_object]))['error']) == \
+            ['top_seller_top_seller_array_1_exporter']
+
+    async def test_if_objects_are_imported_before_export(self, session, items_model):
+        engine_object = build_engine_object(1, items_model)
+        engine_object.instance.get_data.return_value = 'imported'
+        ret = await run_export_objects_jobs(session, [engine_object], {'import_data': True})
+
+        assert ret['done']['top_seller_top_seller_array_1_exporter'] == \
+            {'importer': 'imported', 'exporter': {'length': 1}}
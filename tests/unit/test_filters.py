@@ -0,0 +1,301 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import asyncio
+from unittest import mock
+
+import numpy as np
+
+import pytest
+from myreco.engine_strategies.filters.filters import (ArrayFilterBy,
+                                                      BooleanFilterBy,
+                                                      FilterColumn,
+                                                      IndexFilterByPropertyOf,
+                                                      ObjectFilterBy,
+                                                      SimpleFilterBy)
+
+
+def CoroMock():
+    coro = mock.MagicMock(name="CoroutineResult")
+    corofunc = mock.MagicMock(name="CoroutineFunction", side_effect=asyncio.coroutine(coro))
+    corofunc.coro = coro
+    return corofunc
+
+
+@pytest.fixture
+def items_model():
+    items_model = mock.MagicMock()
+    items_model.__key__ = 'test'
+    return items_model
+
+
+@pytest.fixture
+def session():
+    m = mock.MagicMock()
+    m.redis_bind.set = CoroMock()
+    m.redis_bind.get = CoroMock()
+    m.redis_bind.get.coro.return_value = None
+    m.redis_bind.hmget = CoroMock()
+    m.redis_bind.incr = CoroMock()
+    m.redis_bind.incr.coro.return_value = 2
+    m.redis_bind.getset = CoroMock()
+    m.redis_bind.getset.coro.return_value = b'1'
+    m.redis_bind.expire = CoroMock()
+    m.redis_bind.pipeline.return_value.execute = CoroMock()
+    return m
+
+
+@pytest.fixture
+def items():
+    return [
+        {'index': 0, 'filter': 'a', 'array': [1, 2], 'object': {'id': 1}, 'bool': True},
+        {'index': 1, 'filter': 'b', 'array': [2], 'object': {'id': 2}, 'bool': False},
+        {'index': 2, 'filter': 'a', 'array': None, 'object': {'id': 1}, 'bool': True},
+        {'filter': 'c', 'array': [3], 'object': {'id': 3}, 'bool': True}
+    ]
+
+
+def _groups(column):
+    return {value: indices.tolist() for value, indices in column.group()}
+
+
+class TestFilterColumn(object):
+
+    def test_if_group_returns_nothing_when_empty(self):
+        assert list(FilterColumn().group()) == []
+
+    def test_if_group_returns_indices_grouped_by_value(self):
+        column = FilterColumn()
+        for value, index in [('b', 3), ('a', 0), ('b', 1), ('c', 2), ('a', 4)]:
+            column.append(value, index)
+
+        assert _groups(column) == {'a': [0, 4], 'b': [3, 1], 'c': [2]}
+
+
+class TestFiltersBuildColumn(object):
+
+    def test_if_simple_filter_builds_column(self, items_model, items):
+        filter_ = SimpleFilterBy(items_model, 'filter')
+        assert _groups(filter_.build_column(items)) == {'a': [0, 2], 'b': [1]}
+
+    def test_if_simple_filter_skip_values(self, items_model, items):
+        filter_ = SimpleFilterBy(items_model, 'filter', skip_values=['a'])
+        assert _groups(filter_.build_column(items)) == {'b': [1]}
+
+    def test_if_array_filter_builds_column(self, items_model, items):
+        filter_ = ArrayFilterBy(items_model, 'array')
+        assert _groups(filter_.build_column(items)) == {1: [0], 2: [0, 1]}
+
+    def test_if_object_filter_builds_column(self, items_model, items):
+        filter_ = ObjectFilterBy(items_model, 'object', id_names=['id'])
+        assert _groups(filter_.build_column(items)) == {'(1,)': [0, 2], '(2,)': [1]}
+
+
+class TestFiltersUpdateFromColumn(object):
+
+    async def test_if_boolean_filter_sets_filter(self, items_model, items, session):
+        filter_ = BooleanFilterBy(items_model, 'bool')
+        ret = await filter_.update_from_column(session, filter_.build_column(items), 4)
+
+        assert ret == {'true_values': 2}
+        assert session.redis_bind.set.coro.call_args_list == [
+            mock.call('test_bool_filter', np.array([True, False, True, False]).tobytes()),
+            mock.call('test_bool_filter:count', 2)
+        ]
+
+    async def test_if_multiple_filter_pipelines_filters(self, items_model, items, session):
+        filter_ = SimpleFilterBy(items_model, 'filter')
+        ret = await filter_.update_from_column(session, filter_.build_column(items), 3)
+        pipeline = session.redis_bind.pipeline.return_value
+
+        assert ret == {'filters_quantity': 2}
+        assert pipeline.hset.call_args_list == [
+            mock.call('test_filter_filter:v2', 'a', np.array([True, False, True]).tobytes()),
+            mock.call('test_filter_filter:v2:counts', 'a', 2),
+            mock.call('test_filter_filter:v2', 'b', np.array([False, True, False]).tobytes()),
+            mock.call('test_filter_filter:v2:counts', 'b', 1)
+        ]
+        assert pipeline.execute.coro.call_count == 1
+
+    async def test_if_multiple_filter_dont_executes_empty_pipeline(self, items_model, session):
+        filter_ = SimpleFilterBy(items_model, 'filter')
+        ret = await filter_.update_from_column(session, FilterColumn(), 3)
+
+        assert ret == {'filters_quantity': 0}
+        assert session.redis_bind.pipeline.return_value.execute.coro.call_count == 0
+
+
+class TestMultipleFilterVersions(object):
+
+    async def test_if_update_publishes_new_version(self, items_model, items, session):
+        filter_ = SimpleFilterBy(items_model, 'filter')
+        await filter_.update_from_column(session, filter_.build_column(items), 3)
+
+        assert session.redis_bind.incr.coro.call_args_list == [mock.call('test_filter_filter:counter')]
+        assert session.redis_bind.getset.coro.call_args_list == [mock.call('test_filter_filter:version', 2)]
+
+    async def test_if_update_expires_old_version(self, items_model, items, session):
+        filter_ = SimpleFilterBy(items_model, 'filter')
+        await filter_.update_from_column(session, filter_.build_column(items), 3)
+
+        assert session.redis_bind.expire.coro.call_args_list == [
+            mock.call('test_filter_filter:v1', 60),
+            mock.call('test_filter_filter:v1:counts', 60)
+        ]
+
+    async def test_if_update_expires_unversioned_filter(self, items_model, items, session):
+        session.redis_bind.getset.coro.return_value = None
+        filter_ = SimpleFilterBy(items_model, 'filter')
+        await filter_.update_from_column(session, filter_.build_column(items), 3)
+
+        assert session.redis_bind.expire.coro.call_args_list == [mock.call('test_filter_filter', 60)]
+
+    async def test_if_filter_reads_current_version(self, items_model, session):
+        session.redis_bind.get.coro.return_value = b'3'
+        session.redis_bind.hmget.coro.return_value = [np.array([True, False]).tobytes()]
+        filter_ = SimpleFilterBy(items_model, 'filter')
+        items_vector = np.array([1, 1], dtype=np.int32)
+        await filter_.filter(session, items_vector, ['a'])
+
+        assert session.redis_bind.hmget.coro.call_args_list == [mock.call('test_filter_filter:v3', 'a')]
+        assert items_vector.tolist() == [1, 0]
+
+    async def test_if_filter_reads_unversioned_filter(self, items_model, session):
+        session.redis_bind.hmget.coro.return_value = [None]
+        filter_ = SimpleFilterBy(items_model, 'filter')
+        await filter_.filter(session, np.array([1, 1], dtype=np.int32), ['a'])
+
+        assert session.redis_bind.hmget.coro.call_args_list == [mock.call('test_filter_filter', 'a')]
+
+
+class TestFiltersSelectivity(object):
+
+    async def test_if_multiple_filter_selectivity_uses_counts(self, items_model, session):
+        session.redis_bind.get.coro.return_value = b'3'
+        session.redis_bind.hmget.coro.return_value = [b'2', None, b'3']
+        filter_ = SimpleFilterBy(items_model, 'filter')
+
+        assert await filter_.get_selectivity(session, 10, ['a', 'b', 'c']) == 0.5
+        assert session.redis_bind.hmget.coro.call_args_list == [
+            mock.call('test_filter_filter:v3:counts', 'a', 'b', 'c')
+        ]
+
+    async def test_if_exclusive_filter_selectivity_is_inverted(self, items_model, session):
+        session.redis_bind.get.coro.return_value = b'3'
+        session.redis_bind.hmget.coro.return_value = [b'2']
+        filter_ = SimpleFilterBy(items_model, 'filter', is_inclusive=False)
+
+        assert await filter_.get_selectivity(session, 10, 'a') == 0.8
+
+    async def test_if_exclusive_overlapped_values_selectivity_is_not_exact(
+            self, items_model, session):
+        session.redis_bind.get.coro.return_value = b'3'
+        session.redis_bind.hmget.coro.return_value = [b'3', b'3']
+        filter_ = ArrayFilterBy(items_model, 'tags', is_inclusive=False)
+
+        assert await filter_.get_selectivity(session, 4, ['a', 'b']) == 0.0
+        assert not filter_.has_exact_selectivity(['a', 'b'])
+        assert filter_.has_exact_selectivity('a')
+        assert SimpleFilterBy(items_model, 'filter').has_exact_selectivity(['a', 'b'])
+
+    async def test_if_unversioned_filter_selectivity_is_unknown(self, items_model, session):
+        filter_ = SimpleFilterBy(items_model, 'filter')
+        assert await filter_.get_selectivity(session, 10, ['a']) is None
+
+    async def test_if_boolean_filter_selectivity_uses_count(self, items_model, session):
+        session.redis_bind.get.coro.return_value = b'1'
+        filter_ = BooleanFilterBy(items_model, 'bool')
+
+        assert await filter_.get_selectivity(session, 4, True) == 0.25
+        assert session.redis_bind.get.coro.call_args_list == [mock.call('test_bool_filter:count')]
+
+
+@pytest.fixture
+def compaction():
+    from myreco.item_types.indices_map import ItemsIndicesCompaction, ItemsIndicesSnapshot
+    return ItemsIndicesCompaction(ItemsIndicesSnapshot.from_dict({b'a': 1, b'b': 4, b'c': 2}))
+
+
+class TestFiltersRemap(object):
+
+    async def test_if_boolean_filter_remaps_filter(self, items_model, session, compaction):
+        session.redis_bind.get.coro.return_value = \
+            np.array([1, 1, 0, 1, 1], dtype=np.bool).tobytes()
+        transaction = mock.MagicMock()
+        filter_ = BooleanFilterBy(items_model, 'bool')
+
+        assert await filter_.remap(session, transaction, compaction) == 2
+        assert transaction.set.call_args_list == [
+            mock.call('test_bool_filter', np.array([1, 0, 1], dtype=np.bool).tobytes()),
+            mock.call('test_bool_filter:count', 2)
+        ]
+
+    async def test_if_multiple_filter_publishes_remapped_version(
+            self, items_model, session, compaction):
+        session.redis_bind.get.coro.return_value = b'1'
+        session.redis_bind.hgetall = CoroMock()
+        session.redis_bind.hgetall.coro.return_value = \
+            {b'a': np.array([0, 0, 1, 0, 1], dtype=np.bool).tobytes()}
+        transaction = mock.MagicMock()
+        filter_ = SimpleFilterBy(items_model, 'filter')
+
+        assert await filter_.remap(session, transaction, compaction) == 2
+        assert session.redis_bind.hgetall.call_args == mock.call('test_filter_filter:v1')
+        assert transaction.hset.call_args_list == [
+            mock.call('test_filter_filter:v2', b'a',
+                      np.array([0, 1, 1], dtype=np.bool).tobytes()),
+            mock.call('test_filter_filter:v2:counts', b'a', 2)
+        ]
+        assert transaction.set.call_args_list == [mock.call('test_filter_filter:version', 2)]
+        assert transaction.expire.call_args_list == [
+            mock.call('test_filter_filter:v1', 60),
+            mock.call('test_filter_filter:v1:counts', 60)
+        ]
+
+    async def test_if_index_filter_remaps_indices(self, items_model, session, compaction):
+        session.redis_bind.hgetall = CoroMock()
+        session.redis_bind.hgetall.coro.return_value = \
+            {b'a': np.array([4, 0, 1], dtype=np.int32).tobytes()}
+        transaction = mock.MagicMock()
+        filter_ = IndexFilterByPropertyOf(items_model, 'filter')
+        await filter_.remap(session, transaction, compaction)
+
+        assert transaction.hset.call_args_list == [
+            mock.call('test_filter_filter:v2', b'a', np.array([2, 0], dtype=np.int32).tobytes()),
+            mock.call('test_filter_filter:v2:counts', b'a', 2)
+        ]
+        assert transaction.expire.call_args_list == [mock.call('test_filter_filter', 60)]
+
+
+class TestBooleanFilterUpdateIndices(object):
+
+    async def test_if_update_indices_changes_only_the_indices(self, items_model, session):
+        session.redis_bind.get.coro.return_value = \
+            np.array([1, 1, 0, 1], dtype=np.bool).tobytes()
+        filter_ = BooleanFilterBy(items_model, 'stock')
+        ret = await filter_.update_indices(
+            session, np.array([2, 4]), np.array([0]), 5)
+
+        assert ret == {'true_values': 4}
+        assert session.redis_bind.set.coro.call_args_list[0] == mock.call(
+            'test_stock_filter', np.array([0, 1, 1, 1, 1], dtype=np.bool).tobytes())
@@ -0,0 +1,77 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+import asyncio
+from unittest import mock
+
+import pytest
+from myreco.item_types.filters_updater.model import ItemTypesFiltersUpdaterModelBase
+
+
+def CoroMock():
+    coro = mock.MagicMock(name="CoroutineResult")
+    corofunc = mock.MagicMock(name="CoroutineFunction", side_effect=asyncio.coroutine(coro))
+    corofunc.coro = coro
+    return corofunc
+
+
+@pytest.fixture
+def updater(monkeypatch):
+    monkeypatch.setattr(ItemTypesFiltersUpdaterModelBase, '__updater_lock_interval__', 0)
+    monkeypatch.setattr(ItemTypesFiltersUpdaterModelBase, '_compact_indices', CoroMock())
+    return ItemTypesFiltersUpdaterModelBase
+
+
+@pytest.fixture
+def session():
+    session = mock.MagicMock()
+    session.redis_bind.set = CoroMock()
+    session.redis_bind.set.coro.side_effect = [None, True]
+    session.redis_bind.delete = CoroMock()
+    return session
+
+
+class TestFiltersUpdaterLock(object):
+
+    async def test_if_compact_indices_waits_the_updater_lock(self, updater, session):
+        store_items_model = mock.MagicMock(__key__='store_items')
+        updater._compact_indices.coro.return_value = {'reclaimed_bytes': 1}
+
+        assert await updater.compact_indices(store_items_model, session, 1) == \
+            {'reclaimed_bytes': 1}
+        assert session.redis_bind.set.call_count == 2
+        assert session.redis_bind.set.call_args == mock.call(
+            'store_items_updater_lock', 1, expire=updater.__updater_lock_timeout__,
+            exist=session.redis_bind.SET_IF_NOT_EXIST)
+        assert session.redis_bind.delete.call_args == mock.call('store_items_updater_lock')
+
+    async def test_if_compact_indices_releases_the_updater_lock_on_error(
+            self, updater, session):
+        store_items_model = mock.MagicMock(__key__='store_items')
+        updater._compact_indices.coro.side_effect = ValueError
+
+        with pytest.raises(ValueError):
+            await updater.compact_indices(store_items_model, session, 1)
+
+        assert session.redis_bind.delete.call_args == mock.call('store_items_updater_lock')
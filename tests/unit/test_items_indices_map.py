@@ -22,10 +22,13 @@
 
 
 import asyncio
+import os
 from collections import OrderedDict
 from types import MethodType
 from unittest import mock
 
+import numpy as np
+
 import pytest
 
 
@@ -63,6 +66,10 @@ def session_first_update():
     m.redis_bind.hmset_dict = CoroMock()
     m.redis_bind.set = CoroMock()
     m.redis_bind.hdel = CoroMock()
+    m.redis_bind.exists = CoroMock()
+    m.redis_bind.exists.coro.return_value = 0
+    m.redis_bind.delete = CoroMock()
+    m.redis_bind.multi_exec.return_value.execute = CoroMock()
     return m
 
 
@@ -87,6 +94,21 @@ class TestItemsIndicesMapFirstUpdate(object):
         await indices_map.update(session_first_update)
         assert session_first_update.redis_bind.hdel.coro.call_args_list == []
 
+    async def test_if_update_sets_snapshot(self, indices_map, session_first_update):
+        from myreco.item_types.indices_map import ItemsIndicesSnapshot
+        await indices_map.update(session_first_update)
+        transaction = session_first_update.redis_bind.multi_exec.return_value
+        snapshot = ItemsIndicesSnapshot.unpack(transaction.set.call_args[0][1])
+
+        assert transaction.set.call_args[0][0] == 'test_indices_snapshot'
+        assert transaction.incr.call_args_list == [mock.call('test_indices_version')]
+        assert snapshot.get_indices([b'a', b'b', b'c', b'd']).tolist() == [0, 1, 2, 3]
+
+    async def test_if_update_clears_changes_log(self, indices_map, session_first_update):
+        await indices_map.update(session_first_update)
+        assert session_first_update.redis_bind.delete.coro.call_args_list == \
+            [mock.call('test_indices_changes', 'test_indices_processing_changes')]
+
 
 @pytest.fixture
 def session(session_first_update):
@@ -282,3 +304,264 @@ class TestItemsIndicesMapFreeIndices(object):
         assert session.redis_bind.hdel.coro.call_args_list[0][0][0] == 'test_indices_map'
         assert set(session.redis_bind.hdel.coro.call_args_list[0][0][1:]) == {b'a', b'c', b'd'}
         assert session.redis_bind.hdel.coro.call_args_list[1] == mock.call('test_items_map', 0, 2, 3)
+
+
+@pytest.fixture
+def snapshot_class():
+    from myreco.item_types.indices_map import ItemsIndicesSnapshot
+    return ItemsIndicesSnapshot
+
+
+class TestItemsIndicesSnapshot(object):
+
+    def test_if_unpack_restores_packed_snapshot(self, snapshot_class):
+        snapshot = snapshot_class.from_dict({b'b': 3, b'aaa': 0, b'c': 7})
+        snapshot = snapshot_class.unpack(snapshot.pack(), 2)
+
+        assert snapshot.keys.tolist() == [b'aaa', b'b', b'c']
+        assert snapshot.indices.tolist() == [0, 3, 7]
+        assert len(snapshot) == 8
+        assert snapshot.total_items == 3
+        assert snapshot.version == 2
+
+    def test_if_get_indices_returns_minus_one_for_missing_keys(self, snapshot_class):
+        snapshot = snapshot_class.from_dict({b'b': 3, b'aaa': 0, b'c': 7})
+        assert snapshot.get_indices([b'c', 'aaa', b'aa', b'aaaa', b'd', b'b']).tolist() == \
+            [7, 0, -1, -1, -1, 3]
+
+    def test_if_get_returns_default_for_missing_key(self, snapshot_class):
+        snapshot = snapshot_class.from_dict({b'a': 1})
+        assert snapshot.get('a') == 1
+        assert snapshot.get('b') is None
+
+    def test_if_empty_snapshot_is_packed(self, snapshot_class):
+        snapshot = snapshot_class.unpack(snapshot_class.from_dict({}).pack())
+
+        assert len(snapshot) == 0
+        assert snapshot.get_indices([b'a']).tolist() == [-1]
+
+
+@pytest.fixture
+def session_incremental(session_first_update, snapshot_class):
+    def hexists(key, field):
+        future = mock.MagicMock()
+        future.result.return_value = field != b'a'
+        return future
+
+    snapshot = snapshot_class.from_dict({b'a': 0, b'b': 1, b'c': 2, b'd': 3})
+    m = session_first_update
+    m.redis_bind.exists.coro.return_value = 1
+    m.redis_bind.multi_exec.return_value.execute.coro.side_effect = [
+        [4, 1, {b'a', b'e', b'f', b'b'}], [snapshot.pack(), b'1'], []
+    ]
+    m.redis_bind.hmget = CoroMock()
+    m.redis_bind.hmget.coro.side_effect = \
+        lambda key, *keys: [{b'a': b'0', b'b': b'1'}.get(k) for k in keys]
+    m.redis_bind.pipeline.return_value.hexists.side_effect = hexists
+    m.redis_bind.pipeline.return_value.execute = CoroMock()
+    m.redis_bind.smembers = CoroMock()
+    m.redis_bind.smembers.coro.return_value = set()
+    return m
+
+
+class TestItemsIndicesMapIncrementalUpdate(object):
+
+    async def test_if_update_dont_reads_all_items_keys(self, indices_map, session_incremental):
+        await indices_map.update(session_incremental)
+        assert not indices_map.items_model.get_keys.called
+        assert not session_incremental.redis_bind.hgetall.called
+
+    async def test_if_update_reuses_freed_index(self, indices_map, session_incremental):
+        assert await indices_map.update(session_incremental) == \
+            {'total_items': 5, 'maximum_index': 4}
+
+        transaction = session_incremental.redis_bind.multi_exec.return_value
+        added_map = transaction.hmset_dict.call_args_list[0][0][1]
+        assert transaction.hdel.call_args_list == [
+            mock.call('test_indices_map', b'a'), mock.call('test_items_map', 0)
+        ]
+        assert sorted(added_map.values()) == [0, 4]
+        assert transaction.hmset_dict.call_args_list[1] == \
+            mock.call('test_items_map', {i: k for k, i in added_map.items()})
+
+    async def test_if_update_sets_snapshot(self, indices_map, session_incremental, snapshot_class):
+        await indices_map.update(session_incremental)
+        transaction = session_incremental.redis_bind.multi_exec.return_value
+        snapshot = snapshot_class.unpack(transaction.set.call_args_list[-1][0][1])
+
+        assert transaction.set.call_args_list[0] == mock.call('test_indices_length', 5)
+        assert transaction.incr.call_args_list == [mock.call('test_indices_version')]
+        assert snapshot.keys.tolist() == [b'b', b'c', b'd', b'e', b'f']
+        assert sorted(snapshot.indices.tolist()) == [0, 1, 2, 3, 4]
+
+    async def test_if_update_keeps_changes_until_they_are_set(
+            self, indices_map, session_incremental):
+        transaction = session_incremental.redis_bind.multi_exec.return_value
+        await indices_map.update(session_incremental)
+
+        assert transaction.sunionstore.call_args == mock.call(
+            'test_indices_processing_changes', 'test_indices_processing_changes',
+            'test_indices_changes'
+        )
+        assert transaction.delete.call_args_list[0] == mock.call('test_indices_changes')
+        assert transaction.delete.call_args_list[-1] == \
+            mock.call('test_indices_processing_changes')
+
+    async def test_if_update_without_changes_dont_writes(self, indices_map, session_incremental):
+        session_incremental.redis_bind.multi_exec.return_value.execute.coro.side_effect = [
+            [0, 0, set()], [None, None]
+        ]
+        assert await indices_map.update(session_incremental) == \
+            {'total_items': 0, 'maximum_index': None}
+        assert not session_incremental.redis_bind.multi_exec.return_value.set.called
+
+
+@pytest.fixture
+def compaction(snapshot_class):
+    from myreco.item_types.indices_map import ItemsIndicesCompaction
+    return ItemsIndicesCompaction(snapshot_class.from_dict({b'a': 6, b'b': 1, b'c': 3}))
+
+
+class TestItemsIndicesCompaction(object):
+
+    def test_if_compaction_keeps_indices_order(self, compaction):
+        assert compaction.snapshot.get_indices([b'a', b'b', b'c']).tolist() == [2, 0, 1]
+        assert compaction.get_report() == \
+            {'total_items': 3, 'old_length': 7, 'new_length': 3, 'reclaimed_slots': 4}
+
+    def test_if_remap_vector_moves_values(self, compaction):
+        vector = np.array([0, 10, 0, 30, 0, 0, 60])
+        assert compaction.remap_vector(vector).tolist() == [10, 30, 60]
+
+    def test_if_remap_vector_fills_missing_values(self, compaction):
+        assert compaction.remap_vector(np.array([0, 10])).tolist() == [10, 0, 0]
+
+    def test_if_remap_indices_drops_freed_indices(self, compaction):
+        indices = np.array([6, 0, 3, 9], dtype=np.int32)
+        assert compaction.remap_indices(indices).tolist() == [2, 1]
+
+    def test_if_set_compaction_rewrites_map(self, indices_map, compaction):
+        transaction = mock.MagicMock()
+        indices_map.set_compaction(transaction, compaction)
+
+        assert transaction.hmset_dict.call_args_list == [
+            mock.call('test_indices_map', {b'b': 0, b'c': 1, b'a': 2}),
+            mock.call('test_items_map', {0: b'b', 1: b'c', 2: b'a'})
+        ]
+        assert transaction.set.call_args_list[0] == mock.call('test_indices_length', 3)
+        assert transaction.incr.call_args_list == [mock.call('test_indices_version')]
+
+
+@pytest.fixture
+def reverse_array_indices_map(indices_map, tmpdir):
+    indices_map.items_model.__data_path__ = str(tmpdir)
+    return type(indices_map)(indices_map.items_model)
+
+
+@pytest.fixture
+def session_reverse_array(snapshot_class):
+    snapshot = snapshot_class.from_dict({b'a': 2, b'bb': 0, b'c': 3})
+    m = mock.MagicMock()
+    m.redis_bind.get = CoroMock()
+    m.redis_bind.get.coro.return_value = b'3'
+    m.redis_bind.hmget = CoroMock()
+    m.redis_bind.multi_exec.return_value.execute = CoroMock()
+    m.redis_bind.multi_exec.return_value.execute.coro.return_value = [snapshot.pack(), b'3']
+    return m
+
+
+class TestItemsIndicesReverseArray(object):
+
+    def test_if_reverse_array_skips_freed_indices(self, snapshot_class):
+        from myreco.item_types.indices_map import ItemsIndicesReverseArray
+        snapshot = snapshot_class.from_dict({b'a': 2, b'bb': 0, b'c': 3})
+        reverse_array = ItemsIndicesReverseArray.from_snapshot(snapshot)
+
+        assert reverse_array.get_items([3, 1, 0, 2, 7]) == [b'c', b'bb', b'a']
+
+    async def test_if_get_items_dont_calls_hmget(
+            self, reverse_array_indices_map, session_reverse_array):
+        assert await reverse_array_indices_map.get_items([0, 3], session_reverse_array) == \
+            [b'bb', b'c']
+        assert not session_reverse_array.redis_bind.hmget.called
+
+    async def test_if_get_items_loads_saved_reverse_array(
+            self, reverse_array_indices_map, session_reverse_array):
+        await reverse_array_indices_map.get_items([0], session_reverse_array)
+        indices_map = type(reverse_array_indices_map)(reverse_array_indices_map.items_model)
+
+        assert await indices_map.get_items([2], session_reverse_array) == [b'a']
+        assert session_reverse_array.redis_bind.multi_exec.return_value.execute.call_count == 1
+
+    async def test_if_get_items_uses_hmget_without_version(
+            self, reverse_array_indices_map, session_reverse_array):
+        session_reverse_array.redis_bind.get.coro.return_value = None
+        session_reverse_array.redis_bind.hmget.coro.return_value = [b'a', None]
+
+        assert await reverse_array_indices_map.get_items([2, 1], session_reverse_array) == [b'a']
+
+    def set_version(self, session, snapshot_class, version):
+        snapshot = snapshot_class.from_dict({b'd': 0}, version)
+        session.redis_bind.get.coro.return_value = str(version).encode()
+        session.redis_bind.multi_exec.return_value.execute.coro.return_value = \
+            [snapshot.pack(), str(version).encode()]
+
+    async def test_if_get_items_checks_version_on_each_call(
+            self, reverse_array_indices_map, session_reverse_array, snapshot_class):
+        await reverse_array_indices_map.get_items([0], session_reverse_array)
+        self.set_version(session_reverse_array, snapshot_class, 4)
+
+        assert await reverse_array_indices_map.get_items([0], session_reverse_array) == [b'd']
+
+    async def test_if_old_reverse_arrays_are_kept_until_ttl(
+            self, reverse_array_indices_map, session_reverse_array, snapshot_class):
+        filename = reverse_array_indices_map._build_reverse_array_filename
+        await reverse_array_indices_map.get_items([0], session_reverse_array)
+        self.set_version(session_reverse_array, snapshot_class, 4)
+        await reverse_array_indices_map.get_items([0], session_reverse_array)
+
+        assert os.path.exists(filename(3))
+
+        os.utime(filename(4), (0, 0))
+        self.set_version(session_reverse_array, snapshot_class, 5)
+        await reverse_array_indices_map.get_items([0], session_reverse_array)
+
+        assert not os.path.exists(filename(3))
+        assert os.path.exists(filename(4))
+        assert os.path.exists(filename(5))
+
+
+@pytest.fixture
+def shared_indices_map(indices_map, monkeypatch):
+    monkeypatch.setattr(type(indices_map), '_shared_snapshots', OrderedDict())
+    return indices_map
+
+
+class TestItemsIndicesMapSharedSnapshot(object):
+
+    async def test_if_shared_snapshot_is_loaded_once_by_process(
+            self, shared_indices_map, session_reverse_array):
+        snapshot = await shared_indices_map.get_shared_snapshot(session_reverse_array)
+        indices_map = type(shared_indices_map)(shared_indices_map.items_model)
+
+        assert await indices_map.get_shared_snapshot(session_reverse_array) is snapshot
+        assert session_reverse_array.redis_bind.multi_exec.return_value.execute.call_count == 1
+
+    async def test_if_shared_snapshot_is_reloaded_on_new_version(
+            self, shared_indices_map, session_reverse_array, snapshot_class):
+        snapshot = await shared_indices_map.get_shared_snapshot(session_reverse_array)
+        session_reverse_array.redis_bind.get.coro.return_value = b'4'
+        session_reverse_array.redis_bind.multi_exec.return_value.execute.coro.return_value = \
+            [snapshot_class.from_dict({b'a': 0}).pack(), b'4']
+        new_snapshot = await shared_indices_map.get_shared_snapshot(session_reverse_array)
+
+        assert new_snapshot is not snapshot
+        assert new_snapshot.version == 4
+        assert new_snapshot.keys.tolist() == [b'a']
+
+    async def test_if_shared_snapshot_is_read_only(
+            self, shared_indices_map, session_reverse_array):
+        snapshot = await shared_indices_map.get_shared_snapshot(session_reverse_array)
+
+        with pytest.raises(ValueError):
+            snapshot.indices[0] = 1
@@ -0,0 +1,137 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from gzip import GzipFile
+from unittest import mock
+
+import numpy as np
+import pytest
+from myreco.engine_strategies.neighborhood.matrix import NeighborhoodMatrix
+from myreco.engine_strategies.neighborhood.strategy import NeighborhoodEngineStrategy
+
+import ujson
+
+
+@pytest.fixture
+def matrix(tmpdir):
+    matrix = NeighborhoodMatrix({
+        'id': 1,
+        'name': 'test',
+        'type': 'neighborhood_matrix',
+        'strategy': {'name': 'neighborhood'},
+        'configuration': {'max_neighbors': 2}
+    })
+    matrix._data_path = str(tmpdir)
+    return matrix
+
+
+@pytest.fixture
+def snapshot():
+    from myreco.item_types.indices_map import ItemsIndicesSnapshot
+    return ItemsIndicesSnapshot.from_dict({b'1': 0, b'2': 1, b'3': 2, b'4': 3})
+
+
+def build_reader(baskets):
+    return [ujson.dumps({'item_keys': basket}).encode() + b'\n' for basket in baskets]
+
+
+class TestNeighborhoodMatrixBuild(object):
+
+    def test_if_partial_vector_counts_cooccurrences(self, matrix, snapshot):
+        cooccurrences = matrix._build_partial_vector(
+            [build_reader([['1', '2', '2'], ['1', '3', '5']]), build_reader([['1', '2']])],
+            snapshot
+        )
+
+        assert cooccurrences.toarray().tolist() == [
+            [3, 2, 1, 0],
+            [2, 2, 0, 0],
+            [1, 0, 1, 0],
+            [0, 0, 0, 0]
+        ]
+
+    def test_if_similarity_matrix_keeps_top_neighbors(self, matrix, snapshot):
+        cooccurrences = matrix._build_partial_vector(
+            [build_reader([['1', '2', '3', '4'], ['1', '2'], ['1', '3']])], snapshot)
+        similarities = matrix._build_similarity_matrix(cooccurrences).toarray()
+
+        assert similarities.dtype == np.float32
+        assert np.count_nonzero(similarities, axis=1).tolist() == [2, 2, 2, 2]
+        assert np.allclose(similarities[0], [0, 2 / 6 ** 0.5, 2 / 6 ** 0.5, 0])
+        assert np.allclose(similarities[3], [0, 1 / 2 ** 0.5, 1 / 2 ** 0.5, 0])
+        assert np.diag(similarities).tolist() == [0, 0, 0, 0]
+
+    @pytest.mark.parametrize('processes', [1, 2])
+    def test_if_files_vector_sums_files_matrices(self, matrix, snapshot, tmpdir, processes):
+        matrix._engine_object['configuration']['export_processes'] = processes
+        for i, baskets in enumerate([[['1', '2']], [['1', '2'], ['2', '3']]]):
+            with GzipFile(str(tmpdir.join('{}.gz'.format(i))), 'w') as file_:
+                file_.writelines(build_reader(baskets))
+
+        cooccurrences = matrix._build_files_vector(snapshot)
+        assert cooccurrences[0, 1] == 2
+        assert cooccurrences[1, 2] == 1
+
+
+class TestNeighborhoodMatrixItemsVector(object):
+
+    async def test_if_items_vector_sums_context_items_rows(self, matrix):
+        rows = {
+            0: matrix._pack_row(np.array([1, 2]), np.array([0.5, 0.25])),
+            1: matrix._pack_row(np.array([0, 2, 3]), np.array([0.5, 0.5, 1]))
+        }
+        session = mock.MagicMock()
+
+        async def hmget(key, *fields):
+            return [rows.get(field) for field in fields]
+
+        session.redis_bind.hmget = hmget
+        vector = await matrix.get_items_vector(session, [0, 1, 5], 4)
+
+        assert vector.tolist() == [0, 0, 0.75, 1]
+
+    async def test_if_remap_indices_remaps_rows_and_neighbors(self, matrix):
+        from myreco.item_types.indices_map import ItemsIndicesCompaction, ItemsIndicesSnapshot
+        compaction = ItemsIndicesCompaction(ItemsIndicesSnapshot.from_dict({b'1': 0, b'3': 2}))
+        session = mock.MagicMock()
+
+        async def hgetall(key):
+            return {
+                b'0': matrix._pack_row(np.array([1, 2]), np.array([0.5, 0.25])),
+                b'1': matrix._pack_row(np.array([0]), np.array([0.5]))
+            }
+
+        session.redis_bind.hgetall = hgetall
+        transaction = mock.MagicMock()
+        await matrix.remap_indices(session, transaction, compaction)
+        rows = transaction.hmset_dict.call_args[0][1]
+
+        assert list(rows) == [0]
+        assert [array.tolist() for array in matrix._unpack_row(rows[0])] == [[1], [0.25]]
+
+
+class TestNeighborhoodEngineStrategy(object):
+
+    async def test_if_items_vector_is_none_without_item_keys(self):
+        strategy = NeighborhoodEngineStrategy({'objects': []})
+        assert await strategy._build_items_vector(None, mock.MagicMock()) is None
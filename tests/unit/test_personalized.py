@@ -0,0 +1,170 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from unittest import mock
+
+import numpy as np
+import pytest
+from myreco.engine_strategies.personalized.affinities import UserAffinities
+from myreco.engine_strategies.personalized.strategy import PersonalizedEngineStrategy
+from myreco.engine_strategies.top_seller.array import TopSellerArray
+
+import ujson
+
+
+class TopSellerArrayTest(TopSellerArray):
+
+    def get_data(self, items_model, session):
+        pass
+
+
+class PersonalizedEngineStrategyTest(PersonalizedEngineStrategy):
+    object_types = dict(
+        PersonalizedEngineStrategy.object_types, top_seller_array=TopSellerArrayTest)
+
+
+def build_object(object_type, configuration):
+    return {
+        'id': 1,
+        'name': object_type,
+        'type': object_type,
+        'strategy': {'name': 'personalized'},
+        'configuration': configuration
+    }
+
+
+@pytest.fixture
+def affinities():
+    return UserAffinities(build_object('user_affinities', {'max_affinities': 2}))
+
+
+@pytest.fixture
+def snapshot():
+    from myreco.item_types.indices_map import ItemsIndicesSnapshot
+    return ItemsIndicesSnapshot.from_dict({b'1': 0, b'2': 1, b'3': 2})
+
+
+def build_affinities(affinities, readers, items_indices_map_dict):
+    return affinities._prune_affinities(
+        affinities._build_partial_vector(readers, items_indices_map_dict))
+
+
+def build_reader(events):
+    return [ujson.dumps(dict(zip(('user_id', 'item_key', 'value'), event))).encode()
+            for event in events]
+
+
+class TestUserAffinities(object):
+
+    def test_if_affinities_are_summed_and_pruned(self, affinities, snapshot):
+        users_ids, matrix = build_affinities(affinities, [
+            build_reader([('a', '1', 1), ('a', '2', 3), ('b', '3', 2), ('b', '4', 9)]),
+            build_reader([('a', '1', 3), ('a', '3', 1), (1, '2', 1)])
+        ], snapshot)
+
+        assert users_ids == ['a', 'b', '1']
+        assert matrix.dtype == np.float32
+        assert matrix.toarray().tolist() == [[4, 3, 0], [0, 0, 2], [0, 1, 0]]
+
+    def test_if_affinities_are_none_without_known_items(self, affinities, snapshot):
+        assert build_affinities(
+            affinities, [build_reader([('a', '4', 1)])], snapshot) == ([], None)
+
+    def test_if_partial_affinities_are_reduced_before_pruning(self, affinities, snapshot):
+        users_ids, matrix = affinities._prune_affinities(affinities._reduce_partial_vectors([
+            affinities._build_partial_vector(
+                [build_reader([('a', '1', 1), ('a', '2', 3), ('b', '3', 2)])], snapshot),
+            None,
+            affinities._build_partial_vector(
+                [build_reader([('c', '2', 1), ('a', '1', 3), ('a', '3', 1)])], snapshot)
+        ]))
+
+        assert users_ids == ['a', 'b', 'c']
+        assert matrix.toarray().tolist() == [[4, 3, 0], [0, 0, 2], [0, 1, 0]]
+
+    def test_if_set_affinities_writes_users_rows(self, affinities, snapshot):
+        users_ids, matrix = build_affinities(
+            affinities, [build_reader([('a', '1', 1), ('b', '3', 2)])], snapshot)
+        affinities._run_coro = lambda coro, session: coro
+        session = mock.MagicMock()
+
+        assert affinities._set_affinities(users_ids, matrix, session) == 2
+        rows = session.redis_bind.hmset_dict.call_args[0][1]
+        assert [array.tolist() for array in affinities._unpack_affinities(rows['b'])] == \
+            [[2], [2]]
+        assert session.redis_bind.rename.call_args == \
+            mock.call(affinities._redis_key + '_tmp', affinities._redis_key)
+
+
+class TestPersonalizedEngineStrategy(object):
+
+    @pytest.fixture
+    def strategy(self):
+        strategy = PersonalizedEngineStrategyTest({'objects': [
+            build_object('user_affinities', {'weight': 2}),
+            build_object('top_seller_array', {'days_interval': 7})
+        ]})
+        strategy.validate_config()
+        return strategy
+
+    @pytest.fixture
+    def session(self, strategy, monkeypatch):
+        monkeypatch.setattr(TopSellerArray, '_arrays', {})
+        session = mock.MagicMock()
+        session.gets = []
+        user_affinities = strategy.objects['user_affinities']
+        top_seller = strategy.objects['top_seller_array']
+        values = {
+            top_seller._redis_key: top_seller._pack_chunked_array(
+                np.array([5, 0, 1, 0], dtype=np.int32)),
+            top_seller._version_key: b'1'
+        }
+
+        async def get(key):
+            session.gets.append(key)
+            return values.get(key)
+
+        async def hget(key, user_id):
+            if user_id == 'a':
+                return user_affinities._pack_affinities(
+                    np.array([1, 3, 7]), np.array([0.5, 1, 1]))
+
+        session.redis_bind.get = get
+        session.redis_bind.hget = hget
+        return session
+
+    async def test_if_affinities_are_added_to_base_vector(self, strategy, session):
+        vector = await strategy._build_items_vector(session, mock.MagicMock(), user_id='a')
+        assert vector.tolist() == [5, 1, 1, 2]
+
+    async def test_if_base_vector_is_used_without_user(self, strategy, session):
+        vector = await strategy._build_items_vector(session, mock.MagicMock())
+        assert vector.tolist() == [5, 0, 1, 0]
+
+    async def test_if_base_vector_is_fetched_once_by_version(self, strategy, session):
+        await strategy._build_items_vector(session, mock.MagicMock(), user_id='a')
+        vector = await strategy._build_items_vector(session, mock.MagicMock())
+
+        assert vector.dtype == np.float32
+        assert vector.tolist() == [5, 0, 1, 0]
+        assert session.gets.count(strategy.objects['top_seller_array']._redis_key) == 1
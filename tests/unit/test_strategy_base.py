@@ -0,0 +1,110 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import asyncio
+from unittest import mock
+
+import numpy as np
+
+import pytest
+from myreco.engine_strategies.strategy_base import EngineStrategyBase
+
+
+def CoroMock():
+    coro = mock.MagicMock(name="CoroutineResult")
+    corofunc = mock.MagicMock(name="CoroutineFunction", side_effect=asyncio.coroutine(coro))
+    corofunc.coro = coro
+    return corofunc
+
+
+class StrategyTest(EngineStrategyBase):
+
+    async def _build_items_vector(self, session, items_model, **external_variables):
+        return np.array([3, 2, 1, 4], dtype=np.int32)
+
+
+def FilterMock(selectivity, mask, calls, sets_vector_values=False, exact=True):
+    filter_ = mock.MagicMock()
+    filter_.sets_vector_values = sets_vector_values
+    filter_.has_exact_selectivity.return_value = exact
+    filter_.get_selectivity = CoroMock()
+    filter_.get_selectivity.coro.return_value = selectivity
+
+    async def filter_func(session, items_vector, ids):
+        calls.append(filter_)
+        items_vector *= mask
+
+    filter_.filter = filter_func
+    return filter_
+
+
+@pytest.fixture
+def strategy():
+    strategy = StrategyTest({'objects': []})
+    strategy._build_rec_list = CoroMock()
+    strategy._build_rec_list.coro.return_value = ['recos']
+    return strategy
+
+
+class TestEngineStrategyBaseFilters(object):
+
+    async def test_if_filters_are_applied_by_selectivity(self, strategy):
+        calls = []
+        filter1 = FilterMock(0.9, np.array([1, 1, 1, 0]), calls)
+        filter2 = FilterMock(None, np.array([1, 1, 1, 1]), calls)
+        filter3 = FilterMock(0.5, np.array([1, 1, 0, 0]), calls)
+        filter4 = FilterMock(1.0, np.array([1, 1, 1, 1]), calls, True)
+        filters = {filter1: 'a', filter2: 'b', filter3: 'c', filter4: 'd'}
+
+        assert await strategy.get_items(mock.MagicMock(), filters, 2, False, None) == ['recos']
+        assert calls == [filter4, filter3, filter1, filter2]
+        assert strategy._build_rec_list.coro.call_args[0][1].tolist() == [3, 2, 0, 0]
+
+    async def test_if_empty_vector_skips_remaining_filters(self, strategy):
+        calls = []
+        filter1 = FilterMock(0.5, np.array([0, 0, 0, 0]), calls)
+        filter2 = FilterMock(0.9, np.array([1, 1, 1, 1]), calls)
+        filters = {filter1: 'a', filter2: 'b'}
+
+        assert await strategy.get_items(mock.MagicMock(), filters, 2, True, None) == []
+        assert calls == [filter1]
+        assert not strategy._build_rec_list.coro.called
+
+    async def test_if_zero_selectivity_skips_all_filters(self, strategy):
+        calls = []
+        filter1 = FilterMock(0.0, np.array([0, 0, 0, 0]), calls)
+        filter2 = FilterMock(0.9, np.array([1, 1, 1, 1]), calls)
+        filters = {filter1: 'a', filter2: 'b'}
+
+        assert await strategy.get_items(mock.MagicMock(), filters, 2, True, None) == []
+        assert calls == []
+
+    async def test_if_estimated_zero_selectivity_applies_filters(self, strategy):
+        calls = []
+        filter1 = FilterMock(0.0, np.array([0, 0, 0, 1]), calls, exact=False)
+        filter2 = FilterMock(0.9, np.array([1, 1, 1, 1]), calls)
+        filters = {filter1: 'a', filter2: 'b'}
+
+        assert await strategy.get_items(mock.MagicMock(), filters, 2, True, None) == ['recos']
+        assert calls == [filter1, filter2]
+        assert strategy._build_rec_list.coro.call_args[0][1].tolist() == [0, 0, 0, 4]
@@ -0,0 +1,263 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from gzip import GzipFile
+from io import BytesIO
+from unittest import mock
+
+import numpy as np
+import pytest
+from myreco.engine_objects.object_base import EngineObjectBase
+from myreco.engine_strategies.top_seller.array import TopSellerArray
+from myreco.exceptions import EngineError
+
+import ujson
+
+
+class TopSellerArrayTest(TopSellerArray):
+    __sales_chunk_size__ = 2
+
+    def get_data(self, items_model, session):
+        pass
+
+
+@pytest.fixture
+def top_seller():
+    return TopSellerArrayTest({
+        'id': 1,
+        'name': 'test',
+        'type': 'top_seller_array',
+        'strategy': {'name': 'top_seller'}
+    })
+
+
+@pytest.fixture
+def snapshot_class():
+    from myreco.item_types.indices_map import ItemsIndicesSnapshot
+    return ItemsIndicesSnapshot
+
+
+@pytest.fixture
+def snapshot(snapshot_class):
+    return snapshot_class.from_dict({b'1': 0, b'2': 1, b'3': 3})
+
+
+def build_reader(sales):
+    return [ujson.dumps({'item_key': key, 'value': value}).encode() + b'\n'
+            for key, value in sales]
+
+
+class TestTopSellerArrayBuildVector(object):
+
+    def test_if_build_vector_sums_sales_of_all_readers(self, top_seller, snapshot):
+        readers = [
+            build_reader([('1', 2), ('3', 5), ('4', 7)]),
+            build_reader([('1', '3')]) + [b'\n']
+        ]
+        keys, values = top_seller._build_partial_vector(readers, snapshot)
+
+        assert keys.tolist() == [b'1', b'3', b'4']
+        assert values.tolist() == [5, 5, 7]
+
+    def test_if_build_vector_returns_none_without_sales(self, top_seller, snapshot):
+        assert top_seller._build_partial_vector([[b'\n']], snapshot) is None
+
+
+class TestTopSellerArrayFilesVector(object):
+
+    def write_files(self, top_seller, tmpdir, files_sales):
+        top_seller._data_path = str(tmpdir)
+        for i, sales in enumerate(files_sales):
+            with GzipFile(str(tmpdir.join('{}.gz'.format(i))), 'w') as file_:
+                file_.writelines(build_reader(sales))
+
+    @pytest.mark.parametrize('processes', [1, 2, 3])
+    def test_if_files_vector_sums_partial_vectors(self, top_seller, snapshot,
+                                                  tmpdir, processes):
+        top_seller._engine_object['configuration'] = {'export_processes': processes}
+        self.write_files(top_seller, tmpdir, [[('1', 1)], [('1', 2), ('2', 3)], [('4', 4)]])
+        keys, values = top_seller._build_files_vector(snapshot)
+
+        assert keys.tolist() == [b'1', b'2', b'4']
+        assert values.tolist() == [3, 3, 4]
+
+    def test_if_files_vector_returns_none_without_files(self, top_seller, snapshot, tmpdir):
+        top_seller._engine_object['configuration'] = {'export_processes': 2}
+        top_seller._data_path = str(tmpdir)
+
+        assert top_seller._build_files_vector(snapshot) is None
+
+    def test_if_files_vector_closes_readers_with_one_process(self, top_seller, snapshot):
+        readers = [BytesIO(b''.join(build_reader([('1', 1)])))]
+        top_seller._build_csv_readers = lambda pattern, filenames: readers
+        keys, values = top_seller._build_files_vector(snapshot)
+
+        assert values.tolist() == [1]
+        assert readers[0].closed
+
+    def test_if_files_vector_raises_error_without_builder_and_processes(
+            self, top_seller, snapshot, tmpdir, monkeypatch):
+        monkeypatch.setattr(TopSellerArrayTest, '_build_partial_vector',
+                            EngineObjectBase._build_partial_vector)
+        top_seller._engine_object['configuration'] = {'export_processes': 2}
+        self.write_files(top_seller, tmpdir, [[('1', 1)], [('2', 2)]])
+
+        with pytest.raises(EngineError):
+            top_seller._build_files_vector(snapshot)
+
+    def test_if_last_reduction_keeps_last_written_values(self, top_seller):
+        top_seller.__export_reduction__ = 'last'
+        vector = EngineObjectBase._reduce_partial_vectors(top_seller, [
+            np.array([1, 2, 0], dtype=np.int32),
+            None,
+            np.array([0, 5, 6], dtype=np.int32)
+        ])
+
+        assert vector.tolist() == [1, 5, 6]
+
+    def test_if_last_reduction_keeps_whole_rows(self, top_seller):
+        top_seller.__export_reduction__ = 'last'
+        vector = EngineObjectBase._reduce_partial_vectors(top_seller, [
+            np.array([[1, 2], [3, 4]], dtype=np.int32),
+            np.array([[0, 5], [0, 0]], dtype=np.int32)
+        ])
+
+        assert vector.tolist() == [[0, 5], [3, 4]]
+
+
+class TestTopSellerArrayWindowVector(object):
+
+    @pytest.fixture
+    def top_seller(self, top_seller, tmpdir):
+        top_seller._data_path = str(tmpdir)
+        top_seller._get_today = lambda: date(2016, 10, 19)
+        top_seller._engine_object['configuration'] = {'days_interval': 2}
+
+        for day, sales in [('2016-10-17', [('1', 10)]),
+                           ('2016-10-18', [('1', 2), ('2', 4)]),
+                           ('2016-10-19', [('2', 1)])]:
+            with GzipFile(str(tmpdir.join('{}.gz'.format(day))), 'w') as file_:
+                file_.writelines(build_reader(sales))
+
+        return top_seller
+
+    def test_if_window_vector_sums_days_interval(self, top_seller, snapshot):
+        assert top_seller._build_window_vector(snapshot).tolist() == [2, 5, 0, 0]
+
+    def test_if_window_vector_decays_old_days(self, top_seller, snapshot):
+        top_seller._engine_object['configuration']['decay_half_life'] = 1
+
+        vector = top_seller._build_window_vector(snapshot)
+        assert vector.dtype == np.int32
+        assert vector.tolist() == [1, 3, 0, 0]
+
+    def test_if_window_vector_reuses_complete_days_aggregates(
+            self, top_seller, snapshot, tmpdir):
+        top_seller._build_window_vector(snapshot)
+        tmpdir.join('2016-10-18.gz').remove()
+
+        assert tmpdir.join('aggregates', '2016-10-18.npz').check()
+        assert not tmpdir.join('aggregates', '2016-10-19.npz').check()
+        assert top_seller._build_window_vector(snapshot).tolist() == [2, 5, 0, 0]
+
+    def test_if_window_vector_removes_aggregates_out_of_days_interval(
+            self, top_seller, snapshot, tmpdir):
+        top_seller._engine_object['configuration']['days_interval'] = 3
+        top_seller._build_window_vector(snapshot)
+        assert tmpdir.join('aggregates', '2016-10-17.npz').check()
+
+        top_seller._engine_object['configuration']['days_interval'] = 2
+        top_seller._build_window_vector(snapshot)
+        assert not tmpdir.join('aggregates', '2016-10-17.npz').check()
+        assert tmpdir.join('aggregates', '2016-10-18.npz').check()
+
+    def test_if_window_vector_maps_aggregated_items_added_later(
+            self, top_seller, snapshot_class):
+        top_seller._build_window_vector(snapshot_class.from_dict({b'1': 0}))
+        snapshot = snapshot_class.from_dict({b'1': 0, b'2': 1})
+
+        assert top_seller._build_window_vector(snapshot).tolist() == [2, 5]
+
+    def test_if_window_vector_reads_undated_files_once(self, top_seller, snapshot, tmpdir):
+        with GzipFile(str(tmpdir.join('top_seller-000000001.gz')), 'w') as file_:
+            file_.writelines(build_reader([('3', 1)]))
+
+        assert top_seller._build_window_vector(snapshot).tolist() == [2, 5, 0, 1]
+
+    def test_if_window_vector_reuses_one_process_pool(self, top_seller, snapshot, monkeypatch):
+        executor_class = mock.MagicMock(wraps=ProcessPoolExecutor)
+        monkeypatch.setattr(
+            'myreco.engine_objects.object_base.ProcessPoolExecutor', executor_class)
+        top_seller._engine_object['configuration']['export_processes'] = 2
+
+        assert top_seller._build_window_vector(snapshot).tolist() == [2, 5, 0, 0]
+        assert executor_class.call_count == 1
+
+
+class TestTopSellerArrayStorage(object):
+
+    @pytest.fixture
+    def session(self, top_seller, monkeypatch):
+        monkeypatch.setattr(TopSellerArray, '_arrays', {})
+        session = mock.MagicMock()
+        session.values = {}
+        session.gets = []
+
+        async def get(key):
+            session.gets.append(key)
+            return session.values.get(key)
+
+        session.redis_bind.get = get
+        return session
+
+    @pytest.mark.parametrize('pack', [
+        lambda top_seller, vector: top_seller._pack_chunked_array(vector),
+        lambda top_seller, vector: vector.tobytes()
+    ])
+    async def test_if_get_numpy_array_reads_chunked_and_raw_arrays(
+            self, top_seller, session, pack):
+        vector = np.arange(10, dtype=np.int32)
+        session.values[top_seller._redis_key] = pack(top_seller, vector)
+        numpy_array = await top_seller.get_numpy_array(session)
+
+        assert np.array_equal(numpy_array, vector)
+        assert numpy_array.flags.writeable
+
+    async def test_if_get_numpy_array_decompresses_once_by_version(self, top_seller, session):
+        session.values[top_seller._redis_key] = \
+            top_seller._pack_chunked_array(np.arange(10, dtype=np.int32))
+        session.values[top_seller._version_key] = b'1'
+        numpy_array = await top_seller.get_numpy_array(session)
+        numpy_array[0] = 10
+
+        assert (await top_seller.get_numpy_array(session)).tolist() == list(range(10))
+        assert session.gets.count(top_seller._redis_key) == 1
+
+        session.values[top_seller._redis_key] = \
+            top_seller._pack_chunked_array(np.ones(10, dtype=np.int32))
+        session.values[top_seller._version_key] = b'2'
+
+        assert (await top_seller.get_numpy_array(session)).tolist() == [1] * 10
+        assert session.gets.count(top_seller._redis_key) == 2
@@ -0,0 +1,103 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from unittest import mock
+
+import pytest
+from jsonschema import ValidationError
+from myreco.item_types.model import ItemValidator, build_item_validator
+from myreco.item_types.validator import CompiledValidator
+
+
+schema = {
+    'type': 'array',
+    'minItems': 1,
+    'items': {
+        'type': 'object',
+        'id_names': ['id'],
+        'required': ['id'],
+        'additionalProperties': False,
+        'properties': {
+            'id': {'type': 'integer', 'minimum': 0},
+            'name': {'type': 'string', 'minLength': 1, 'pattern': '^[a-z]+$'},
+            'price': {'type': ['number', 'null'], 'maximum': 10, 'exclusiveMaximum': True},
+            'tags': {'type': 'array', 'items': {'enum': ['a', 'b']}, 'uniqueItems': True},
+            'object': {'type': 'simpleObject'},
+            'kind': {'anyOf': [{'type': 'boolean'}, {'type': 'string', 'maxLength': 2}]}
+        }
+    }
+}
+
+valid_instances = [
+    [{'id': 1}],
+    [{'id': 0, 'name': 'abc', 'price': 9.9, 'tags': ['a', 'b'], 'object': {'a': 1}}],
+    [{'id': 1, 'price': None, 'kind': True}, {'id': 2, 'kind': 'ab'}]
+]
+
+invalid_instances = [
+    [],
+    [{}],
+    [{'id': True}],
+    [{'id': -1}],
+    [{'id': 1.0}],
+    [{'id': 1, 'name': ''}],
+    [{'id': 1, 'name': 'A'}],
+    [{'id': 1, 'price': 10}],
+    [{'id': 1, 'tags': ['a', 'a']}],
+    [{'id': 1, 'tags': ['c']}],
+    [{'id': 1, 'object': []}],
+    [{'id': 1, 'kind': 'abc'}],
+    [{'id': 1, 'other': 1}]
+]
+
+
+@pytest.fixture
+def validator():
+    return build_item_validator(schema)
+
+
+class TestCompiledValidator(object):
+
+    @pytest.mark.parametrize('instance', valid_instances)
+    def test_if_valid_instances_skip_full_validator(self, instance):
+        validator_class = mock.MagicMock()
+        CompiledValidator(schema, validator_class).validate(instance)
+        assert not validator_class.return_value.validate.called
+
+    @pytest.mark.parametrize('instance', invalid_instances)
+    def test_if_invalid_instances_raise_full_validator_error(self, validator, instance):
+        with pytest.raises(ValidationError) as compiled_error:
+            validator.validate(instance)
+
+        with pytest.raises(ValidationError) as full_error:
+            ItemValidator(schema).validate(instance)
+
+        assert compiled_error.value.message == full_error.value.message
+        assert compiled_error.value.path == full_error.value.path
+
+    def test_if_unsupported_schema_uses_full_validator(self):
+        validator_class = mock.MagicMock()
+        validator = CompiledValidator({'not': {'type': 'string'}}, validator_class)
+        validator.validate(1)
+
+        assert validator_class.return_value.validate.call_args_list == [mock.call(1)]
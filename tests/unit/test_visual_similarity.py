@@ -0,0 +1,188 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra <dutradda@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from unittest import mock
+
+import numpy as np
+import pytest
+from myreco.engine_strategies.visual_similarity.index import IVFIndex, VisualSimilarityIndex
+
+import ujson
+
+
+@pytest.fixture
+def embeddings():
+    random_state = np.random.RandomState(0)
+    centers = random_state.normal(size=(4, 16))
+    embeddings = np.repeat(centers, 50, axis=0) + random_state.normal(scale=0.1, size=(200, 16))
+    embeddings[10] = 0
+    return embeddings.astype(np.float32)
+
+
+@pytest.fixture
+def index(embeddings):
+    return IVFIndex.build(embeddings, lists=4, train_size=200, iterations=5)
+
+
+def cosine_scores(embeddings, seeds):
+    norms = np.linalg.norm(embeddings, axis=1)
+    vectors = embeddings / np.where(norms, norms, 1)[:, None]
+    query = vectors[seeds].sum(axis=0)
+    return vectors.dot(query / np.linalg.norm(query))
+
+
+def build_reader(embeddings):
+    return [ujson.dumps({'item_key': key, 'embedding': embedding}).encode()
+            for key, embedding in embeddings]
+
+
+class TestIVFIndex(object):
+
+    def test_if_build_skips_items_without_embeddings(self, index):
+        assert index.positions[10] == -1
+        assert index.items_indices.size == 199
+        assert index.lists_offsets[-1] == 199
+
+    def test_if_all_probes_gives_exact_scores(self, index, embeddings):
+        scores = index.get_scores([0, 60], probes=4)
+        expected = cosine_scores(embeddings, [0, 60])
+        expected[[0, 60, 10]] = 0
+
+        assert np.allclose(scores, expected, atol=1e-5)
+
+    def test_if_one_probe_finds_the_nearest_items(self, index, embeddings):
+        scores = index.get_scores([0], probes=1)
+        expected = cosine_scores(embeddings, [0])
+        expected[[0, 10]] = 0
+
+        assert set(np.argsort(-scores)[:10]) == set(np.argsort(-expected)[:10])
+        assert np.count_nonzero(scores) < 199
+
+    def test_if_load_maps_saved_index(self, index, tmpdir):
+        path = str(tmpdir.join('ivf_v1'))
+        index.save(path)
+        loaded = IVFIndex.load(path, 1)
+
+        assert loaded.version == 1
+        assert isinstance(loaded.vectors, np.memmap)
+        assert np.array_equal(loaded.get_scores([0], 2), index.get_scores([0], 2))
+
+
+class TestVisualSimilarityIndex(object):
+
+    @pytest.fixture
+    def visual_index(self, tmpdir):
+        visual_index = VisualSimilarityIndex({
+            'id': 1,
+            'name': 'test',
+            'type': 'visual_similarity_index',
+            'strategy': {'name': 'visual_similarity'},
+            'configuration': {'lists': 2, 'probes': 2}
+        })
+        visual_index._data_path = str(tmpdir.join(visual_index._redis_key))
+        return visual_index
+
+    @pytest.fixture
+    def snapshot(self):
+        from myreco.item_types.indices_map import ItemsIndicesSnapshot
+        return ItemsIndicesSnapshot.from_dict({b'1': 0, b'2': 2})
+
+    def test_if_partial_vector_has_rows_of_mapped_items(self, visual_index, snapshot):
+        indices, rows = visual_index._build_partial_vector(
+            [build_reader([('1', [1, 1]), ('2', [2, 1]), ('3', [3, 1])])], snapshot)
+
+        assert indices.tolist() == [0, 2]
+        assert rows.tolist() == [[1, 1], [2, 1]]
+        assert visual_index._build_embeddings(3, indices, rows).tolist() == \
+            [[1, 1], [0, 0], [2, 1]]
+
+    def test_if_partial_vectors_keep_last_written_rows(self, visual_index, snapshot):
+        indices, rows = visual_index._reduce_partial_vectors([
+            visual_index._build_partial_vector(
+                [build_reader([('1', [1, 1]), ('2', [2, 2])])], snapshot),
+            None,
+            visual_index._build_partial_vector(
+                [build_reader([('1', [0, 5]), ('3', [3, 3])])], snapshot)
+        ])
+
+        assert indices.tolist() == [0, 2]
+        assert rows.tolist() == [[0, 5], [2, 2]]
+
+    async def test_if_items_vector_loads_exported_index(
+            self, visual_index, index, tmpdir, monkeypatch):
+        monkeypatch.setattr(VisualSimilarityIndex, '_indices', {})
+        index.save(visual_index._build_index_path(visual_index._data_path, 3))
+        session = mock.MagicMock()
+        version = [b'3']
+
+        async def get(key):
+            return version[0]
+
+        session.redis_bind.get = get
+        items_model = mock.MagicMock(__data_path__=str(tmpdir))
+        vector = await visual_index.get_items_vector(session, [0], items_model)
+
+        assert np.array_equal(vector, index.get_scores([0], 2))
+
+        version[0] = b'4'
+        assert await visual_index.get_items_vector(session, [0], items_model) is None
+
+    async def test_if_remap_indices_publishes_remapped_index_after_commit(
+            self, visual_index, index, tmpdir):
+        from myreco.item_types.indices_map import (ItemsIndicesCompaction,
+                                                   ItemsIndicesSnapshot)
+        index.save(visual_index._build_index_path(visual_index._data_path, 3))
+        snapshot = ItemsIndicesSnapshot.from_dict(
+            {str(i).encode(): i for i in range(200) if i not in (5, 60)})
+        compaction = ItemsIndicesCompaction(snapshot)
+        session = mock.MagicMock()
+        transaction = mock.MagicMock()
+        sets = []
+
+        async def get(key):
+            return b'3'
+
+        async def incr(key):
+            return 4
+
+        async def set_(key, value):
+            sets.append((key, value))
+
+        session.redis_bind.get = get
+        session.redis_bind.incr = incr
+        session.redis_bind.set = set_
+        reclaimed = await visual_index.remap_indices(session, transaction, compaction)
+        remapped_path = visual_index._build_index_path(visual_index._data_path, 4)
+
+        assert not transaction.method_calls
+        assert not tmpdir.join(visual_index._redis_key, 'ivf_v4').check()
+
+        await visual_index.publish_remapped_indices(session)
+        remapped = IVFIndex.load(remapped_path)
+        expected = index.get_scores([0, 70], 4)
+
+        assert sets == [(visual_index._redis_key, 4)]
+        assert reclaimed > 0
+        assert remapped.positions.size == 198
+        assert remapped.items_indices.size == 197
+        assert np.allclose(remapped.get_scores([0, 68], 4), np.delete(expected, [5, 60]))